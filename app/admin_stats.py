@@ -0,0 +1,109 @@
+# Platform-wide statistics for the admin home page.
+# Every figure comes from a grouped aggregate, so one refresh is a handful of
+# queries regardless of table size. The result is cached for ADMIN_STATS_TTL
+# seconds; once stale it is still served while a background thread
+# recomputes it. The cache is filled on startup, so requests never wait on
+# the aggregates.
+
+import os
+import time
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import User, Course, StudentCourseEnrollment, StudentLessonProgress
+
+ADMIN_STATS_TTL = int(os.getenv("ADMIN_STATS_TTL", "60"))
+ACTIVE_LEARNER_DAYS = 7
+
+_cached = None  # (stats, computed_at monotonic)
+_lock = threading.Lock()
+_refreshing = threading.Event()
+
+
+def compute_stats(db: Session):
+    users_by_role = {}
+    teachers_by_status = {}
+    for role, teacher_status, count in db.query(
+        User.role, User.teacher_status, func.count(User.id)
+    ).group_by(User.role, User.teacher_status).all():
+        users_by_role[role] = users_by_role.get(role, 0) + count
+        if role == "teacher":
+            status = teacher_status or "pending"
+            teachers_by_status[status] = teachers_by_status.get(status, 0) + count
+
+    students_by_board = {}
+    students_by_class = {}
+    for board, student_class, count in db.query(
+        User.board, User.student_class, func.count(User.id)
+    ).filter(User.role.in_(["student", "user"])).group_by(User.board, User.student_class).all():
+        students_by_board[board or "Unknown"] = students_by_board.get(board or "Unknown", 0) + count
+        students_by_class[student_class or "Unknown"] = students_by_class.get(student_class or "Unknown", 0) + count
+
+    courses_by_board = dict(db.query(
+        func.coalesce(Course.target_board, "All"), func.count(Course.id)
+    ).group_by(func.coalesce(Course.target_board, "All")).all())
+
+    enrollments_by_status = dict(db.query(
+        StudentCourseEnrollment.status, func.count(StudentCourseEnrollment.id)
+    ).group_by(StudentCourseEnrollment.status).all())
+
+    active_since = datetime.utcnow() - timedelta(days=ACTIVE_LEARNER_DAYS)
+    active_learners = db.query(func.count(func.distinct(StudentLessonProgress.student_id))).filter(
+        StudentLessonProgress.last_accessed >= active_since
+    ).scalar()
+
+    return {
+        "users": {"total": sum(users_by_role.values()), "by_role": users_by_role},
+        "teachers_by_status": teachers_by_status,
+        "students": {
+            "total": sum(students_by_board.values()),
+            "by_board": students_by_board,
+            "by_class": students_by_class,
+        },
+        "courses": {"total": sum(courses_by_board.values()), "by_board": courses_by_board},
+        "enrollments": {"total": sum(enrollments_by_status.values()), "by_status": enrollments_by_status},
+        "active_learners_7d": active_learners or 0,
+        "generated_at": datetime.utcnow(),
+    }
+
+
+def refresh():
+    global _cached
+    db = SessionLocal()
+    try:
+        stats = compute_stats(db)
+        with _lock:
+            _cached = (stats, time.monotonic())
+        return stats
+    finally:
+        db.close()
+
+
+def _background_refresh():
+    try:
+        refresh()
+    except Exception as e:
+        print(f"Admin stats refresh failed: {e}")
+    finally:
+        _refreshing.clear()
+
+
+def get_stats():
+    """Cached stats plus whether they are past their TTL"""
+    with _lock:
+        cached = _cached
+        if cached is None:
+            start_refresh = False
+        else:
+            stale = time.monotonic() - cached[1] >= ADMIN_STATS_TTL
+            start_refresh = stale and not _refreshing.is_set()
+            if start_refresh:
+                _refreshing.set()
+    if cached is None:
+        return refresh(), False
+
+    if start_refresh:
+        threading.Thread(target=_background_refresh, name="admin-stats-refresh", daemon=True).start()
+    return cached[0], stale
@@ -0,0 +1,244 @@
+# Priority-aware admission control.
+# Every HTTP request is put in a priority class by method and path. The
+# process admits at most ADMISSION_CAPACITY requests at once, and each class
+# may only fill its share of that capacity, so low-priority work (admin
+# listings, exports, bulk operations) always leaves room for logins and
+# student playback. A request that finds its class full waits in a queue,
+# and freed slots go to the highest-priority waiter first.
+# A request that waits longer than its class's budget gets 503 with
+# Retry-After. While the recent queueing delay is above ADMISSION_TARGET_MS,
+# low-priority requests are shed on arrival instead of queueing.
+# Long-lived streams (SSE) bypass the gate. So does the /batch envelope:
+# its sub-requests skip the middleware, so run_batch_item classifies and
+# gates each one through admitted().
+
+import os
+import re
+import math
+import time
+import asyncio
+from collections import deque
+from contextlib import asynccontextmanager
+
+ADMISSION_CAPACITY = int(os.getenv("ADMISSION_CAPACITY", "40"))
+ADMISSION_TARGET_MS = float(os.getenv("ADMISSION_TARGET_MS", "100"))
+ADMISSION_MAX_QUEUE = int(os.getenv("ADMISSION_MAX_QUEUE", "200"))
+DELAY_SAMPLES = 512
+EWMA_WEIGHT = 0.1
+# The queueing-delay average halves every second without new samples, so
+# shedding stops once the queue has drained even if only shed traffic arrives
+DELAY_HALF_LIFE = 1.0
+
+# name -> (share of capacity, longest wait in seconds); highest priority first
+CLASSES = {
+    "critical": (1.0, 5.0),
+    "normal": (0.8, 2.0),
+    "low": (0.3, 0.5),
+}
+
+# First match wins; anything unmatched is "normal"
+ROUTE_CLASSES = [
+    ("exempt", None, re.compile(r"/(student|teacher/courses/\d+)/enrollment-events$")),
+    ("exempt", "POST", re.compile(r"/batch$")),
+    ("critical", None, re.compile(r"/$")),
+    ("critical", "POST", re.compile(r"/(login|token/refresh|logout)$")),
+    ("critical", "GET", re.compile(r"/media/hls/")),
+    ("critical", "POST", re.compile(r"/student/lessons/\d+/progress$")),
+    ("critical", "GET", re.compile(r"/admin/admission$")),
+    ("low", None, re.compile(r"/admin/")),
+    ("low", "POST", re.compile(r"/courses/\d+/enrollment/bulk$")),
+    ("low", "POST", re.compile(r"/teacher/courses/\d+/clone$")),
+    ("low", "GET", re.compile(r"/teacher/courses/\d+/exports/")),
+]
+
+
+def classify(method: str, path: str):
+    for name, route_method, pattern in ROUTE_CLASSES:
+        if (route_method is None or route_method == method) and pattern.match(path):
+            return name
+    return "normal"
+
+
+class ClassStats:
+    def __init__(self):
+        self.in_flight = 0
+        self.admitted = 0
+        self.shed = 0
+        self.delays = deque(maxlen=DELAY_SAMPLES)
+        self.service_ewma = 0.0
+
+    def snapshot(self, queued: int):
+        delays = sorted(self.delays)
+        return {
+            "in_flight": self.in_flight,
+            "queued": queued,
+            "admitted": self.admitted,
+            "shed": self.shed,
+            "queue_delay_p50_ms": round(delays[len(delays) // 2] * 1000, 1) if delays else 0,
+            "queue_delay_p95_ms": round(delays[max(0, int(len(delays) * 0.95) - 1)] * 1000, 1) if delays else 0,
+            "service_ms": round(self.service_ewma * 1000, 1),
+        }
+
+
+class AdmissionController:
+    """Slot accounting for one process; all methods run on the event loop"""
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.limits = {name: max(1, math.floor(capacity * share)) for name, (share, _) in CLASSES.items()}
+        self.in_flight = 0
+        self.delay_ewma = 0.0
+        self.delay_updated = time.monotonic()
+        self.stats = {name: ClassStats() for name in CLASSES}
+        self.waiters = {name: deque() for name in CLASSES}
+
+    def queue_delay(self):
+        elapsed = time.monotonic() - self.delay_updated
+        return self.delay_ewma * 0.5 ** (elapsed / DELAY_HALF_LIFE)
+
+    def overloaded(self):
+        return self.queue_delay() * 1000 > ADMISSION_TARGET_MS
+
+    def can_admit(self, name: str):
+        return self.in_flight < self.limits[name]
+
+    def queued(self):
+        return sum(len(w) for w in self.waiters.values())
+
+    def retry_after(self):
+        """Seconds until the current queue should have drained, at least 1"""
+        service = max(s.service_ewma for s in self.stats.values()) or 0.1
+        return max(1, min(30, math.ceil(self.queued() * service / self.capacity + self.queue_delay())))
+
+    def record_delay(self, name: str, delay: float):
+        self.stats[name].delays.append(delay)
+        current = self.queue_delay()
+        self.delay_ewma = current + EWMA_WEIGHT * (delay - current)
+        self.delay_updated = time.monotonic()
+
+    def _take(self, name: str):
+        self.in_flight += 1
+        self.stats[name].in_flight += 1
+        self.stats[name].admitted += 1
+
+    async def acquire(self, name: str):
+        """True once a slot is held, False if the request should be shed"""
+        if (name == "low" and self.overloaded()) or self.queued() >= ADMISSION_MAX_QUEUE:
+            self.stats[name].shed += 1
+            return False
+        if self.can_admit(name) and not any(self.waiters[n] for n in self.higher_or_equal(name)):
+            self._take(name)
+            self.record_delay(name, 0.0)
+            return True
+
+        waiter = asyncio.get_running_loop().create_future()
+        self.waiters[name].append(waiter)
+        started = time.monotonic()
+        try:
+            await asyncio.wait_for(asyncio.shield(waiter), timeout=CLASSES[name][1])
+        except asyncio.TimeoutError:
+            if waiter.done():
+                # Granted just as the wait ran out; keep the slot
+                self.record_delay(name, time.monotonic() - started)
+                return True
+            waiter.cancel()
+            self.waiters[name].remove(waiter)
+            self.stats[name].shed += 1
+            self.record_delay(name, time.monotonic() - started)
+            return False
+        except BaseException:
+            # Client went away while queued; give back a slot granted meanwhile
+            if waiter.done() and not waiter.cancelled():
+                self.release(name, 0.0)
+            elif waiter in self.waiters[name]:
+                self.waiters[name].remove(waiter)
+            raise
+        self.record_delay(name, time.monotonic() - started)
+        return True
+
+    def higher_or_equal(self, name: str):
+        names = list(CLASSES)
+        return names[:names.index(name) + 1]
+
+    def release(self, name: str, service_seconds: float):
+        self.in_flight -= 1
+        stats = self.stats[name]
+        stats.in_flight -= 1
+        stats.service_ewma += EWMA_WEIGHT * (service_seconds - stats.service_ewma)
+        # Hand freed slots to waiters, highest priority first
+        for waiting in CLASSES:
+            queue = self.waiters[waiting]
+            while queue and self.can_admit(waiting):
+                waiter = queue.popleft()
+                if not waiter.done():
+                    self._take(waiting)
+                    waiter.set_result(True)
+
+    def metrics(self):
+        return {
+            "capacity": self.capacity,
+            "limits": self.limits,
+            "in_flight": self.in_flight,
+            "queue_delay_ewma_ms": round(self.queue_delay() * 1000, 1),
+            "target_ms": ADMISSION_TARGET_MS,
+            "overloaded": self.overloaded(),
+            "classes": {name: s.snapshot(len(self.waiters[name])) for name, s in self.stats.items()},
+        }
+
+
+controller = AdmissionController(ADMISSION_CAPACITY) if ADMISSION_CAPACITY > 0 else None
+
+
+class Shed(Exception):
+    """The request was refused a slot; retry_after is the suggested wait in seconds"""
+
+    def __init__(self, retry_after: int):
+        super().__init__(retry_after)
+        self.retry_after = retry_after
+
+
+@asynccontextmanager
+async def admitted(method: str, path: str):
+    """Hold a slot of the request's class for the body of the block; raises Shed if refused"""
+    name = classify(method, path) if controller is not None else "exempt"
+    if name == "exempt":
+        yield
+        return
+    if not await controller.acquire(name):
+        raise Shed(controller.retry_after())
+    started = time.monotonic()
+    try:
+        yield
+    finally:
+        controller.release(name, time.monotonic() - started)
+
+
+class AdmissionMiddleware:
+    """Gate requests through the controller; a no-op when ADMISSION_CAPACITY is 0"""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        try:
+            async with admitted(scope["method"], scope["path"]):
+                await self.app(scope, receive, send)
+        except Shed as e:
+            # Only raised before the app runs; gated work inside the app handles its own
+            await self.reject(send, e.retry_after)
+
+    async def reject(self, send, retry_after: int):
+        body = b'{"detail":"Server is busy, retry later"}'
+        await send({
+            "type": "http.response.start",
+            "status": 503,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"retry-after", str(retry_after).encode()),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
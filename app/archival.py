@@ -0,0 +1,315 @@
+# Hot/cold archival of lesson progress and finished enrollments.
+# Moves rows older than ARCHIVE_AFTER_DAYS into compact archive tables in
+# ARCHIVE_BATCH_SIZE chunks, one short transaction each, so the hot tables and
+# their indexes only hold what dashboards actually read:
+#   - enrollments that are no longer pending or approved (e.g. rejected)
+#   - progress on completed lessons, and progress in courses the student is
+#     no longer enrolled in
+# Read paths that need history (progress totals, enrollment checks, exports)
+# also look in the archive tables. A progress write for an archived lesson
+# moves the row back first.
+#
+# Run from cron:  python -m app.archival [--optimize]
+# Or from the admin API, which queues an ArchiveJob and runs it in the background.
+
+import sys
+import os
+import json
+from datetime import datetime, timedelta
+from sqlalchemy import func, text, bindparam, and_, or_, exists
+from sqlalchemy.orm import Session
+from .database import SessionLocal, DATABASE_URL
+from .models import (
+    CourseModule, CourseLesson, StudentCourseEnrollment, StudentLessonProgress,
+    LessonProgressArchive, EnrollmentArchive, ArchiveJob,
+)
+from . import sync
+
+ARCHIVE_AFTER_DAYS = int(os.getenv("ARCHIVE_AFTER_DAYS", "180"))
+ARCHIVE_BATCH_SIZE = int(os.getenv("ARCHIVE_BATCH_SIZE", "1000"))
+ACTIVE_ENROLLMENT_STATUSES = ("pending", "approved")
+# A job still running after this long is assumed dead and no longer blocks a new one
+ARCHIVE_JOB_TIMEOUT = timedelta(hours=6)
+REPORTED_TABLES = (
+    "lesson_progress", "student_enrollments", "lesson_progress_archive", "student_enrollments_archive",
+)
+
+
+def archivable_enrollments(cutoff: datetime):
+    return and_(
+        StudentCourseEnrollment.status.notin_(ACTIVE_ENROLLMENT_STATUSES),
+        StudentCourseEnrollment.enrolled_at < cutoff,
+    )
+
+
+def archivable_progress(cutoff: datetime):
+    still_enrolled = exists().where(
+        StudentCourseEnrollment.student_id == StudentLessonProgress.student_id,
+        StudentCourseEnrollment.course_id == CourseModule.course_id,
+        StudentCourseEnrollment.status == "approved",
+    )
+    return and_(
+        or_(StudentLessonProgress.last_accessed < cutoff, StudentLessonProgress.last_accessed.is_(None)),
+        or_(StudentLessonProgress.completed == 1, ~still_enrolled),
+    )
+
+
+def archive_enrollment_batch(db: Session, cutoff: datetime):
+    rows = db.query(StudentCourseEnrollment).filter(
+        archivable_enrollments(cutoff)
+    ).order_by(StudentCourseEnrollment.id).limit(ARCHIVE_BATCH_SIZE).all()
+    if not rows:
+        return 0
+
+    now = datetime.utcnow()
+    db.bulk_insert_mappings(EnrollmentArchive, [
+        {
+            "id": e.id,
+            "student_id": e.student_id,
+            "course_id": e.course_id,
+            "status": e.status,
+            "enrolled_at": e.enrolled_at,
+            "archived_at": now,
+        }
+        for e in rows
+    ])
+    # Offline clients should drop archived enrollments like deleted ones
+    sync.record_bulk_tombstones(db, StudentCourseEnrollment.__tablename__, [
+        (e.id, e.course_id, e.student_id) for e in rows
+    ])
+    db.query(StudentCourseEnrollment).filter(
+        StudentCourseEnrollment.id.in_([e.id for e in rows])
+    ).delete(synchronize_session=False)
+    db.commit()
+    return len(rows)
+
+
+def archive_progress_batch(db: Session, cutoff: datetime, after_id: int):
+    """Returns (rows moved, last id seen); last id is None when nothing is left"""
+    rows = db.query(StudentLessonProgress).join(
+        CourseLesson, StudentLessonProgress.lesson_id == CourseLesson.id
+    ).join(
+        CourseModule, CourseLesson.module_id == CourseModule.id
+    ).filter(
+        StudentLessonProgress.id > after_id, archivable_progress(cutoff)
+    ).order_by(StudentLessonProgress.id).limit(ARCHIVE_BATCH_SIZE).all()
+    if not rows:
+        return 0, None
+
+    # Fold duplicates and any row already in the archive into one row per key
+    merged = {}
+    for p in rows:
+        key = (p.student_id, p.lesson_id)
+        merged[key] = merge_progress(merged.get(key), p.watched_seconds, p.completed, p.last_accessed)
+    existing = db.query(LessonProgressArchive).filter(
+        LessonProgressArchive.student_id.in_({k[0] for k in merged}),
+        LessonProgressArchive.lesson_id.in_({k[1] for k in merged}),
+    ).all()
+    for a in existing:
+        key = (a.student_id, a.lesson_id)
+        if key in merged:
+            merged[key] = merge_progress(merged[key], a.watched_seconds, a.completed, a.last_accessed)
+            db.delete(a)
+    db.flush()
+
+    now = datetime.utcnow()
+    db.bulk_insert_mappings(LessonProgressArchive, [
+        {
+            "student_id": student_id,
+            "lesson_id": lesson_id,
+            "watched_seconds": watched,
+            "completed": completed,
+            "last_accessed": last_accessed,
+            "archived_at": now,
+        }
+        for (student_id, lesson_id), (watched, completed, last_accessed) in merged.items()
+    ])
+    ids = [p.id for p in rows]
+    db.query(StudentLessonProgress).filter(StudentLessonProgress.id.in_(ids)).delete(synchronize_session=False)
+    db.commit()
+    return len(rows), ids[-1]
+
+
+def merge_progress(current, watched, completed, last_accessed):
+    if current is None:
+        return (watched or 0, completed or 0, last_accessed)
+    latest = max((t for t in (current[2], last_accessed) if t is not None), default=None)
+    return (max(current[0], watched or 0), max(current[1], completed or 0), latest)
+
+
+def restore_progress(db: Session, student_id: int, lesson_id: int):
+    """Move an archived progress row back into lesson_progress; the caller commits"""
+    archived = db.query(LessonProgressArchive).filter(
+        LessonProgressArchive.student_id == student_id, LessonProgressArchive.lesson_id == lesson_id
+    ).first()
+    if not archived:
+        return None
+    progress = StudentLessonProgress(
+        student_id=student_id,
+        lesson_id=lesson_id,
+        watched_seconds=archived.watched_seconds,
+        completed=archived.completed,
+        last_accessed=archived.last_accessed,
+        # The archive keeps no event times; date them before the rollup watermark so
+        # a restored row is not counted as a new start or completion
+        started_at=archived.last_accessed,
+        completed_at=archived.last_accessed if archived.completed else None,
+    )
+    db.add(progress)
+    db.delete(archived)
+    return progress
+
+
+def archived_completed_count(db: Session, student_id: int, lesson_ids):
+    return db.query(func.count()).select_from(LessonProgressArchive).filter(
+        LessonProgressArchive.student_id == student_id,
+        LessonProgressArchive.completed == 1,
+        LessonProgressArchive.lesson_id.in_(lesson_ids),
+    ).scalar()
+
+
+def archived_enrollment(db: Session, student_id: int, course_id: int):
+    return db.query(EnrollmentArchive).filter(
+        EnrollmentArchive.student_id == student_id, EnrollmentArchive.course_id == course_id
+    ).order_by(EnrollmentArchive.id.desc()).first()
+
+
+def table_sizes(db: Session):
+    """{table: {"rows", "data_bytes", "index_bytes"}} for the hot and archive tables"""
+    sizes = {}
+    if DATABASE_URL.startswith("sqlite"):
+        try:
+            pages = dict(db.execute(text("SELECT name, SUM(pgsize) FROM dbstat GROUP BY name")).all())
+        except Exception:
+            pages = {}
+        indexes = db.execute(text(
+            "SELECT name, tbl_name FROM sqlite_master WHERE type = 'index'"
+        )).all()
+        for table in REPORTED_TABLES:
+            sizes[table] = {
+                "rows": db.execute(text(f"SELECT COUNT(*) FROM {table}")).scalar(),
+                "data_bytes": pages.get(table),
+                "index_bytes": sum(pages.get(name) or 0 for name, tbl in indexes if tbl == table) if pages else None,
+            }
+        return sizes
+
+    for table in REPORTED_TABLES:
+        # Refresh InnoDB's estimates so the before/after numbers mean something
+        db.execute(text(f"ANALYZE TABLE {table}")).all()
+    rows = db.execute(text(
+        "SELECT table_name, table_rows, data_length, index_length FROM information_schema.tables "
+        "WHERE table_schema = DATABASE() AND table_name IN :tables"
+    ).bindparams(bindparam("tables", value=list(REPORTED_TABLES), expanding=True))).all()
+    for table, row_count, data_bytes, index_bytes in rows:
+        sizes[table] = {"rows": row_count, "data_bytes": data_bytes, "index_bytes": index_bytes}
+    return sizes
+
+
+def optimize_tables(db: Session):
+    """Give freed pages back to the filesystem; rewrites the tables, so run off-peak"""
+    if DATABASE_URL.startswith("sqlite"):
+        db.commit()
+        with db.get_bind().connect() as connection:
+            connection.exec_driver_sql("VACUUM")
+    else:
+        for table in ("lesson_progress", "student_enrollments"):
+            db.execute(text(f"OPTIMIZE TABLE {table}")).all()
+        db.commit()
+
+
+def size_changes(before, after):
+    changes = {}
+    for table in REPORTED_TABLES:
+        b, a = before.get(table, {}), after.get(table, {})
+        changes[table] = {
+            key: (a.get(key) - b.get(key)) if a.get(key) is not None and b.get(key) is not None else None
+            for key in ("rows", "data_bytes", "index_bytes")
+        }
+    return changes
+
+
+def run_archival(db: Session = None, optimize: bool = False, max_batches: int = None):
+    """Archive everything eligible and report what moved and how sizes changed"""
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        cutoff = datetime.utcnow() - timedelta(days=ARCHIVE_AFTER_DAYS)
+        before = table_sizes(db)
+        db.commit()
+
+        batches = 0
+        enrollments_moved = 0
+        while max_batches is None or batches < max_batches:
+            moved = archive_enrollment_batch(db, cutoff)
+            if not moved:
+                break
+            enrollments_moved += moved
+            batches += 1
+
+        progress_moved = 0
+        after_id = 0
+        while max_batches is None or batches < max_batches:
+            moved, after_id = archive_progress_batch(db, cutoff, after_id)
+            if after_id is None:
+                break
+            progress_moved += moved
+            batches += 1
+
+        if optimize:
+            optimize_tables(db)
+        after = table_sizes(db)
+        db.commit()
+
+        return {
+            "cutoff": cutoff,
+            "batches": batches,
+            "enrollments_archived": enrollments_moved,
+            "progress_archived": progress_moved,
+            "optimized": optimize,
+            "before": before,
+            "after": after,
+            "change": size_changes(before, after),
+        }
+    finally:
+        if own_session:
+            db.close()
+
+
+def active_job(db: Session):
+    """The queued or running ArchiveJob, if one started within ARCHIVE_JOB_TIMEOUT"""
+    return db.query(ArchiveJob).filter(
+        ArchiveJob.status.in_(("queued", "running")),
+        ArchiveJob.created_at > datetime.utcnow() - ARCHIVE_JOB_TIMEOUT,
+    ).first()
+
+
+def run_archive_job(job_id: int):
+    """Background entry point: run archival for an ArchiveJob row and store its report"""
+    db = SessionLocal()
+    try:
+        job = db.query(ArchiveJob).filter(ArchiveJob.id == job_id).first()
+        if not job:
+            return
+        job.status = "running"
+        db.commit()
+
+        try:
+            report = run_archival(db, optimize=bool(job.optimize), max_batches=job.max_batches)
+            job.report = json.dumps(report, default=str)
+            job.status = "done"
+        except Exception as e:
+            db.rollback()
+            job.status = "failed"
+            job.error = str(e)
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
+
+
+if __name__ == "__main__":
+    report = run_archival(optimize="--optimize" in sys.argv)
+    print(f"Archived {report['enrollments_archived']} enrollments and {report['progress_archived']} progress rows "
+          f"in {report['batches']} batches (cutoff {report['cutoff']:%Y-%m-%d})")
+    for table, change in report["change"].items():
+        print(f"  {table:<30} rows {change['rows']:+}  data {change['data_bytes'] or 0:+} B  index {change['index_bytes'] or 0:+} B")
@@ -0,0 +1,220 @@
+# Audit trail for admin actions and teacher enrollment decisions.
+# record() only puts the event on a bounded in-process queue. A background
+# thread writes queued events with one bulk insert per AUDIT_BATCH_SIZE events
+# or every AUDIT_FLUSH_SECONDS, whichever comes first, so the request that
+# made the change does no extra write.
+# Events that cannot reach the table are appended to AUDIT_SPOOL_PATH as JSON
+# lines: when the queue is full, when a flush fails, and when the queue cannot
+# be drained at shutdown. The spool is loaded back into the table on startup;
+# lines cut off by a crash mid-write are skipped.
+
+import os
+import glob
+import json
+import time
+import queue
+import secrets
+import threading
+from datetime import datetime
+from .database import SessionLocal
+from .models import AuditEvent
+
+AUDIT_QUEUE_SIZE = int(os.getenv("AUDIT_QUEUE_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.getenv("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_SECONDS = float(os.getenv("AUDIT_FLUSH_SECONDS", "2"))
+AUDIT_SPOOL_PATH = os.getenv("AUDIT_SPOOL_PATH", "./audit-spool.jsonl")
+
+_queue = queue.Queue(maxsize=AUDIT_QUEUE_SIZE)
+_stop = threading.Event()
+_spool_lock = threading.Lock()
+_flusher = None
+
+
+def record(actor, action: str, target_type: str, target_id: int = None, **details):
+    """Queue an audit event; actor is a User or the admin token payload. Never blocks."""
+    if isinstance(actor, dict):
+        actor_id, actor_role, actor_email = 0, actor.get("role", "admin"), actor.get("email")
+    else:
+        actor_id, actor_role, actor_email = actor.id, actor.role, actor.email
+    event = {
+        "actor_id": actor_id,
+        "actor_role": actor_role,
+        "actor_email": actor_email,
+        "action": action,
+        "target_type": target_type,
+        "target_id": target_id,
+        "details": json.dumps(details, default=str) if details else None,
+        "created_at": datetime.utcnow(),
+    }
+    try:
+        _queue.put_nowait(event)
+    except queue.Full:
+        spool([event])
+
+
+def spool(events):
+    """Append events to the spool file and fsync it"""
+    lines = "".join(
+        json.dumps({**e, "created_at": e["created_at"].isoformat()}) + "\n" for e in events
+    )
+    with _spool_lock:
+        with open(AUDIT_SPOOL_PATH, "a") as f:
+            f.write(lines)
+            f.flush()
+            os.fsync(f.fileno())
+
+
+def write_batch(events):
+    db = SessionLocal()
+    try:
+        db.bulk_insert_mappings(AuditEvent, events)
+        db.commit()
+    finally:
+        db.close()
+
+
+def flush_batch(events):
+    try:
+        write_batch(events)
+    except Exception as e:
+        print(f"Audit flush failed, spooling {len(events)} events: {e}")
+        spool(events)
+
+
+def take_batch(wait: float):
+    """Block up to wait for a first event, then collect more for up to AUDIT_FLUSH_SECONDS"""
+    try:
+        batch = [_queue.get(timeout=wait)]
+    except queue.Empty:
+        return []
+    deadline = time.monotonic() + AUDIT_FLUSH_SECONDS
+    while len(batch) < AUDIT_BATCH_SIZE:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0 or _stop.is_set():
+            break
+        try:
+            batch.append(_queue.get(timeout=remaining))
+        except queue.Empty:
+            break
+    return batch
+
+
+def flusher_loop():
+    while not _stop.is_set():
+        batch = take_batch(AUDIT_FLUSH_SECONDS)
+        if batch:
+            flush_batch(batch)
+
+
+def drain():
+    """Write everything still queued, in batches; returns how many events were taken"""
+    taken = 0
+    while True:
+        batch = []
+        try:
+            while len(batch) < AUDIT_BATCH_SIZE:
+                batch.append(_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if not batch:
+            return taken
+        flush_batch(batch)
+        taken += len(batch)
+
+
+def read_spool(path: str):
+    """Parse a spool file, skipping lines that are not whole events (e.g. cut off by a crash)"""
+    events, skipped = [], 0
+    with open(path) as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                event = json.loads(line)
+                event["created_at"] = datetime.fromisoformat(event["created_at"])
+            except (ValueError, TypeError, KeyError):
+                skipped += 1
+                continue
+            events.append(event)
+    if skipped:
+        print(f"Skipped {skipped} malformed line(s) in audit spool {path}")
+    return events
+
+
+def replay_file(claimed: str):
+    """Load one claimed spool file into the table and remove it; returns how many were loaded"""
+    events = read_spool(claimed)
+    written = 0
+    try:
+        while written < len(events):
+            batch = events[written:written + AUDIT_BATCH_SIZE]
+            write_batch(batch)
+            written += len(batch)
+    except Exception as e:
+        # Only the unwritten tail goes back, so nothing is loaded twice
+        print(f"Audit spool replay failed, keeping {len(events) - written} events spooled: {e}")
+        spool(events[written:])
+    os.remove(claimed)
+    return written
+
+
+def claim_owner_alive(claimed: str):
+    """Whether the process that claimed a .replay file may still be loading it"""
+    try:
+        pid = int(claimed[len(AUDIT_SPOOL_PATH) + 1:].split(".")[0])
+    except ValueError:
+        return False
+    if pid == os.getpid():
+        return False
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def replay_spool():
+    """Load spooled events into the table; returns how many were loaded"""
+    # Claim a file before reading it, so events spooled meanwhile (or by another worker)
+    # start a new one. Claims left by a process that died mid-replay are taken over here.
+    sources = [
+        path for path in glob.glob(f"{glob.escape(AUDIT_SPOOL_PATH)}.*.replay")
+        if not claim_owner_alive(path)
+    ]
+    sources.append(AUDIT_SPOOL_PATH)
+
+    loaded = 0
+    for source in sources:
+        claimed = f"{AUDIT_SPOOL_PATH}.{os.getpid()}.{secrets.token_hex(4)}.replay"
+        try:
+            os.replace(source, claimed)
+        except FileNotFoundError:
+            continue
+        try:
+            loaded += replay_file(claimed)
+        except Exception as e:
+            print(f"Audit spool replay of {claimed} failed, will retry on next start: {e}")
+    return loaded
+
+
+def start_flusher():
+    global _flusher
+    try:
+        loaded = replay_spool()
+    except Exception as e:
+        loaded = 0
+        print(f"Audit spool replay failed: {e}")
+    if loaded:
+        print(f"Loaded {loaded} spooled audit events")
+    _stop.clear()
+    _flusher = threading.Thread(target=flusher_loop, name="audit-flusher", daemon=True)
+    _flusher.start()
+
+
+def stop_flusher():
+    _stop.set()
+    if _flusher is not None:
+        _flusher.join(timeout=AUDIT_FLUSH_SECONDS + 30)
+    drain()
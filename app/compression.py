@@ -0,0 +1,184 @@
+# Response compression.
+# Buffered responses above COMPRESSION_MIN_BYTES are brotli- or gzip-encoded
+# according to Accept-Encoding. Compressed bodies of successful GETs are kept
+# in a byte-bounded LRU keyed by a hash of the uncompressed body, so identical
+# payloads (the same catalog for a whole class) are only compressed once.
+# Streaming responses (SSE, CSV exports) pass through uncompressed.
+# Every compressible response carries Vary: Accept-Encoding, whether or not
+# it was compressed, so shared caches keep the variants apart.
+
+import os
+import gzip
+import hashlib
+import threading
+from collections import OrderedDict
+
+try:
+    import brotli
+except ImportError:
+    brotli = None
+
+COMPRESSION_MIN_BYTES = int(os.getenv("COMPRESSION_MIN_BYTES", "1024"))
+COMPRESSION_CACHE_BYTES = int(os.getenv("COMPRESSION_CACHE_MB", "32")) * 1024 * 1024
+GZIP_LEVEL = 6
+BROTLI_QUALITY = 5
+COMPRESSIBLE_TYPES = (b"application/json", b"text/", b"application/javascript", b"image/svg+xml")
+
+
+class CompressedCache:
+    def __init__(self, max_bytes: int):
+        self.max_bytes = max_bytes
+        self.size = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        with self._lock:
+            value = self._entries.get(key)
+            if value is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return value
+
+    def put(self, key, value: bytes):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = value
+            self.size += len(value)
+            while self.size > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def stats(self):
+        with self._lock:
+            return {"entries": len(self._entries), "bytes": self.size, "hits": self.hits, "misses": self.misses}
+
+
+cache = CompressedCache(COMPRESSION_CACHE_BYTES)
+
+
+def choose_encoding(accept_encoding: str):
+    """Pick br or gzip from an Accept-Encoding header, honouring q=0"""
+    offered = {}
+    for part in accept_encoding.lower().split(","):
+        name, _, params = part.strip().partition(";")
+        q = 1.0
+        if params.strip().startswith("q="):
+            try:
+                q = float(params.strip()[2:])
+            except ValueError:
+                q = 0.0
+        offered[name.strip()] = q
+    wildcard = offered.get("*", 0.0)
+    if brotli is not None and offered.get("br", wildcard) > 0:
+        return "br"
+    if offered.get("gzip", wildcard) > 0:
+        return "gzip"
+    return None
+
+
+def compress(body: bytes, encoding: str):
+    if encoding == "br":
+        return brotli.compress(body, quality=BROTLI_QUALITY)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+
+def with_vary(headers):
+    """Add Accept-Encoding to Vary, keeping whatever CORS already put there"""
+    vary = [v for k, v in headers if k.lower() == b"vary"]
+    headers = [(k, v) for k, v in headers if k.lower() != b"vary"]
+    values = b", ".join(vary + [b"Accept-Encoding"])
+    return headers + [(b"vary", values)]
+
+
+def compressible(start_message):
+    headers = dict((k.lower(), v) for k, v in start_message.get("headers", []))
+    return b"content-encoding" not in headers and headers.get(b"content-type", b"").startswith(COMPRESSIBLE_TYPES)
+
+
+def vary_only(send):
+    """Wrap send so compressible responses get Vary without being compressed"""
+    async def send_with_vary(message):
+        if message["type"] == "http.response.start" and compressible(message):
+            message = {**message, "headers": with_vary(list(message.get("headers", [])))}
+        await send(message)
+    return send_with_vary
+
+
+class CompressionMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        accept_encoding = ""
+        for name, value in scope["headers"]:
+            if name == b"accept-encoding":
+                accept_encoding = value.decode("latin-1")
+        encoding = choose_encoding(accept_encoding) if accept_encoding else None
+        if encoding is None:
+            return await self.app(scope, receive, vary_only(send))
+
+        cacheable_method = scope["method"] == "GET"
+        start_message = None
+        body_parts = []
+        passthrough = False
+
+        async def send_wrapper(message):
+            nonlocal start_message, passthrough
+            if passthrough:
+                return await send(message)
+
+            if message["type"] == "http.response.start":
+                if not compressible(message):
+                    passthrough = True
+                    return await send(message)
+                start_message = message
+                return
+
+            if message["type"] != "http.response.body":
+                return await send(message)
+
+            body_parts.append(message.get("body", b""))
+            if message.get("more_body", False):
+                # Streaming response: flush what we held back and stop buffering
+                passthrough = True
+                await send({**start_message, "headers": with_vary(list(start_message.get("headers", [])))})
+                await send({"type": "http.response.body", "body": b"".join(body_parts), "more_body": True})
+                return
+
+            body = b"".join(body_parts)
+            status = start_message["status"]
+            headers = with_vary([
+                (k, v) for k, v in start_message.get("headers", []) if k.lower() != b"content-length"
+            ])
+
+            if len(body) < COMPRESSION_MIN_BYTES:
+                await send({**start_message, "headers": headers + [(b"content-length", str(len(body)).encode())]})
+                return await send({"type": "http.response.body", "body": body})
+
+            cacheable = cacheable_method and status == 200
+            key = (encoding, hashlib.blake2b(body, digest_size=16).digest()) if cacheable else None
+            compressed = cache.get(key) if cacheable else None
+            if compressed is None:
+                compressed = compress(body, encoding)
+                if cacheable:
+                    cache.put(key, compressed)
+
+            headers += [
+                (b"content-encoding", encoding.encode()),
+                (b"content-length", str(len(compressed)).encode()),
+            ]
+            await send({**start_message, "headers": headers})
+            await send({"type": "http.response.body", "body": compressed})
+
+        await self.app(scope, receive, send_wrapper)
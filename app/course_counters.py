@@ -0,0 +1,132 @@
+# Denormalized per-course summary counters.
+# Course.module_count, lesson_count, video_seconds, resource_count,
+# resource_size_mb and student_count are adjusted with relative UPDATEs in
+# the same transaction as the write that changes them, so listings read them
+# straight off the course row instead of running COUNT/SUM subqueries.
+# Counters are not part of the /sync payload, so changing them leaves
+# Course.sync_version alone and clients do not re-download the course.
+# reconcile() recomputes every counter with grouped aggregates, fixes any
+# course that drifted and reports what it found.
+#
+# Run from cron:  python -m app.course_counters [--dry-run]
+
+import sys
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import Course, CourseModule, CourseLesson, CourseResource, StudentCourseEnrollment
+
+COUNTERS = ("module_count", "lesson_count", "video_seconds", "resource_count", "resource_size_mb", "student_count")
+# resource_size_mb accumulates float deltas; differences below this are rounding, not drift
+SIZE_TOLERANCE_MB = 0.01
+
+
+def bump(db: Session, course_id: int, **deltas):
+    """Add deltas to a course's counters in the current transaction; the caller commits"""
+    values = {getattr(Course, name): getattr(Course, name) + delta for name, delta in deltas.items() if delta}
+    if not values:
+        return
+    db.query(Course).filter(Course.id == course_id).update(values, synchronize_session=False)
+
+
+def summary(course: Course):
+    return {
+        "moduleCount": course.module_count or 0,
+        "lessonCount": course.lesson_count or 0,
+        "videoSeconds": course.video_seconds or 0,
+        "resourceCount": course.resource_count or 0,
+        "resourceSizeMb": round(course.resource_size_mb or 0, 2),
+        "studentCount": course.student_count or 0,
+    }
+
+
+def actual_counts(db: Session, course_ids=None):
+    """{course_id: {counter: value}} computed from the source tables"""
+    def scoped(query, column):
+        return query.filter(column.in_(course_ids)) if course_ids is not None else query
+
+    counts = {}
+
+    def put(rows, *names):
+        for course_id, *values in rows:
+            entry = counts.setdefault(course_id, dict.fromkeys(COUNTERS, 0))
+            for name, value in zip(names, values):
+                entry[name] = value or 0
+
+    put(scoped(db.query(CourseModule.course_id, func.count(CourseModule.id)), CourseModule.course_id)
+        .group_by(CourseModule.course_id).all(), "module_count")
+    put(scoped(db.query(
+        CourseModule.course_id, func.count(CourseLesson.id), func.sum(CourseLesson.duration_seconds)
+    ).join(CourseLesson, CourseLesson.module_id == CourseModule.id), CourseModule.course_id)
+        .group_by(CourseModule.course_id).all(), "lesson_count", "video_seconds")
+    put(scoped(db.query(
+        CourseResource.course_id, func.count(CourseResource.id), func.sum(CourseResource.size_mb)
+    ), CourseResource.course_id).group_by(CourseResource.course_id).all(), "resource_count", "resource_size_mb")
+    put(scoped(db.query(StudentCourseEnrollment.course_id, func.count(StudentCourseEnrollment.id)).filter(
+        StudentCourseEnrollment.status == "approved"
+    ), StudentCourseEnrollment.course_id).group_by(StudentCourseEnrollment.course_id).all(), "student_count")
+    return counts
+
+
+def drifted(stored, actual):
+    """Counters whose stored value differs from the actual one"""
+    diff = {}
+    for name in COUNTERS:
+        if name == "resource_size_mb":
+            if abs((stored[name] or 0) - actual[name]) >= SIZE_TOLERANCE_MB:
+                diff[name] = {"stored": round(stored[name] or 0, 2), "actual": round(actual[name], 2)}
+        elif (stored[name] or 0) != actual[name]:
+            diff[name] = {"stored": stored[name] or 0, "actual": actual[name]}
+    return diff
+
+
+def recount(db: Session, course_id: int):
+    """Set one course's counters from the source tables; the caller commits"""
+    actual = actual_counts(db, [course_id]).get(course_id, dict.fromkeys(COUNTERS, 0))
+    db.query(Course).filter(Course.id == course_id).update(
+        {getattr(Course, name): value for name, value in actual.items()},
+        synchronize_session=False,
+    )
+    return actual
+
+
+def reconcile(db: Session = None, fix: bool = True):
+    """Rebuild every course's counters in bulk and report the ones that had drifted"""
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        actual = actual_counts(db)
+        stored = db.query(Course.id, *(getattr(Course, name) for name in COUNTERS)).all()
+
+        drift = {}
+        for row in stored:
+            expected = actual.get(row.id, dict.fromkeys(COUNTERS, 0))
+            diff = drifted(row._mapping, expected)
+            if diff:
+                drift[row.id] = diff
+
+        if fix and drift:
+            db.bulk_update_mappings(Course, [
+                {"id": course_id, **actual.get(course_id, dict.fromkeys(COUNTERS, 0))}
+                for course_id in drift
+            ])
+        db.commit()
+
+        return {
+            "courses": len(stored),
+            "drifted": len(drift),
+            "fixed": fix,
+            "drift": [{"course_id": course_id, "counters": diff} for course_id, diff in sorted(drift.items())],
+        }
+    finally:
+        if own_session:
+            db.close()
+
+
+if __name__ == "__main__":
+    report = reconcile(fix="--dry-run" not in sys.argv)
+    print(f"Checked {report['courses']} courses, {report['drifted']} drifted"
+          f"{'' if report['fixed'] else ' (dry run, nothing changed)'}")
+    for entry in report["drift"]:
+        changes = ", ".join(f"{name} {d['stored']} -> {d['actual']}" for name, d in entry["counters"].items())
+        print(f"  course {entry['course_id']}: {changes}")
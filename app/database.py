@@ -1,5 +1,5 @@
 import os
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, text
 from sqlalchemy.orm import sessionmaker, declarative_base
 from sqlalchemy.engine.url import make_url
 
@@ -24,6 +24,62 @@ def should_run_mysql_migrations() -> bool:
     )
 
 
+# Columns and indexes added after the tables were first created; create_all skips existing tables.
+# Applied to MySQL with MIGRATE_DB=true and to SQLite files on every start.
+MYSQL_COLUMNS = [
+    ("courses", "thumbnail_variants", "TEXT DEFAULT NULL"),
+    ("course_lessons", "hls_playlist", "VARCHAR(500) DEFAULT NULL"),
+    ("courses", "sync_version", "INT NOT NULL DEFAULT 0"),
+    ("course_modules", "sync_version", "INT NOT NULL DEFAULT 0"),
+    ("course_lessons", "sync_version", "INT NOT NULL DEFAULT 0"),
+    ("course_resources", "sync_version", "INT NOT NULL DEFAULT 0"),
+    ("student_enrollments", "sync_version", "INT NOT NULL DEFAULT 0"),
+    ("courses", "module_count", "INT NOT NULL DEFAULT 0"),
+    ("courses", "lesson_count", "INT NOT NULL DEFAULT 0"),
+    ("courses", "video_seconds", "INT NOT NULL DEFAULT 0"),
+    ("courses", "resource_count", "INT NOT NULL DEFAULT 0"),
+    ("courses", "resource_size_mb", "FLOAT NOT NULL DEFAULT 0"),
+    ("courses", "student_count", "INT NOT NULL DEFAULT 0"),
+    ("lesson_progress", "started_at", "DATETIME DEFAULT NULL"),
+    ("lesson_progress", "completed_at", "DATETIME DEFAULT NULL"),
+    ("student_enrollments", "approved_at", "DATETIME DEFAULT NULL"),
+]
+
+MYSQL_INDEXES = [
+    ("lesson_progress", "ix_lesson_progress_last_accessed", "last_accessed"),
+    ("student_enrollments", "ix_student_enrollments_enrolled_at", "enrolled_at"),
+    ("courses", "ix_courses_sync_version", "sync_version"),
+    ("course_modules", "ix_course_modules_sync_version", "sync_version"),
+    ("course_lessons", "ix_course_lessons_sync_version", "sync_version"),
+    ("course_resources", "ix_course_resources_sync_version", "sync_version"),
+    ("student_enrollments", "ix_student_enrollments_sync_version", "sync_version"),
+    ("users", "ix_users_role_class_board", "role, student_class, board"),
+    ("lesson_progress", "ix_lesson_progress_started_at", "started_at"),
+    ("lesson_progress", "ix_lesson_progress_completed_at", "completed_at"),
+    ("student_enrollments", "ix_student_enrollments_approved_at", "approved_at"),
+    ("audit_events", "ix_audit_events_action_id", "action, id"),
+]
+
+# Indexes that became unique: duplicate rows are deleted, keeping the oldest,
+# and the index is rebuilt as UNIQUE
+UNIQUE_INDEXES = [
+    ("lesson_progress", "ix_lesson_progress_student_lesson", "student_id, lesson_id"),
+]
+
+
+def make_unique(cursor, table: str, index_name: str, columns: str, exists: bool):
+    cursor.execute(
+        f"DELETE FROM {table} WHERE id NOT IN "
+        f"(SELECT id FROM (SELECT MIN(id) AS id FROM {table} GROUP BY {columns}) AS keep)"
+    )
+    if cursor.rowcount:
+        print(f"Removed {cursor.rowcount} duplicate rows from {table}")
+    if exists:
+        cursor.execute(f"DROP INDEX {index_name} ON {table}" if DATABASE_URL.startswith("mysql") else f"DROP INDEX {index_name}")
+    cursor.execute(f"CREATE UNIQUE INDEX {index_name} ON {table} ({columns})")
+    print(f"Made '{index_name}' index on {table} table unique")
+
+
 def migrate_mysql_database():
     import pymysql
 
@@ -94,14 +150,81 @@ def migrate_mysql_database():
 
             connection.commit()
 
+        for table, column, definition in MYSQL_COLUMNS:
+            cursor.execute(f"SHOW TABLES LIKE '{table}'")
+            if not cursor.fetchone():
+                continue
+            cursor.execute(f"SHOW COLUMNS FROM {table}")
+            if column not in {row[0] for row in cursor.fetchall()}:
+                cursor.execute(f"ALTER TABLE {table} ADD COLUMN {column} {definition}")
+                print(f"Added '{column}' column to {table} table")
+
+        for table, index_name, columns in MYSQL_INDEXES:
+            cursor.execute(f"SHOW TABLES LIKE '{table}'")
+            if not cursor.fetchone():
+                continue
+            cursor.execute(f"SHOW INDEX FROM {table}")
+            if index_name not in {row[2] for row in cursor.fetchall()}:
+                cursor.execute(f"CREATE INDEX {index_name} ON {table} ({columns})")
+                print(f"Added '{index_name}' index to {table} table")
+
+        cursor.execute("SHOW TABLES LIKE 'user_search_keys'")
+        if cursor.fetchone():
+            cursor.execute("SHOW FULL COLUMNS FROM user_search_keys LIKE 'search_key'")
+            if cursor.fetchone()[2] != "utf8mb4_bin":
+                cursor.execute("ALTER TABLE user_search_keys MODIFY COLUMN search_key VARCHAR(100) COLLATE utf8mb4_bin NOT NULL")
+                print("Switched user_search_keys.search_key to binary collation")
+
+        for table, index_name, columns in UNIQUE_INDEXES:
+            cursor.execute(f"SHOW TABLES LIKE '{table}'")
+            if not cursor.fetchone():
+                continue
+            cursor.execute(f"SHOW INDEX FROM {table}")
+            non_unique = {row[2]: row[1] for row in cursor.fetchall()}
+            if non_unique.get(index_name, 1):
+                make_unique(cursor, table, index_name, columns, index_name in non_unique)
+
+        connection.commit()
+
         cursor.close()
         connection.close()
     except Exception as e:
         print(f"Migration handled: {e}")
 
 
+def migrate_sqlite_database():
+    """Add MYSQL_COLUMNS and MYSQL_INDEXES missing from an existing SQLite file"""
+    try:
+        with engine.begin() as connection:
+            tables = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'table'"))}
+            for table, column, definition in MYSQL_COLUMNS:
+                if table not in tables:
+                    continue
+                existing_columns = {row[1] for row in connection.execute(text(f"PRAGMA table_info({table})"))}
+                if column not in existing_columns:
+                    connection.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+                    print(f"Added '{column}' column to {table} table")
+
+            indexes = {row[0] for row in connection.execute(text("SELECT name FROM sqlite_master WHERE type = 'index'"))}
+            for table, index_name, columns in MYSQL_INDEXES:
+                if table in tables and index_name not in indexes:
+                    connection.execute(text(f"CREATE INDEX {index_name} ON {table} ({columns})"))
+                    print(f"Added '{index_name}' index to {table} table")
+
+            for table, index_name, columns in UNIQUE_INDEXES:
+                if table not in tables:
+                    continue
+                unique = {row[1]: row[2] for row in connection.execute(text(f"PRAGMA index_list({table})"))}
+                if not unique.get(index_name, 0):
+                    make_unique(connection.connection.cursor(), table, index_name, columns, index_name in unique)
+    except Exception as e:
+        print(f"Migration handled: {e}")
+
+
 if should_run_mysql_migrations():
     migrate_mysql_database()
+elif DATABASE_URL.startswith("sqlite"):
+    migrate_sqlite_database()
 
 SessionLocal = sessionmaker(
     autocommit=False,
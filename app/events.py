@@ -0,0 +1,148 @@
+# In-process pub/sub used to push enrollment changes to connected clients.
+# Set EVENTS_BROKER=redis (and REDIS_URL) to share events between workers.
+
+import os
+import json
+import asyncio
+import threading
+
+EVENTS_BROKER = os.getenv("EVENTS_BROKER", "memory").lower()
+REDIS_URL = os.getenv("REDIS_URL", "redis://localhost:6379/0")
+SUBSCRIBER_QUEUE_SIZE = int(os.getenv("EVENTS_QUEUE_SIZE", "100"))
+# Backoff between attempts to re-subscribe after the Redis connection drops
+RECONNECT_MIN_SECONDS = 1
+RECONNECT_MAX_SECONDS = 30
+
+
+class InMemoryBroker:
+    """Fans events out to subscribers of this process only"""
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel: str):
+        queue = asyncio.Queue(maxsize=SUBSCRIBER_QUEUE_SIZE)
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            self._subscribers.setdefault(channel, set()).add((loop, queue))
+        return queue
+
+    def unsubscribe(self, channel: str, queue):
+        with self._lock:
+            subscribers = self._subscribers.get(channel, set())
+            subscribers.difference_update({s for s in subscribers if s[1] is queue})
+            if not subscribers:
+                self._subscribers.pop(channel, None)
+
+    def publish(self, channel: str, event: dict):
+        with self._lock:
+            subscribers = list(self._subscribers.get(channel, ()))
+        for loop, queue in subscribers:
+            # Endpoints run in the threadpool, so hand off to the subscriber's loop
+            loop.call_soon_threadsafe(_deliver, queue, event)
+
+
+def _deliver(queue, event):
+    if queue.full():
+        # Slow client: drop the oldest delta rather than grow without bound
+        queue.get_nowait()
+    queue.put_nowait(event)
+
+
+class RedisBroker(InMemoryBroker):
+    """Publishes through Redis so every worker's subscribers see every event"""
+
+    def __init__(self, url: str):
+        super().__init__()
+        import redis
+
+        self._url = url
+        self._client = redis.Redis.from_url(url)
+        self._listener = None
+
+    def subscribe(self, channel: str):
+        queue = super().subscribe(channel)
+        if self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+        return queue
+
+    def publish(self, channel: str, event: dict):
+        self._client.publish(f"sikhiya:{channel}", json.dumps(event, default=str))
+
+    async def _listen(self):
+        """Relay Redis messages to this process's subscribers, reconnecting until cancelled.
+        Events published while disconnected are lost; clients catch up through /sync."""
+        import redis.asyncio as aioredis
+
+        delay = RECONNECT_MIN_SECONDS
+        while True:
+            client = aioredis.Redis.from_url(self._url)
+            try:
+                pubsub = client.pubsub()
+                await pubsub.psubscribe("sikhiya:*")
+                if delay > RECONNECT_MIN_SECONDS:
+                    print("Events listener reconnected to Redis")
+                delay = RECONNECT_MIN_SECONDS
+                async for message in pubsub.listen():
+                    if message["type"] != "pmessage":
+                        continue
+                    try:
+                        channel = message["channel"].decode().split(":", 1)[1]
+                        event = json.loads(message["data"])
+                    except (IndexError, ValueError) as e:
+                        print(f"Ignoring malformed event on {message['channel']!r}: {e}")
+                        continue
+                    super().publish(channel, event)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Events listener lost Redis ({e}); retrying in {delay}s")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, RECONNECT_MAX_SECONDS)
+            finally:
+                await client.aclose()
+
+
+def create_broker():
+    if EVENTS_BROKER == "redis":
+        try:
+            return RedisBroker(REDIS_URL)
+        except ImportError:
+            print("EVENTS_BROKER=redis but redis is not installed, using in-memory broker")
+    return InMemoryBroker()
+
+
+broker = create_broker()
+
+
+def publish(channel: str, event: dict):
+    try:
+        broker.publish(channel, event)
+    except Exception as e:
+        # Notifications are best effort and must never fail the write request
+        print(f"Event publish failed: {e}")
+
+
+def course_channel(course_id: int):
+    return f"course:{course_id}"
+
+
+def student_channel(student_id: int):
+    return f"student:{student_id}"
+
+
+async def event_stream(channel: str, keepalive_seconds: int = 15):
+    """Yield Server-Sent Events for a channel until the client disconnects"""
+    queue = broker.subscribe(channel)
+    try:
+        yield "retry: 5000\n\n"
+        while True:
+            try:
+                event = await asyncio.wait_for(queue.get(), timeout=keepalive_seconds)
+            except asyncio.TimeoutError:
+                yield ": keepalive\n\n"
+                continue
+            yield f"event: {event['type']}\ndata: {json.dumps(event, default=str)}\n\n"
+    finally:
+        broker.unsubscribe(channel, queue)
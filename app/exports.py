@@ -0,0 +1,183 @@
+# Spreadsheet exports of users, enrollments and lesson progress.
+# Rows are read through a server-side cursor and written out as they arrive,
+# so memory stays flat no matter how many rows an export has. Enrollment and
+# progress exports include rows moved to the archive tables.
+
+import os
+import io
+import csv
+from datetime import datetime
+from .database import SessionLocal
+from .models import (
+    User, CourseModule, CourseLesson, StudentCourseEnrollment, StudentLessonProgress, ExportJob,
+    LessonProgressArchive, EnrollmentArchive,
+)
+
+EXPORT_DIR = os.getenv("EXPORT_DIR", "./exports")
+EXPORT_BATCH_SIZE = int(os.getenv("EXPORT_BATCH_SIZE", "1000"))
+
+EXPORT_COLUMNS = {
+    "users": ["id", "name", "email", "role", "board", "student_class", "teacher_status"],
+    "enrollments": ["enrollment_id", "student_id", "student_name", "student_email", "status", "enrolled_at"],
+    "progress": [
+        "student_id", "student_name", "student_email", "lesson_id", "lesson_title",
+        "watched_seconds", "completed", "last_accessed",
+    ],
+}
+
+
+def export_query(db, kind: str, course_id: int = None):
+    if kind == "users":
+        query = db.query(
+            User.id, User.name, User.email, User.role, User.board, User.student_class, User.teacher_status,
+        ).order_by(User.id)
+    elif kind == "enrollments":
+        query = db.query(
+            StudentCourseEnrollment.id, User.id, User.name, User.email,
+            StudentCourseEnrollment.status, StudentCourseEnrollment.enrolled_at,
+        ).join(
+            User, StudentCourseEnrollment.student_id == User.id
+        ).filter(
+            StudentCourseEnrollment.course_id == course_id
+        ).order_by(StudentCourseEnrollment.id)
+    elif kind == "progress":
+        query = db.query(
+            User.id, User.name, User.email, CourseLesson.id, CourseLesson.title,
+            StudentLessonProgress.watched_seconds, StudentLessonProgress.completed,
+            StudentLessonProgress.last_accessed,
+        ).join(
+            User, StudentLessonProgress.student_id == User.id
+        ).join(
+            CourseLesson, StudentLessonProgress.lesson_id == CourseLesson.id
+        ).join(
+            CourseModule, CourseLesson.module_id == CourseModule.id
+        ).filter(
+            CourseModule.course_id == course_id
+        ).order_by(User.id, CourseLesson.id)
+    else:
+        raise ValueError(f"Unknown export: {kind}")
+
+    # yield_per turns on stream_results, i.e. a server-side cursor
+    return query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def archived_query(db, kind: str, course_id: int = None):
+    """The archive-table half of an export, or None when the kind has no archive"""
+    if kind == "enrollments":
+        query = db.query(
+            EnrollmentArchive.id, User.id, User.name, User.email,
+            EnrollmentArchive.status, EnrollmentArchive.enrolled_at,
+        ).join(
+            User, EnrollmentArchive.student_id == User.id
+        ).filter(
+            EnrollmentArchive.course_id == course_id
+        ).order_by(EnrollmentArchive.id)
+    elif kind == "progress":
+        query = db.query(
+            User.id, User.name, User.email, CourseLesson.id, CourseLesson.title,
+            LessonProgressArchive.watched_seconds, LessonProgressArchive.completed,
+            LessonProgressArchive.last_accessed,
+        ).join(
+            User, LessonProgressArchive.student_id == User.id
+        ).join(
+            CourseLesson, LessonProgressArchive.lesson_id == CourseLesson.id
+        ).join(
+            CourseModule, CourseLesson.module_id == CourseModule.id
+        ).filter(
+            CourseModule.course_id == course_id
+        ).order_by(User.id, CourseLesson.id)
+    else:
+        return None
+    return query.execution_options(yield_per=EXPORT_BATCH_SIZE)
+
+
+def export_rows(db, kind: str, course_id: int = None):
+    """Live rows followed by archived ones; the second cursor opens after the first is drained"""
+    yield from export_query(db, kind, course_id)
+    archived = archived_query(db, kind, course_id)
+    if archived is not None:
+        yield from archived
+
+
+# Spreadsheet apps run a CSV cell starting with one of these as a formula
+FORMULA_PREFIXES = ("=", "+", "-", "@", "\t", "\r")
+
+
+def csv_row(row):
+    """Row with user-entered text that would start a formula quoted with a leading '"""
+    return [
+        f"'{value}" if isinstance(value, str) and value.startswith(FORMULA_PREFIXES) else value
+        for value in row
+    ]
+
+
+def iter_csv(kind: str, course_id: int = None):
+    """Yield CSV text in chunks of EXPORT_BATCH_SIZE rows"""
+    db = SessionLocal()
+    try:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(EXPORT_COLUMNS[kind])
+        for count, row in enumerate(export_rows(db, kind, course_id), start=1):
+            writer.writerow(csv_row(row))
+            if count % EXPORT_BATCH_SIZE == 0:
+                yield buffer.getvalue()
+                buffer.seek(0)
+                buffer.truncate()
+        yield buffer.getvalue()
+    finally:
+        db.close()
+
+
+def write_export(path: str, kind: str, course_id: int = None, file_format: str = "csv"):
+    """Write an export to path and return the number of data rows"""
+    row_count = 0
+    db = SessionLocal()
+    try:
+        rows = export_rows(db, kind, course_id)
+        if file_format == "xlsx":
+            from openpyxl import Workbook
+
+            # write_only mode streams rows to a temp file instead of building a sheet in memory
+            workbook = Workbook(write_only=True)
+            sheet = workbook.create_sheet(kind)
+            sheet.append(EXPORT_COLUMNS[kind])
+            for row in rows:
+                sheet.append(list(row))
+                row_count += 1
+            workbook.save(path)
+        else:
+            with open(path, "w", newline="", encoding="utf-8") as f:
+                writer = csv.writer(f)
+                writer.writerow(EXPORT_COLUMNS[kind])
+                for row in rows:
+                    writer.writerow(csv_row(row))
+                    row_count += 1
+    finally:
+        db.close()
+    return row_count
+
+
+def run_export_job(job_id: int):
+    """Background entry point: build the file for an ExportJob row"""
+    db = SessionLocal()
+    try:
+        job = db.query(ExportJob).filter(ExportJob.id == job_id).first()
+        if not job:
+            return
+        job.status = "running"
+        db.commit()
+
+        os.makedirs(EXPORT_DIR, exist_ok=True)
+        path = os.path.join(EXPORT_DIR, f"export-{job.id}-{job.kind}.{job.file_format}")
+        try:
+            job.row_count = write_export(path, job.kind, job.course_id, job.file_format)
+            job.file_path = path
+            job.status = "done"
+        except Exception as e:
+            job.status = "failed"
+            job.error = str(e)
+        job.finished_at = datetime.utcnow()
+        db.commit()
+    finally:
+        db.close()
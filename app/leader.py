@@ -0,0 +1,99 @@
+# Leader election for background work that must run once per deployment.
+# Under gunicorn every worker runs the startup tasks, so schedulers, backfills
+# and job runners are registered as leader tasks instead. They start only in
+# the process holding an advisory lock: GET_LOCK on MySQL, or an flock on
+# LEADER_LOCK_FILE otherwise (which needs every process on one host, as
+# SQLite does anyway). Processes that lose the election retry every
+# LEADER_RETRY_SECONDS and take over when the leader exits.
+# MySQL drops GET_LOCK with the connection holding it (wait_timeout, network
+# errors), so the leader checks the lock every LEADER_CHECK_SECONDS, which
+# also keeps the connection from idling out. If the lock is gone it runs the
+# stop tasks and campaigns again.
+
+import os
+import fcntl
+import asyncio
+from .database import engine
+
+LEADER_LOCK_NAME = "sikhiya-leader"
+LEADER_LOCK_FILE = os.getenv("LEADER_LOCK_FILE", "/tmp/sikhiya-leader.lock")
+LEADER_RETRY_SECONDS = int(os.getenv("LEADER_RETRY_SECONDS", "30"))
+LEADER_CHECK_SECONDS = int(os.getenv("LEADER_CHECK_SECONDS", "10"))
+
+_held = None  # open file or MySQL connection holding the lock
+
+
+def try_acquire():
+    """Take the lock without waiting; True if this process holds it"""
+    global _held
+    if _held is not None:
+        return True
+    if engine.dialect.name == "mysql":
+        # A connection of its own, outside the pool: the lock lives as long as it does
+        connection = engine.raw_connection()
+        connection.detach()
+        cursor = connection.cursor()
+        cursor.execute("SELECT GET_LOCK(%s, 0)", (LEADER_LOCK_NAME,))
+        acquired = cursor.fetchone()[0] == 1
+        cursor.close()
+        if not acquired:
+            connection.close()
+            return False
+        _held = connection
+    else:
+        lock_file = open(LEADER_LOCK_FILE, "a")
+        try:
+            fcntl.flock(lock_file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except OSError:
+            lock_file.close()
+            return False
+        _held = lock_file
+    return True
+
+
+def still_held():
+    """Whether this process still holds the lock; False once MySQL has dropped it"""
+    if _held is None:
+        return False
+    if engine.dialect.name != "mysql":
+        return True  # the flock lasts as long as the open file
+    try:
+        cursor = _held.cursor()
+        cursor.execute("SELECT IS_USED_LOCK(%s) = CONNECTION_ID()", (LEADER_LOCK_NAME,))
+        held = cursor.fetchone()[0] == 1
+        cursor.close()
+        return held
+    except Exception as e:
+        print(f"Leader lock check failed: {e}")
+        return False
+
+
+def is_leader():
+    return _held is not None
+
+
+def release():
+    global _held
+    if _held is not None:
+        _held.close()
+        _held = None
+
+
+async def campaign(tasks, stop_tasks):
+    """Run tasks while this process is the leader and stop_tasks when it stops being one"""
+    while True:
+        while not await asyncio.to_thread(try_acquire):
+            await asyncio.sleep(LEADER_RETRY_SECONDS)
+        print(f"Process {os.getpid()} is the leader; starting {len(tasks)} background task(s)")
+        for task in tasks:
+            await task()
+
+        while await asyncio.to_thread(still_held):
+            await asyncio.sleep(LEADER_CHECK_SECONDS)
+        print(f"Process {os.getpid()} lost the leader lock; stopping background tasks")
+        for task in stop_tasks:
+            try:
+                await task()
+            except Exception as e:
+                print(f"Stopping leader task failed: {e}")
+        await asyncio.to_thread(release)
@@ -0,0 +1,253 @@
+# Student leaderboards.
+# leaderboard_scores holds one row per (board, student), bumped in place by
+# each progress write, and indexed so top-K and rank-of-user are range scans.
+# Boards are "course:<id>" and "class:<student_class>:<board>". Read paths
+# use an in-process sorted list per board, warmed on startup, kept in an LRU
+# and reloaded every LEADERBOARD_REFRESH_SECONDS to pick up other workers'
+# writes.
+#
+# Rebuild every score row from lesson progress:  python -m app.leaderboards
+
+import os
+import time
+import bisect
+import threading
+from collections import OrderedDict
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import (
+    User, CourseModule, CourseLesson, StudentCourseEnrollment, StudentLessonProgress, LeaderboardScore,
+    LessonProgressArchive,
+)
+
+LEADERBOARD_CACHE_BOARDS = int(os.getenv("LEADERBOARD_CACHE_BOARDS", "256"))
+LEADERBOARD_REFRESH_SECONDS = int(os.getenv("LEADERBOARD_REFRESH_SECONDS", "60"))
+LEADERBOARD_MAX_LIMIT = 100
+
+
+def course_board(course_id: int):
+    return f"course:{course_id}"
+
+
+def class_board(student: User):
+    if not student.student_class:
+        return None
+    return f"class:{student.student_class}:{student.board or 'Other'}"
+
+
+class Leaderboard:
+    """Students sorted by (lessons completed, watch time) descending"""
+
+    def __init__(self, rows):
+        self.scores = {student_id: (-lessons, -watch, student_id) for student_id, lessons, watch in rows}
+        self.keys = sorted(self.scores.values())
+        self.loaded_at = time.monotonic()
+
+    def __len__(self):
+        return len(self.keys)
+
+    def update(self, student_id: int, lessons: int, watch: int):
+        self.remove(student_id)
+        key = (-lessons, -watch, student_id)
+        bisect.insort(self.keys, key)
+        self.scores[student_id] = key
+
+    def remove(self, student_id: int):
+        key = self.scores.pop(student_id, None)
+        if key is not None:
+            del self.keys[bisect.bisect_left(self.keys, key)]
+
+    def rank_of_key(self, key):
+        # Students with equal scores share a rank
+        return bisect.bisect_left(self.keys, key[:2]) + 1
+
+    def top(self, limit: int):
+        return [
+            {"student_id": key[2], "rank": self.rank_of_key(key), "lessons_completed": -key[0], "watch_seconds": -key[1]}
+            for key in self.keys[:limit]
+        ]
+
+    def rank(self, student_id: int):
+        key = self.scores.get(student_id)
+        if key is None:
+            return None
+        return {"student_id": student_id, "rank": self.rank_of_key(key), "lessons_completed": -key[0], "watch_seconds": -key[1]}
+
+
+_boards = OrderedDict()
+_lock = threading.Lock()
+
+
+def load_board(db: Session, board_key: str):
+    rows = db.query(
+        LeaderboardScore.student_id, LeaderboardScore.lessons_completed, LeaderboardScore.watch_seconds
+    ).filter(LeaderboardScore.board_key == board_key).all()
+    return Leaderboard(rows)
+
+
+def get_board(db: Session, board_key: str):
+    with _lock:
+        board = _boards.get(board_key)
+        if board is not None and time.monotonic() - board.loaded_at < LEADERBOARD_REFRESH_SECONDS:
+            _boards.move_to_end(board_key)
+            return board
+
+    board = load_board(db, board_key)
+    with _lock:
+        _boards[board_key] = board
+        _boards.move_to_end(board_key)
+        while len(_boards) > LEADERBOARD_CACHE_BOARDS:
+            _boards.popitem(last=False)
+    return board
+
+
+def apply_local(updates):
+    """Mirror committed score rows [(board_key, student_id, lessons, watch)] into cached boards"""
+    with _lock:
+        for board_key, student_id, lessons, watch in updates:
+            board = _boards.get(board_key)
+            if board is not None:
+                board.update(student_id, lessons, watch)
+
+
+def forget_student(student_id: int, board_key: str = None):
+    with _lock:
+        for key, board in _boards.items():
+            if board_key is None or key == board_key:
+                board.remove(student_id)
+
+
+def forget_board(board_key: str):
+    with _lock:
+        _boards.pop(board_key, None)
+
+
+def course_totals(db: Session, student_id: int, course_id: int = None):
+    """(lessons completed, watch seconds) from raw progress, for one course or all of them"""
+    query = db.query(
+        func.coalesce(func.sum(StudentLessonProgress.completed), 0),
+        func.coalesce(func.sum(StudentLessonProgress.watched_seconds), 0),
+    ).filter(StudentLessonProgress.student_id == student_id)
+    if course_id is not None:
+        query = query.join(CourseLesson, StudentLessonProgress.lesson_id == CourseLesson.id).join(
+            CourseModule, CourseLesson.module_id == CourseModule.id
+        ).filter(CourseModule.course_id == course_id)
+    lessons, watch = query.one()
+
+    archived = db.query(
+        func.coalesce(func.sum(LessonProgressArchive.completed), 0),
+        func.coalesce(func.sum(LessonProgressArchive.watched_seconds), 0),
+    ).filter(LessonProgressArchive.student_id == student_id)
+    if course_id is not None:
+        archived = archived.join(CourseLesson, LessonProgressArchive.lesson_id == CourseLesson.id).join(
+            CourseModule, CourseLesson.module_id == CourseModule.id
+        ).filter(CourseModule.course_id == course_id)
+    archived_lessons, archived_watch = archived.one()
+    return int(lessons) + int(archived_lessons), int(watch) + int(archived_watch)
+
+
+def record_progress(db: Session, student: User, course_id: int, lessons_delta: int, watch_delta: int):
+    """
+    Bump the student's course and class rows; the caller commits and then
+    passes the returned rows to apply_local. Missing rows (new student, or
+    one who unenrolled and came back) are computed from raw progress, which
+    already includes this write.
+    """
+    boards = [(course_board(course_id), course_id)]
+    if class_board(student):
+        boards.append((class_board(student), None))
+
+    updates = []
+    for board_key, scope_course_id in boards:
+        row = db.query(LeaderboardScore).filter(
+            LeaderboardScore.board_key == board_key, LeaderboardScore.student_id == student.id
+        ).first()
+        if row is None:
+            lessons, watch = course_totals(db, student.id, scope_course_id)
+            row = LeaderboardScore(board_key=board_key, student_id=student.id, lessons_completed=lessons, watch_seconds=watch)
+            db.add(row)
+        elif lessons_delta or watch_delta:
+            # Increment in SQL so concurrent writes for the same student don't lose updates
+            row.lessons_completed = LeaderboardScore.lessons_completed + lessons_delta
+            row.watch_seconds = LeaderboardScore.watch_seconds + watch_delta
+        db.flush()
+        updates.append((board_key, student.id, row.lessons_completed, row.watch_seconds))
+    return updates
+
+
+def progress_per_course(db: Session, model):
+    return db.query(
+        model.student_id,
+        CourseModule.course_id,
+        func.sum(model.completed),
+        func.sum(model.watched_seconds),
+    ).join(CourseLesson, model.lesson_id == CourseLesson.id).join(
+        CourseModule, CourseLesson.module_id == CourseModule.id
+    ).group_by(model.student_id, CourseModule.course_id).all()
+
+
+def rebuild_scores(db: Session):
+    """Recompute every score row from lesson progress, hot and archived"""
+    totals = {}
+    for model in (StudentLessonProgress, LessonProgressArchive):
+        for student_id, course_id, lessons, watch in progress_per_course(db, model):
+            current = totals.setdefault((student_id, course_id), [0, 0])
+            current[0] += int(lessons or 0)
+            current[1] += int(watch or 0)
+    per_course = [(student_id, course_id, lessons, watch) for (student_id, course_id), (lessons, watch) in totals.items()]
+    # Course boards only list current students; class boards count all progress
+    approved = set(db.query(StudentCourseEnrollment.student_id, StudentCourseEnrollment.course_id).filter(
+        StudentCourseEnrollment.status == "approved"
+    ).all())
+
+    per_class = {}
+    students = {u.id: u for u in db.query(User).filter(User.role == "student").all()}
+    rows = []
+    for student_id, course_id, lessons, watch in per_course:
+        if (student_id, course_id) in approved:
+            rows.append({
+                "board_key": course_board(course_id), "student_id": student_id,
+                "lessons_completed": int(lessons or 0), "watch_seconds": int(watch or 0),
+            })
+        student = students.get(student_id)
+        if student and class_board(student):
+            totals = per_class.setdefault((class_board(student), student_id), [0, 0])
+            totals[0] += int(lessons or 0)
+            totals[1] += int(watch or 0)
+    rows += [
+        {"board_key": board_key, "student_id": student_id, "lessons_completed": lessons, "watch_seconds": watch}
+        for (board_key, student_id), (lessons, watch) in per_class.items()
+    ]
+
+    db.query(LeaderboardScore).delete(synchronize_session=False)
+    db.bulk_insert_mappings(LeaderboardScore, rows)
+    db.commit()
+    with _lock:
+        _boards.clear()
+    return len(rows)
+
+
+def backfill_scores(db: Session):
+    """Fill the score table from progress on first run; returns the rows written"""
+    if not db.query(LeaderboardScore.id).first() and db.query(StudentLessonProgress.id).first():
+        return rebuild_scores(db)
+    return 0
+
+
+def warm_boards(db: Session):
+    """Load the largest boards into memory"""
+    biggest = db.query(LeaderboardScore.board_key).group_by(LeaderboardScore.board_key).order_by(
+        func.count(LeaderboardScore.id).desc()
+    ).limit(LEADERBOARD_CACHE_BOARDS).all()
+    for (board_key,) in biggest:
+        get_board(db, board_key)
+    return len(biggest)
+
+
+if __name__ == "__main__":
+    db = SessionLocal()
+    try:
+        print(f"Rebuilt {rebuild_scores(db)} leaderboard rows")
+    finally:
+        db.close()
@@ -1,8 +1,13 @@
 import os
-from fastapi import FastAPI, Depends, HTTPException, Header
+import asyncio
+import contextvars
+from contextlib import asynccontextmanager
+from fastapi import FastAPI, Depends, HTTPException, Header, BackgroundTasks, UploadFile, File, Request
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, FileResponse, HTMLResponse
 from sqlalchemy import Column, Integer, String, DateTime
 from sqlalchemy.orm import Session
+from sqlalchemy.exc import IntegrityError
 from passlib.context import CryptContext
 from jose import jwt, JWTError
 from pydantic import BaseModel
@@ -10,6 +15,26 @@ from datetime import datetime, timedelta
 from fastapi_mail import FastMail, MessageSchema, ConnectionConfig
 from .database import engine, Base, SessionLocal
 from . import models
+from . import events
+from . import rollups
+from . import exports
+from . import profiling
+from . import thumbnails
+from . import media_jobs
+from . import sync
+from . import compression
+from . import ordering
+from . import leaderboards
+from . import notifications
+from . import admin_stats
+from . import archival
+from . import singleflight
+from . import course_counters
+from . import audit
+from . import user_search
+from . import membership
+from . import admission
+from . import leader
 from .models import User, Course  # Import User model from models.py
 try:
     from .admin_config import ADMIN_EMAIL, ADMIN_PASSWORD, ADMIN_NAME
@@ -49,11 +74,39 @@ if MAIL_USERNAME and MAIL_PASSWORD and MAIL_FROM:
 
 SECRET_KEY = os.getenv("SECRET_KEY", "CHANGE_THIS_SECRET_LATER")
 ALGORITHM = "HS256"
-ACCESS_TOKEN_EXPIRE_MINUTES = 1440  # 24 hours
+ACCESS_TOKEN_EXPIRE_MINUTES = int(os.getenv("ACCESS_TOKEN_EXPIRE_MINUTES", "15"))
+REFRESH_TOKEN_EXPIRE_DAYS = int(os.getenv("REFRESH_TOKEN_EXPIRE_DAYS", "30"))
+REFRESH_TOKEN_REUSE_HISTORY = 5  # used tokens kept per session so replaying them revokes it
+REFRESH_TOKEN_PRUNE_MINUTES = 60
+ADMIN_TOKEN_EXPIRE_MINUTES = 1440  # admin has no user row to hang refresh tokens on
 
 # -------------------- APP --------------------
 
-app = FastAPI(title="Sikhiya Connect Backend")
+# Background work registers async callables here; they run in registration order.
+# Work that must run once per deployment (schedulers, backfills, job runners)
+# goes in leader_tasks, which start only in the elected process (see app.leader);
+# leader_stop_tasks undo them if that process loses the lock.
+startup_tasks = []
+leader_tasks = []
+leader_stop_tasks = []
+shutdown_tasks = []
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    for task in startup_tasks:
+        await task()
+    campaign = asyncio.create_task(leader.campaign(leader_tasks, leader_stop_tasks))
+    yield
+    campaign.cancel()
+    for task in shutdown_tasks:
+        await task()
+    leader.release()
+
+app = FastAPI(title="Sikhiya Connect Backend", lifespan=lifespan)
+app.router.route_class = profiling.ProfiledRoute
+
+# Added first so it sits inside CORS: shed 503s still carry the CORS headers
+app.add_middleware(admission.AdmissionMiddleware)
 
 cors_origins_raw = os.getenv("CORS_ORIGINS", "*")
 cors_origins = ["*"] if cors_origins_raw.strip() == "*" else [
@@ -69,6 +122,10 @@ app.add_middleware(
     allow_headers=["*"],
 )
 
+app.add_middleware(compression.CompressionMiddleware)
+
+# Admin-triggered profiling; added after the admin check is defined, see below
+
 # -------------------- DATABASE --------------------
 # MySQL Database configuration is imported from database.py
 # SessionLocal and engine are already imported from database module
@@ -87,8 +144,8 @@ def verify_password(password: str, hashed: str):
 def is_admin_credentials(email: str, password: str):
     return email == ADMIN_EMAIL and password == ADMIN_PASSWORD
 
-def create_access_token(data: dict):
-    expire = datetime.utcnow() + timedelta(minutes=ACCESS_TOKEN_EXPIRE_MINUTES)
+def create_access_token(data: dict, expire_minutes: int = None):
+    expire = datetime.utcnow() + timedelta(minutes=expire_minutes or ACCESS_TOKEN_EXPIRE_MINUTES)
     to_encode = {**data, "exp": expire}
     return jwt.encode(to_encode, SECRET_KEY, algorithm=ALGORITHM)
 import random
@@ -108,6 +165,30 @@ def generate_temp_password(length: int = 10):
     alphabet = "ABCDEFGHJKLMNPQRSTUVWXYZabcdefghijkmnopqrstuvwxyz23456789"
     return "".join(secrets.choice(alphabet) for _ in range(length))
 
+def hash_refresh_token(token: str):
+    return hashlib.sha256(token.encode()).hexdigest()
+
+def issue_refresh_token(db: Session, user_id: int, family_id: str = None):
+    """Store a new refresh token and return the raw value; the caller commits"""
+    from .models import RefreshToken
+
+    token = secrets.token_urlsafe(32)
+    now = datetime.utcnow()
+    db.add(RefreshToken(
+        user_id=user_id,
+        token_hash=hash_refresh_token(token),
+        family_id=family_id or secrets.token_hex(16),
+        expires_at=now + timedelta(days=REFRESH_TOKEN_EXPIRE_DAYS),
+        created_at=now,
+    ))
+    return token
+
+def revoke_refresh_tokens(db: Session, user_id: int):
+    """Log a user out everywhere; the caller commits"""
+    from .models import RefreshToken
+
+    db.query(RefreshToken).filter(RefreshToken.user_id == user_id).delete(synchronize_session=False)
+
 # -------------------- MODELS --------------------
 # User model is imported from models.py
 
@@ -144,6 +225,13 @@ def get_db():
     finally:
         db.close()
 
+def coalesce(key, load):
+    """Share one run of load() among concurrent requests for the same key"""
+    try:
+        return singleflight.group.do(key, load)
+    except TimeoutError:
+        raise HTTPException(status_code=504, detail="Timed out waiting for a shared query")
+
 # -------------------- ROUTES --------------------
 
 @app.get("/")
@@ -166,6 +254,8 @@ def register(data: RegisterRequest, db: Session = Depends(get_db)):
     )
 
     db.add(user)
+    db.flush()
+    user_search.index_user(db, user)
     db.commit()
     db.refresh(user)
 
@@ -178,7 +268,7 @@ def login(data: LoginRequest, db: Session = Depends(get_db)):
             "user_id": 0,
             "email": ADMIN_EMAIL,
             "role": "admin",
-        })
+        }, expire_minutes=ADMIN_TOKEN_EXPIRE_MINUTES)
 
         return {
             "access_token": token,
@@ -195,14 +285,24 @@ def login(data: LoginRequest, db: Session = Depends(get_db)):
     if not user or not verify_password(data.password, user.password):
         raise HTTPException(status_code=401, detail="Invalid credentials")
 
+    from .models import RefreshToken
+
     token = create_access_token({
         "user_id": user.id,
         "email": user.email,
         "role": user.role,
     })
+    # Drop this user's expired refresh tokens while we're here
+    db.query(RefreshToken).filter(
+        RefreshToken.user_id == user.id, RefreshToken.expires_at < datetime.utcnow()
+    ).delete(synchronize_session=False)
+    refresh_token = issue_refresh_token(db, user.id)
+    db.commit()
 
     return {
         "access_token": token,
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
         "token_type": "bearer",
         "user": {
             "id": user.id,
@@ -215,6 +315,106 @@ def login(data: LoginRequest, db: Session = Depends(get_db)):
         }
     }
 
+# -------------------- REFRESH TOKENS --------------------
+class RefreshTokenRequest(BaseModel):
+    refresh_token: str
+
+@app.post("/token/refresh")
+def refresh_access_token(data: RefreshTokenRequest, db: Session = Depends(get_db)):
+    """Trade a refresh token for a new access token and a rotated refresh token"""
+    from .models import RefreshToken
+
+    stored = db.query(RefreshToken).filter(RefreshToken.token_hash == hash_refresh_token(data.refresh_token)).first()
+    if not stored or stored.expires_at < datetime.utcnow():
+        raise HTTPException(status_code=401, detail="Invalid refresh token")
+
+    # Only one caller can rotate a token; anyone presenting it afterwards holds a stolen copy
+    now = datetime.utcnow()
+    rotated = db.query(RefreshToken).filter(
+        RefreshToken.id == stored.id, RefreshToken.used_at.is_(None)
+    ).update({RefreshToken.used_at: now}, synchronize_session=False)
+    if rotated != 1:
+        user_id, family_id = stored.user_id, stored.family_id
+        db.query(RefreshToken).filter(RefreshToken.family_id == family_id).delete(synchronize_session=False)
+        db.commit()
+        print(f"Refresh token reuse detected for user {user_id}; session revoked")
+        raise HTTPException(status_code=401, detail="Refresh token already used")
+
+    user = db.query(User).filter(User.id == stored.user_id).first()
+    if not user:
+        raise HTTPException(status_code=401, detail="User not found")
+
+    token = create_access_token({
+        "user_id": user.id,
+        "email": user.email,
+        "role": user.role,
+    })
+    refresh_token = issue_refresh_token(db, user.id, stored.family_id)
+
+    # Forget all but the latest used tokens of this session; replaying an older one is just rejected
+    forgotten = [
+        row.id for row in db.query(RefreshToken.id).filter(
+            RefreshToken.family_id == stored.family_id, RefreshToken.used_at.isnot(None)
+        ).order_by(RefreshToken.id.desc()).offset(REFRESH_TOKEN_REUSE_HISTORY).all()
+    ]
+    if forgotten:
+        db.query(RefreshToken).filter(RefreshToken.id.in_(forgotten)).delete(synchronize_session=False)
+    db.commit()
+
+    return {
+        "access_token": token,
+        "refresh_token": refresh_token,
+        "expires_in": ACCESS_TOKEN_EXPIRE_MINUTES * 60,
+        "token_type": "bearer",
+    }
+
+@app.post("/logout")
+def logout(data: RefreshTokenRequest, db: Session = Depends(get_db)):
+    """Revoke the session the refresh token belongs to"""
+    from .models import RefreshToken
+
+    stored = db.query(RefreshToken.family_id).filter(RefreshToken.token_hash == hash_refresh_token(data.refresh_token)).first()
+    if stored:
+        db.query(RefreshToken).filter(RefreshToken.family_id == stored.family_id).delete(synchronize_session=False)
+        db.commit()
+    return {"message": "Logged out"}
+
+def prune_refresh_tokens():
+    """Delete expired refresh tokens; they are rejected before reuse detection runs"""
+    from .models import RefreshToken
+
+    db = SessionLocal()
+    try:
+        deleted = db.query(RefreshToken).filter(
+            RefreshToken.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.commit()
+        return deleted
+    finally:
+        db.close()
+
+async def refresh_token_pruner():
+    while True:
+        try:
+            deleted = await asyncio.to_thread(prune_refresh_tokens)
+            if deleted:
+                print(f"Pruned {deleted} expired refresh tokens")
+        except Exception as e:
+            print(f"Refresh token pruning failed: {e}")
+        await asyncio.sleep(REFRESH_TOKEN_PRUNE_MINUTES * 60)
+
+async def start_refresh_token_pruner():
+    app.state.refresh_token_pruner = asyncio.create_task(refresh_token_pruner())
+
+async def stop_refresh_token_pruner():
+    task = getattr(app.state, "refresh_token_pruner", None)
+    if task:
+        task.cancel()
+
+leader_tasks.append(start_refresh_token_pruner)
+leader_stop_tasks.append(stop_refresh_token_pruner)
+shutdown_tasks.append(stop_refresh_token_pruner)
+
 # -------------------- FORGOT PASSWORD --------------------
 class ForgotPasswordRequest(BaseModel):
     email: str
@@ -279,14 +479,22 @@ def reset_password(data: ResetPasswordRequest, db: Session = Depends(get_db)):
     user.password = hash_password(data.new_password)
     user.reset_otp = None
     user.otp_expiry = None
+    revoke_refresh_tokens(db, user.id)
 
     db.commit()
     return {"message": "Password reset successful"}
 
 # -------------------- DASHBOARD --------------------
 
+batch_auth = contextvars.ContextVar("batch_auth", default=None)
+
 def get_current_user(authorization: str = Header(None), db: Session = Depends(get_db)):
     """Extract user from JWT token in Authorization header"""
+    # Sub-requests of /batch reuse the user the batch already authenticated
+    batch_user = batch_auth.get()
+    if batch_user is not None and batch_user[0] == authorization:
+        return batch_user[1]
+
     if not authorization:
         raise HTTPException(status_code=401, detail="Authorization header required")
     
@@ -328,6 +536,8 @@ def get_current_admin(authorization: str = Header(None)):
 
     return {"email": payload.get("email"), "role": role}
 
+app.add_middleware(profiling.ProfilingMiddleware, engine=engine, authorize_admin=get_current_admin)
+
 def get_current_teacher(user: User = Depends(get_current_user)):
     if user.role != "teacher":
         raise HTTPException(status_code=403, detail="Teacher access required")
@@ -368,17 +578,18 @@ def get_teacher_courses(teacher: User = Depends(get_current_teacher), db: Sessio
                 "teacherName": teacher.name,
                 "modules": [],
                 "thumbnail": c.thumbnail,
+                "thumbnail_variants": thumbnails.course_thumbnail_variants(c),
                 "target_class": c.target_class,
                 "target_board": c.target_board,
                 "createdAt": c.created_at,
-                "studentCount": 0,
+                **course_counters.summary(c),
             }
             for c in courses
         ]
     }
 
 @app.post("/teacher/courses")
-def create_teacher_course(data: CreateCourseRequest, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+def create_teacher_course(data: CreateCourseRequest, background_tasks: BackgroundTasks, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
     course = Course(
         title=data.title,
         description=data.description,
@@ -393,6 +604,7 @@ def create_teacher_course(data: CreateCourseRequest, teacher: User = Depends(get
     db.add(course)
     db.commit()
     db.refresh(course)
+    background_tasks.add_task(notifications.fan_out_course, course.id, "course.published", check_course_access)
     return {
         "course": {
             "id": course.id,
@@ -407,31 +619,35 @@ def create_teacher_course(data: CreateCourseRequest, teacher: User = Depends(get
             "modules": [],
             "thumbnail": course.thumbnail,
             "createdAt": course.created_at,
-            "studentCount": 0,
+            **course_counters.summary(course),
         }
     }
 
 @app.get("/teacher/courses/{course_id}")
 def get_teacher_course(course_id: int, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
-    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
+    def load_course():
+        course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+        if not course:
+            raise HTTPException(status_code=404, detail="Course not found")
+        
+        return {
+            "id": course.id,
+            "title": course.title,
+            "description": course.description,
+            "level": course.level,
+            "duration_hours": course.duration_hours,
+            "thumbnail": course.thumbnail,
+            "target_class": course.target_class,
+            "target_board": course.target_board,
+            "teacher_id": course.teacher_id,
+            "created_at": course.created_at,
+            "summary": course_counters.summary(course),
+        }
     
-    return {
-        "id": course.id,
-        "title": course.title,
-        "description": course.description,
-        "level": course.level,
-        "duration_hours": course.duration_hours,
-        "thumbnail": course.thumbnail,
-        "target_class": course.target_class,
-        "target_board": course.target_board,
-        "teacher_id": course.teacher_id,
-        "created_at": course.created_at,
-    }
+    return coalesce(("teacher.course", teacher.id, course_id), load_course)
 
 @app.put("/teacher/courses/{course_id}")
-def update_teacher_course(course_id: int, data: CreateCourseRequest, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+def update_teacher_course(course_id: int, data: CreateCourseRequest, background_tasks: BackgroundTasks, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
     course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
@@ -444,9 +660,15 @@ def update_teacher_course(course_id: int, data: CreateCourseRequest, teacher: Us
         course.thumbnail = data.thumbnail
     course.target_class = data.target_class
     course.target_board = data.target_board
+
+    from .models import StudentFeedEntry
+    db.query(StudentFeedEntry).filter(StudentFeedEntry.course_id == course_id).update(
+        {StudentFeedEntry.course_title: course.title}, synchronize_session=False
+    )
     
     db.commit()
     db.refresh(course)
+    background_tasks.add_task(notifications.fan_out_course, course.id, "course.updated")
     
     return {
         "id": course.id,
@@ -466,12 +688,121 @@ def delete_teacher_course(course_id: int, teacher: User = Depends(get_current_te
     course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
+
+    from .models import StudentFeedEntry, LeaderboardScore
+    db.query(StudentFeedEntry).filter(StudentFeedEntry.course_id == course_id).delete()
+    db.query(LeaderboardScore).filter(LeaderboardScore.board_key == leaderboards.course_board(course_id)).delete()
     
     db.delete(course)
     db.commit()
+    leaderboards.forget_board(leaderboards.course_board(course_id))
+    membership.forget_course(course_id)
     
     return {"message": "Course deleted successfully"}
 
+class CloneCourseRequest(BaseModel):
+    title: str = None
+
+@app.post("/teacher/courses/{course_id}/clone")
+def clone_teacher_course(course_id: int, data: CloneCourseRequest = None, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Copy a course with its modules, lessons and resources; media files are shared, not copied"""
+    from sqlalchemy import select, insert, literal, case
+    from .models import CourseModule, CourseLesson, CourseResource, MediaJob
+
+    source = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    if not source:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    now = datetime.utcnow()
+    course = Course(
+        title=(data.title if data and data.title else f"{source.title} (Copy)"),
+        description=source.description,
+        level=source.level,
+        duration_hours=source.duration_hours,
+        thumbnail=source.thumbnail,
+        thumbnail_variants=source.thumbnail_variants,
+        teacher_id=teacher.id,
+        target_class=source.target_class,
+        target_board=source.target_board,
+        created_at=now,
+    )
+    db.add(course)
+    db.flush()
+    # INSERT ... SELECT bypasses the flush hook, so stamp the sync version here
+    version = sync.next_version(db)
+
+    db.execute(insert(CourseModule).from_select(
+        ["course_id", "title", "description", "order", "created_at", "sync_version"],
+        select(
+            literal(course.id), CourseModule.title, CourseModule.description, CourseModule.order,
+            literal(now), literal(version),
+        ).where(CourseModule.course_id == course_id).order_by(CourseModule.id),
+    ))
+
+    # Rows were inserted in source id order, so pairing both id lists remaps old modules to new
+    old_module_ids = db.execute(
+        select(CourseModule.id).where(CourseModule.course_id == course_id).order_by(CourseModule.id)
+    ).scalars().all()
+    new_module_ids = db.execute(
+        select(CourseModule.id).where(CourseModule.course_id == course.id).order_by(CourseModule.id)
+    ).scalars().all()
+    module_map = dict(zip(old_module_ids, new_module_ids))
+
+    lesson_count = 0
+    if module_map:
+        # HLS renditions are served from HLS_DIR/<lesson_id>, so the copies start without a
+        # playlist and get their own media job; the uploaded video itself is shared
+        lesson_count = db.execute(insert(CourseLesson).from_select(
+            ["module_id", "title", "description", "video_file", "duration_seconds", "order", "created_at", "sync_version"],
+            select(
+                case(module_map, value=CourseLesson.module_id), CourseLesson.title, CourseLesson.description,
+                CourseLesson.video_file, CourseLesson.duration_seconds, CourseLesson.order,
+                literal(now), literal(version),
+            ).where(CourseLesson.module_id.in_(old_module_ids)).order_by(CourseLesson.id),
+        )).rowcount
+        db.execute(insert(MediaJob).from_select(
+            ["lesson_id", "status", "attempts", "created_at"],
+            select(CourseLesson.id, literal("queued"), literal(0), literal(now)).where(
+                CourseLesson.module_id.in_(new_module_ids),
+                CourseLesson.video_file.isnot(None),
+            ).order_by(CourseLesson.id),
+        ))
+
+    resource_count = db.execute(insert(CourseResource).from_select(
+        ["course_id", "title", "file_path", "file_type", "size_mb", "created_at", "sync_version"],
+        select(
+            literal(course.id), CourseResource.title, CourseResource.file_path, CourseResource.file_type,
+            CourseResource.size_mb, literal(now), literal(version),
+        ).where(CourseResource.course_id == course_id).order_by(CourseResource.id),
+    )).rowcount
+
+    course_counters.recount(db, course.id)
+    db.commit()
+    db.refresh(course)
+
+    return {
+        "course": {
+            "id": course.id,
+            "title": course.title,
+            "description": course.description,
+            "level": course.level,
+            "duration": course.duration_hours,
+            "target_class": course.target_class,
+            "target_board": course.target_board,
+            "teacherId": course.teacher_id,
+            "teacherName": teacher.name,
+            "modules": [],
+            "thumbnail": course.thumbnail,
+            "createdAt": course.created_at,
+            **course_counters.summary(course),
+        },
+        "copied": {
+            "modules": len(module_map),
+            "lessons": lesson_count,
+            "resources": resource_count,
+        },
+    }
+
 @app.get("/teacher/students")
 def get_teacher_students(teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
     """Get all students enrolled in the teacher's courses"""
@@ -533,6 +864,41 @@ def get_teacher_dashboard(teacher: User = Depends(get_current_teacher), db: Sess
         "questions": []
     }
 
+@app.get("/admin/users/search")
+def search_admin_users(
+    q: str,
+    role: str = None,
+    board: str = None,
+    student_class: str = None,
+    limit: int = 20,
+    admin=Depends(get_current_admin),
+    db: Session = Depends(get_db),
+):
+    """Typeahead lookup by name or email prefix; every word of q must match"""
+    limit = max(1, min(limit, 50))
+    users = user_search.search(db, q, role=role, board=board, student_class=student_class, limit=limit)
+    return {
+        "users": [
+            {
+                "id": u.id,
+                "name": u.name,
+                "email": u.email,
+                "role": u.role,
+                "board": u.board,
+                "student_class": u.student_class,
+                "teacher_status": u.teacher_status,
+                "avatar": u.name[0].upper() if u.name else "?",
+            }
+            for u in users
+        ],
+        "count": len(users),
+    }
+
+async def backfill_user_search():
+    user_search.start_backfill()
+
+leader_tasks.append(backfill_user_search)
+
 @app.get("/admin/teachers")
 def get_admin_teachers(status: str = None, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
     query = db.query(User).filter(User.role == "teacher")
@@ -555,6 +921,28 @@ def get_admin_teachers(status: str = None, admin=Depends(get_current_admin), db:
         ]
     }
 
+@app.get("/admin/stats")
+def get_admin_stats(admin=Depends(get_current_admin)):
+    """Platform-wide counts; may be up to ADMIN_STATS_TTL seconds old"""
+    stats, stale = admin_stats.get_stats()
+    return {**stats, "stale": stale}
+
+async def warm_admin_stats():
+    try:
+        await asyncio.to_thread(admin_stats.refresh)
+    except Exception as e:
+        print(f"Admin stats warm-up failed: {e}")
+
+startup_tasks.append(warm_admin_stats)
+
+# async so it reads the controller on the event loop that updates it
+@app.get("/admin/admission")
+async def get_admission_metrics(admin=Depends(get_current_admin)):
+    """In-flight requests, queueing delay and shed counts per priority class"""
+    if admission.controller is None:
+        return {"enabled": False}
+    return {"enabled": True, **admission.controller.metrics()}
+
 @app.delete("/admin/users/{user_id}")
 def delete_user(user_id: int, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
     user = db.query(User).filter(User.id == user_id).first()
@@ -562,6 +950,12 @@ def delete_user(user_id: int, admin=Depends(get_current_admin), db: Session = De
         raise HTTPException(status_code=404, detail="User not found")
     if user.role == "admin":
         raise HTTPException(status_code=400, detail="Cannot delete admin user")
+
+    from .models import (
+        CourseModule, CourseLesson, CourseResource,
+        StudentCourseEnrollment, StudentLessonProgress, StudentFeedEntry, LeaderboardScore, Notification,
+        LessonProgressArchive, EnrollmentArchive,
+    )
     
     # If teacher, delete their courses first (cascade delete)
     if user.role == "teacher":
@@ -569,6 +963,12 @@ def delete_user(user_id: int, admin=Depends(get_current_admin), db: Session = De
         for course in courses:
             # Delete related resources
             db.query(CourseResource).filter(CourseResource.course_id == course.id).delete()
+            # Delete continue-learning feed entries
+            db.query(StudentFeedEntry).filter(StudentFeedEntry.course_id == course.id).delete()
+            # Delete the course leaderboard
+            db.query(LeaderboardScore).filter(LeaderboardScore.board_key == leaderboards.course_board(course.id)).delete()
+            leaderboards.forget_board(leaderboards.course_board(course.id))
+            membership.forget_course(course.id)
             # Delete lesson progress
             db.query(StudentLessonProgress).filter(
                 StudentLessonProgress.lesson_id.in_(
@@ -579,6 +979,15 @@ def delete_user(user_id: int, admin=Depends(get_current_admin), db: Session = De
                     )
                 )
             ).delete()
+            db.query(LessonProgressArchive).filter(
+                LessonProgressArchive.lesson_id.in_(
+                    db.query(CourseLesson.id).filter(
+                        CourseLesson.module_id.in_(
+                            db.query(CourseModule.id).filter(CourseModule.course_id == course.id)
+                        )
+                    )
+                )
+            ).delete(synchronize_session=False)
             # Delete lessons
             db.query(CourseLesson).filter(
                 CourseLesson.module_id.in_(
@@ -589,16 +998,35 @@ def delete_user(user_id: int, admin=Depends(get_current_admin), db: Session = De
             db.query(CourseModule).filter(CourseModule.course_id == course.id).delete()
             # Delete enrollments
             db.query(StudentCourseEnrollment).filter(StudentCourseEnrollment.course_id == course.id).delete()
+            db.query(EnrollmentArchive).filter(EnrollmentArchive.course_id == course.id).delete()
             # Delete the course
             db.delete(course)
     
     # Delete student enrollments
+    for (course_id,) in db.query(StudentCourseEnrollment.course_id).filter(
+        StudentCourseEnrollment.student_id == user_id, StudentCourseEnrollment.status == "approved"
+    ).all():
+        course_counters.bump(db, course_id, student_count=-1)
+    sync.record_bulk_tombstones(db, StudentCourseEnrollment.__tablename__, db.query(
+        StudentCourseEnrollment.id, StudentCourseEnrollment.course_id, StudentCourseEnrollment.student_id
+    ).filter(StudentCourseEnrollment.student_id == user_id).all())
     db.query(StudentCourseEnrollment).filter(StudentCourseEnrollment.student_id == user_id).delete()
     # Delete lesson progress
     db.query(StudentLessonProgress).filter(StudentLessonProgress.student_id == user_id).delete()
-    
+    db.query(LessonProgressArchive).filter(LessonProgressArchive.student_id == user_id).delete()
+    db.query(EnrollmentArchive).filter(EnrollmentArchive.student_id == user_id).delete()
+    db.query(StudentFeedEntry).filter(StudentFeedEntry.student_id == user_id).delete()
+    db.query(LeaderboardScore).filter(LeaderboardScore.student_id == user_id).delete()
+    db.query(Notification).filter(Notification.user_id == user_id).delete()
+    revoke_refresh_tokens(db, user_id)
+    user_search.remove_user(db, user_id)
+    
+    deleted_email, deleted_role = user.email, user.role
     db.delete(user)
     db.commit()
+    leaderboards.forget_student(user_id)
+    membership.invalidate(user_id)
+    audit.record(admin, "user.delete", "user", user_id, email=deleted_email, role=deleted_role)
     return {"message": "User deleted"}
 
 @app.post("/admin/users/{user_id}/reset-password")
@@ -613,7 +1041,9 @@ def reset_user_password(user_id: int, admin=Depends(get_current_admin), db: Sess
     user.password = hash_password(temp_password)
     user.reset_otp = None
     user.otp_expiry = None
+    revoke_refresh_tokens(db, user.id)
     db.commit()
+    audit.record(admin, "user.reset_password", "user", user.id, email=user.email)
     return {"message": "Password reset", "temporaryPassword": temp_password}
 
 @app.post("/admin/teachers/{teacher_id}/approve")
@@ -623,6 +1053,7 @@ def approve_teacher(teacher_id: int, admin=Depends(get_current_admin), db: Sessi
         raise HTTPException(status_code=404, detail="Teacher not found")
     teacher.teacher_status = "approved"
     db.commit()
+    audit.record(admin, "teacher.approve", "user", teacher.id, email=teacher.email)
     return {"message": "Teacher approved"}
 
 @app.post("/admin/teachers/{teacher_id}/reject")
@@ -632,6 +1063,7 @@ def reject_teacher(teacher_id: int, admin=Depends(get_current_admin), db: Sessio
         raise HTTPException(status_code=404, detail="Teacher not found")
     teacher.teacher_status = "rejected"
     db.commit()
+    audit.record(admin, "teacher.reject", "user", teacher.id, email=teacher.email)
     return {"message": "Teacher rejected"}
 
 @app.get("/dashboard")
@@ -692,52 +1124,61 @@ def get_course_modules(course_id: int, teacher: User = Depends(get_current_teach
     """Get all modules for a course"""
     from .models import CourseModule, CourseLesson
     
-    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
-    if not course:
-        raise HTTPException(status_code=404, detail="Course not found")
-    
-    modules = db.query(CourseModule).filter(CourseModule.course_id == course_id).order_by(CourseModule.order).all()
-    
-    result = []
-    for module in modules:
-        lessons = db.query(CourseLesson).filter(CourseLesson.module_id == module.id).order_by(CourseLesson.order).all()
-        result.append({
-            "id": module.id,
-            "title": module.title,
-            "description": module.description,
-            "lessons": [
-                {
-                    "id": l.id,
-                    "title": l.title,
-                    "video_file": l.video_file,
-                    "duration_seconds": l.duration_seconds,
-                }
-                for l in lessons
-            ]
-        })
+    def load_modules():
+        course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+        if not course:
+            raise HTTPException(status_code=404, detail="Course not found")
+        
+        modules = db.query(CourseModule).filter(CourseModule.course_id == course_id).order_by(CourseModule.order, CourseModule.id).all()
+        
+        result = []
+        for module in modules:
+            lessons = db.query(CourseLesson).filter(CourseLesson.module_id == module.id).order_by(CourseLesson.order, CourseLesson.id).all()
+            result.append({
+                "id": module.id,
+                "title": module.title,
+                "description": module.description,
+                "lessons": [
+                    {
+                        "id": l.id,
+                        "title": l.title,
+                        "video_file": l.video_file,
+                        "hls_url": f"/media/hls/{l.id}/master.m3u8" if l.hls_playlist else None,
+                        "duration_seconds": l.duration_seconds,
+                    }
+                    for l in lessons
+                ]
+            })
+        
+        return {"modules": result}
     
-    return {"modules": result}
+    return coalesce(("teacher.course.modules", teacher.id, course_id), load_modules)
 
 @app.post("/teacher/courses/{course_id}/modules")
 def create_course_module(course_id: int, title: str = None, description: str = None, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
     """Create a module for a course"""
     from .models import CourseModule
     
-    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    from sqlalchemy import func
+    
+    # Lock the course row so concurrent appends and reorders don't pick the same key
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).with_for_update().first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
     # Parse JSON body
     import json
     
+    last_order = db.query(func.max(CourseModule.order)).filter(CourseModule.course_id == course_id).scalar()
     module = CourseModule(
         course_id=course_id,
         title=title or "Untitled Module",
         description=description,
-        order=0,
+        order=ordering.next_order(last_order),
         created_at=datetime.utcnow(),
     )
     db.add(module)
+    course_counters.bump(db, course_id, module_count=1)
     db.commit()
     db.refresh(module)
     
@@ -756,9 +1197,10 @@ def create_lesson(
     db: Session = Depends(get_db),
 ):
     """Create a lesson in a module"""
+    from sqlalchemy import func
     from .models import CourseModule, CourseLesson
     
-    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).with_for_update().first()
     if not course:
         raise HTTPException(status_code=404, detail="Course not found")
     
@@ -766,14 +1208,16 @@ def create_lesson(
     if not module:
         raise HTTPException(status_code=404, detail="Module not found")
     
+    last_order = db.query(func.max(CourseLesson.order)).filter(CourseLesson.module_id == module_id).scalar()
     lesson = CourseLesson(
         module_id=module_id,
         title=title or "Untitled Lesson",
         duration_seconds=0,
-        order=0,
+        order=ordering.next_order(last_order),
         created_at=datetime.utcnow(),
     )
     db.add(lesson)
+    course_counters.bump(db, course_id, lesson_count=1)
     db.commit()
     db.refresh(lesson)
     
@@ -783,6 +1227,62 @@ def create_lesson(
         "duration_seconds": lesson.duration_seconds,
     }
 
+class ReorderRequest(BaseModel):
+    ids: list[int]
+
+def reorder_siblings(db: Session, model, sibling_filter, requested_ids):
+    """Move rows to the requested relative order, rewriting as few order keys as possible"""
+    from sqlalchemy import case
+
+    if len(set(requested_ids)) != len(requested_ids):
+        raise HTTPException(status_code=400, detail="Duplicate ids in ordering")
+    current = db.query(model.id, model.order).filter(sibling_filter).all()
+    unknown = set(requested_ids) - {row.id for row in current}
+    if unknown:
+        raise HTTPException(status_code=400, detail=f"Unknown ids: {sorted(unknown)}")
+
+    updates, rebalanced = ordering.plan_reorder([(row.id, row.order) for row in current], requested_ids)
+    if updates:
+        # Bulk update bypasses the flush hook, so stamp the sync version here
+        db.query(model).filter(model.id.in_(list(updates))).update({
+            model.order: case(updates, value=model.id),
+            model.sync_version: sync.next_version(db),
+        }, synchronize_session=False)
+    db.commit()
+
+    rows = db.query(model.id, model.order).filter(sibling_filter).order_by(model.order, model.id).all()
+    return {
+        "order": [{"id": row.id, "order": row.order} for row in rows],
+        "updated": len(updates),
+        "rebalanced": rebalanced,
+    }
+
+@app.put("/teacher/courses/{course_id}/modules/order")
+def reorder_course_modules(course_id: int, data: ReorderRequest, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Reorder modules; ids may list all modules or just the ones being moved"""
+    from .models import CourseModule
+
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).with_for_update().first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    return reorder_siblings(db, CourseModule, CourseModule.course_id == course_id, data.ids)
+
+@app.put("/teacher/courses/{course_id}/modules/{module_id}/lessons/order")
+def reorder_module_lessons(course_id: int, module_id: int, data: ReorderRequest, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Reorder lessons within a module; ids may list all lessons or just the ones being moved"""
+    from .models import CourseModule, CourseLesson
+
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).with_for_update().first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    module = db.query(CourseModule).filter(CourseModule.id == module_id, CourseModule.course_id == course_id).first()
+    if not module:
+        raise HTTPException(status_code=404, detail="Module not found")
+
+    return reorder_siblings(db, CourseLesson, CourseLesson.module_id == module_id, data.ids)
+
 @app.get("/teacher/courses/{course_id}/resources")
 def get_course_resources(course_id: int, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
     """Get all resources for a course"""
@@ -825,6 +1325,7 @@ def upload_course_resource(course_id: int, teacher: User = Depends(get_current_t
         created_at=datetime.utcnow(),
     )
     db.add(resource)
+    course_counters.bump(db, course_id, resource_count=1, resource_size_mb=resource.size_mb or 0)
     db.commit()
     db.refresh(resource)
     
@@ -854,6 +1355,7 @@ def delete_course_resource(course_id: int, resource_id: int, teacher: User = Dep
         raise HTTPException(status_code=404, detail="Resource not found")
     
     db.delete(resource)
+    course_counters.bump(db, course_id, resource_count=-1, resource_size_mb=-(resource.size_mb or 0))
     db.commit()
     
     return {"message": "Resource deleted successfully"}
@@ -892,27 +1394,45 @@ def get_available_courses(user: User = Depends(get_current_user), db: Session =
     if user.role != "student":
         raise HTTPException(status_code=403, detail="Only students can access this endpoint")
     
-    courses = db.query(Course).all()
-    available = []
-    
-    for course in courses:
-        if check_course_access(user, course):
-            teacher = db.query(User).filter(User.id == course.teacher_id).first()
-            available.append({
-                "id": course.id,
-                "title": course.title,
-                "description": course.description,
-                "level": course.level,
-                "duration_hours": course.duration_hours,
-                "thumbnail": course.thumbnail,
-                "target_class": course.target_class,
-                "target_board": course.target_board,
-                "teacher_id": course.teacher_id,
-                "teacher_name": teacher.name if teacher else "Unknown",
-                "created_at": course.created_at,
-            })
-    
-    return {"courses": available, "count": len(available)}
+    def load_available():
+        courses = db.query(Course).all()
+        available = []
+        
+        for course in courses:
+            if check_course_access(user, course):
+                teacher = db.query(User).filter(User.id == course.teacher_id).first()
+                available.append({
+                    "id": course.id,
+                    "title": course.title,
+                    "description": course.description,
+                    "level": course.level,
+                    "duration_hours": course.duration_hours,
+                    "thumbnail": course.thumbnail,
+                    "thumbnail_variants": thumbnails.course_thumbnail_variants(course),
+                    "target_class": course.target_class,
+                    "target_board": course.target_board,
+                    "teacher_id": course.teacher_id,
+                    "teacher_name": teacher.name if teacher else "Unknown",
+                    "created_at": course.created_at,
+                    "summary": course_counters.summary(course),
+                })
+        
+        return {"courses": available, "count": len(available)}
+    
+    # The list depends only on class and board, so a whole class shares one query
+    return coalesce(("courses.available", user.student_class, user.board), load_available)
+
+def publish_enrollment_status(event_type: str, enrollment_id: int, course_id: int, student_id: int, status: str):
+    """Notify the course's teacher and the student that an enrollment changed"""
+    event = {
+        "type": event_type,
+        "enrollment_id": enrollment_id,
+        "course_id": course_id,
+        "student_id": student_id,
+        "status": status,
+    }
+    events.publish(events.course_channel(course_id), event)
+    events.publish(events.student_channel(student_id), event)
 
 @app.post("/courses/{course_id}/enroll")
 def request_enrollment(course_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
@@ -934,7 +1454,7 @@ def request_enrollment(course_id: int, user: User = Depends(get_current_user), d
     existing = db.query(StudentCourseEnrollment).filter(
         StudentCourseEnrollment.student_id == user.id,
         StudentCourseEnrollment.course_id == course_id
-    ).first()
+    ).first() or archival.archived_enrollment(db, user.id, course_id)
     
     if existing:
         if existing.status == "pending":
@@ -952,6 +1472,17 @@ def request_enrollment(course_id: int, user: User = Depends(get_current_user), d
     )
     db.add(enrollment)
     db.commit()
+
+    events.publish(events.course_channel(course_id), {
+        "type": "enrollment.requested",
+        "enrollment_id": enrollment.id,
+        "course_id": course_id,
+        "student_id": user.id,
+        "student_name": user.name,
+        "student_email": user.email,
+        "requested_at": enrollment.enrolled_at,
+        "status": "pending",
+    })
     
     return {"message": "Enrollment request sent to teacher", "enrollment_id": enrollment.id, "status": "pending"}
 
@@ -971,8 +1502,15 @@ def approve_enrollment(course_id: int, enrollment_id: int, teacher: User = Depen
     if not enrollment:
         raise HTTPException(status_code=404, detail="Enrollment request not found")
     
+    if enrollment.status != "approved":
+        course_counters.bump(db, course_id, student_count=1)
+        enrollment.approved_at = datetime.utcnow()
     enrollment.status = "approved"
     db.commit()
+
+    membership.invalidate(enrollment.student_id)
+    publish_enrollment_status("enrollment.approved", enrollment.id, course_id, enrollment.student_id, enrollment.status)
+    audit.record(teacher, "enrollment.approve", "enrollment", enrollment.id, course_id=course_id, student_id=enrollment.student_id)
     
     return {"message": "Enrollment approved"}
 
@@ -992,15 +1530,87 @@ def reject_enrollment(course_id: int, enrollment_id: int, teacher: User = Depend
     if not enrollment:
         raise HTTPException(status_code=404, detail="Enrollment request not found")
     
+    if enrollment.status == "approved":
+        course_counters.bump(db, course_id, student_count=-1)
     enrollment.status = "rejected"
     db.commit()
+
+    membership.invalidate(enrollment.student_id)
+    publish_enrollment_status("enrollment.rejected", enrollment.id, course_id, enrollment.student_id, enrollment.status)
+    audit.record(teacher, "enrollment.reject", "enrollment", enrollment.id, course_id=course_id, student_id=enrollment.student_id)
     
     return {"message": "Enrollment rejected"}
 
+class BulkEnrollmentDecisionRequest(BaseModel):
+    action: str  # approve | reject
+    enrollment_ids: list[int] = None
+    all_pending: bool = False
+
+@app.post("/courses/{course_id}/enrollment/bulk")
+def bulk_enrollment_decision(course_id: int, data: BulkEnrollmentDecisionRequest, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Teacher approves or rejects many enrollment requests with a single UPDATE"""
+    from .models import StudentCourseEnrollment
+
+    statuses = {"approve": "approved", "reject": "rejected"}
+    if data.action not in statuses:
+        raise HTTPException(status_code=400, detail="Action must be 'approve' or 'reject'")
+    if not data.all_pending and not data.enrollment_ids:
+        raise HTTPException(status_code=400, detail="Provide enrollment_ids or set all_pending")
+
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    query = db.query(StudentCourseEnrollment.id, StudentCourseEnrollment.student_id, StudentCourseEnrollment.status).filter(
+        StudentCourseEnrollment.course_id == course_id
+    )
+    if data.all_pending:
+        query = query.filter(StudentCourseEnrollment.status == "pending")
+    else:
+        query = query.filter(StudentCourseEnrollment.id.in_(set(data.enrollment_ids)))
+    rows = query.all()
+    found = {row.id: row.student_id for row in rows}
+    found_ids = set(found)
+    approving_ids = {row.id for row in rows if row.status != "approved"}
+    was_approved = len(found_ids) - len(approving_ids)
+
+    new_status = statuses[data.action]
+    if found_ids:
+        newly_approved = len(found_ids) - was_approved if new_status == "approved" else -was_approved
+        course_counters.bump(db, course_id, student_count=newly_approved)
+        db.query(StudentCourseEnrollment).filter(
+            StudentCourseEnrollment.id.in_(found_ids)
+        ).update({
+            StudentCourseEnrollment.status: new_status,
+            StudentCourseEnrollment.sync_version: sync.next_version(db),
+        }, synchronize_session=False)
+        if new_status == "approved" and approving_ids:
+            db.query(StudentCourseEnrollment).filter(
+                StudentCourseEnrollment.id.in_(approving_ids)
+            ).update({StudentCourseEnrollment.approved_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+
+    for enrollment_id, student_id in found.items():
+        membership.invalidate(student_id)
+        publish_enrollment_status(f"enrollment.{new_status}", enrollment_id, course_id, student_id, new_status)
+        audit.record(teacher, f"enrollment.{data.action}", "enrollment", enrollment_id, course_id=course_id, student_id=student_id, bulk=True)
+
+    requested_ids = sorted(found_ids) if data.all_pending else list(dict.fromkeys(data.enrollment_ids))
+    results = [
+        {
+            "enrollment_id": enrollment_id,
+            "status": new_status if enrollment_id in found_ids else None,
+            "result": "updated" if enrollment_id in found_ids else "not_found",
+        }
+        for enrollment_id in requested_ids
+    ]
+
+    return {"results": results, "updated": len(found_ids)}
+
 @app.post("/courses/{course_id}/unenroll")
 def unenroll_from_course(course_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
     """Student unenrolls from a course"""
-    from .models import StudentCourseEnrollment
+    from .models import StudentCourseEnrollment, StudentFeedEntry, LeaderboardScore
     
     if user.role != "student":
         raise HTTPException(status_code=403, detail="Only students can unenroll")
@@ -1014,20 +1624,36 @@ def unenroll_from_course(course_id: int, user: User = Depends(get_current_user),
         raise HTTPException(status_code=404, detail="Enrollment not found")
     
     db.delete(enrollment)
+    if enrollment.status == "approved":
+        course_counters.bump(db, course_id, student_count=-1)
+    db.query(StudentFeedEntry).filter(
+        StudentFeedEntry.student_id == user.id,
+        StudentFeedEntry.course_id == course_id
+    ).delete()
+    db.query(LeaderboardScore).filter(
+        LeaderboardScore.board_key == leaderboards.course_board(course_id),
+        LeaderboardScore.student_id == user.id
+    ).delete()
     db.commit()
+    leaderboards.forget_student(user.id, leaderboards.course_board(course_id))
+    membership.invalidate(user.id)
+
+    publish_enrollment_status("enrollment.removed", enrollment.id, course_id, enrollment.student_id, "removed")
     
     return {"message": "Successfully unenrolled from course"}
 
 
 @app.get("/student/enrollments")
-def get_student_enrollments(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
-    """Get all courses the student is enrolled in"""
-    from .models import StudentCourseEnrollment
+def get_student_enrollments(include_archived: bool = False, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Get all courses the student is enrolled in; include_archived adds old rejected requests"""
+    from .models import StudentCourseEnrollment, EnrollmentArchive
     
     if user.role != "student":
         raise HTTPException(status_code=403, detail="Only students can access this")
     
     enrollments = db.query(StudentCourseEnrollment).filter(StudentCourseEnrollment.student_id == user.id).all()
+    if include_archived:
+        enrollments += db.query(EnrollmentArchive).filter(EnrollmentArchive.student_id == user.id).all()
     
     courses = []
     for enrollment in enrollments:
@@ -1041,6 +1667,7 @@ def get_student_enrollments(user: User = Depends(get_current_user), db: Session
                 "level": course.level,
                 "duration_hours": course.duration_hours,
                 "thumbnail": course.thumbnail,
+                "thumbnail_variants": thumbnails.course_thumbnail_variants(course),
                 "teacher_name": teacher.name if teacher else "Unknown",
                 "enrolled_at": enrollment.enrolled_at,
                 "status": enrollment.status,
@@ -1077,6 +1704,1094 @@ def get_enrollment_requests(course_id: int, teacher: User = Depends(get_current_
     
     return {"requests": requests, "count": len(requests)}
 
+@app.get("/teacher/courses/{course_id}/enrollment-events")
+def stream_enrollment_requests(course_id: int, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Server-Sent Events stream of enrollment changes for a course"""
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    return StreamingResponse(
+        events.event_stream(events.course_channel(course_id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.get("/student/enrollment-events")
+def stream_student_enrollments(user: User = Depends(get_current_user)):
+    """Server-Sent Events stream of the student's enrollment status changes"""
+    if user.role != "student":
+        raise HTTPException(status_code=403, detail="Only students can access this")
+
+    return StreamingResponse(
+        events.event_stream(events.student_channel(user.id)),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+# -------------------- LESSON PROGRESS --------------------
+
+FEED_MAX_ENTRIES = int(os.getenv("FEED_MAX_ENTRIES", "20"))
+
+class LessonProgressRequest(BaseModel):
+    watched_seconds: int
+    completed: bool = False
+
+def update_continue_learning_feed(db: Session, student_id: int, course: Course, lesson, progress):
+    """Fold one progress write into the student's denormalized feed rows"""
+    from .models import CourseModule, CourseLesson, StudentLessonProgress, StudentFeedEntry
+
+    course_lessons = db.query(CourseLesson.id).join(
+        CourseModule, CourseLesson.module_id == CourseModule.id
+    ).filter(CourseModule.course_id == course.id)
+    total_lessons = course_lessons.count()
+    completed_lessons = db.query(StudentLessonProgress).filter(
+        StudentLessonProgress.student_id == student_id,
+        StudentLessonProgress.completed == 1,
+        StudentLessonProgress.lesson_id.in_(course_lessons),
+    ).count() + archival.archived_completed_count(db, student_id, course_lessons)
+    percent = int(completed_lessons * 100 / total_lessons) if total_lessons else 0
+
+    db.query(StudentFeedEntry).filter(
+        StudentFeedEntry.student_id == student_id,
+        StudentFeedEntry.course_id == course.id
+    ).update({StudentFeedEntry.course_percent_complete: percent}, synchronize_session=False)
+
+    entry = db.query(StudentFeedEntry).filter(
+        StudentFeedEntry.student_id == student_id,
+        StudentFeedEntry.lesson_id == lesson.id
+    ).first()
+
+    if progress.completed:
+        # The feed only lists lessons still in progress
+        if entry:
+            db.delete(entry)
+        return
+
+    if not entry:
+        entry = StudentFeedEntry(student_id=student_id, course_id=course.id, lesson_id=lesson.id)
+        db.add(entry)
+    entry.course_title = course.title
+    entry.lesson_title = lesson.title
+    entry.watched_seconds = progress.watched_seconds
+    entry.duration_seconds = lesson.duration_seconds
+    entry.course_percent_complete = percent
+    entry.last_accessed = progress.last_accessed
+    db.flush()
+
+    # Trim everything beyond the newest FEED_MAX_ENTRIES rows for this student
+    stale_ids = [
+        row.id for row in db.query(StudentFeedEntry.id).filter(
+            StudentFeedEntry.student_id == student_id
+        ).order_by(StudentFeedEntry.last_accessed.desc()).offset(FEED_MAX_ENTRIES).all()
+    ]
+    if stale_ids:
+        db.query(StudentFeedEntry).filter(StudentFeedEntry.id.in_(stale_ids)).delete(synchronize_session=False)
+
+def save_lesson_progress(db: Session, user: User, course: Course, lesson, data: LessonProgressRequest):
+    """Apply a heartbeat to the student's progress row, feed and scores; the caller commits"""
+    from .models import StudentLessonProgress
+
+    progress = db.query(StudentLessonProgress).filter(
+        StudentLessonProgress.student_id == user.id,
+        StudentLessonProgress.lesson_id == lesson.id
+    ).first()
+    if not progress:
+        progress = archival.restore_progress(db, user.id, lesson.id)
+    if not progress:
+        progress = StudentLessonProgress(student_id=user.id, lesson_id=lesson.id)
+        db.add(progress)
+    previous_seconds, previous_completed = progress.watched_seconds or 0, progress.completed or 0
+    progress.watched_seconds = max(progress.watched_seconds or 0, data.watched_seconds)
+    progress.completed = 1 if data.completed or progress.completed else 0
+    progress.last_accessed = datetime.utcnow()
+    if progress.started_at is None:
+        progress.started_at = progress.last_accessed
+    if progress.completed and progress.completed_at is None:
+        progress.completed_at = progress.last_accessed
+    db.flush()
+
+    update_continue_learning_feed(db, user.id, course, lesson, progress)
+    score_updates = leaderboards.record_progress(
+        db, user, course.id,
+        progress.completed - previous_completed,
+        progress.watched_seconds - previous_seconds,
+    )
+    return progress, score_updates
+
+@app.post("/student/lessons/{lesson_id}/progress")
+def record_lesson_progress(lesson_id: int, data: LessonProgressRequest, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Record how far a student has watched a lesson"""
+    from .models import CourseLesson
+
+    if user.role != "student":
+        raise HTTPException(status_code=403, detail="Only students can record progress")
+
+    owner = membership.lesson_course(db, lesson_id)
+    if not owner:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+    if not membership.is_member(db, user.id, owner[0]):
+        raise HTTPException(status_code=403, detail="Not enrolled in this course")
+
+    lesson = db.query(CourseLesson).filter(CourseLesson.id == lesson_id).first()
+    course = db.query(Course).filter(Course.id == owner[0]).first() if lesson else None
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    try:
+        progress, score_updates = save_lesson_progress(db, user, course, lesson, data)
+    except IntegrityError:
+        # A concurrent first heartbeat inserted the row first; start over and update that one
+        db.rollback()
+        progress, score_updates = save_lesson_progress(db, user, course, lesson, data)
+    db.commit()
+    leaderboards.apply_local(score_updates)
+
+    return {
+        "lesson_id": lesson_id,
+        "watched_seconds": progress.watched_seconds,
+        "completed": bool(progress.completed),
+        "last_accessed": progress.last_accessed,
+    }
+
+@app.get("/student/feed")
+def get_continue_learning_feed(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Get the student's in-progress lessons, most recently watched first"""
+    from .models import StudentFeedEntry
+
+    if user.role != "student":
+        raise HTTPException(status_code=403, detail="Only students can access this")
+
+    entries = db.query(StudentFeedEntry).filter(
+        StudentFeedEntry.student_id == user.id
+    ).order_by(StudentFeedEntry.last_accessed.desc()).limit(FEED_MAX_ENTRIES).all()
+
+    return {
+        "feed": [
+            {
+                "course_id": e.course_id,
+                "course_title": e.course_title,
+                "course_percent_complete": e.course_percent_complete,
+                "lesson_id": e.lesson_id,
+                "lesson_title": e.lesson_title,
+                "watched_seconds": e.watched_seconds,
+                "duration_seconds": e.duration_seconds,
+                "last_accessed": e.last_accessed,
+            }
+            for e in entries
+        ],
+        "count": len(entries),
+    }
+
+# -------------------- LEADERBOARDS --------------------
+
+def leaderboard_response(db: Session, board_key: str, limit: int, user: User = None):
+    """Top students on a board with names, plus the caller's own rank"""
+    limit = max(1, min(limit, leaderboards.LEADERBOARD_MAX_LIMIT))
+    board = leaderboards.get_board(db, board_key)
+    top = board.top(limit)
+    names = dict(db.query(User.id, User.name).filter(User.id.in_([e["student_id"] for e in top])).all())
+    for entry in top:
+        entry["name"] = names.get(entry["student_id"])
+
+    return {
+        "board": board_key,
+        "students": len(board),
+        "top": top,
+        "me": board.rank(user.id) if user is not None and user.role == "student" else None,
+    }
+
+@app.get("/courses/{course_id}/leaderboard")
+def get_course_leaderboard(course_id: int, limit: int = 10, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Rank a course's students by completed lessons, then watch time"""
+    course = db.query(Course).filter(Course.id == course_id).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    if course.teacher_id != user.id and not membership.is_member(db, user.id, course_id):
+        raise HTTPException(status_code=403, detail="Not enrolled in this course")
+
+    return leaderboard_response(db, leaderboards.course_board(course_id), limit, user)
+
+@app.get("/student/leaderboard")
+def get_class_leaderboard(limit: int = 10, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Rank the students of the caller's class and board across all courses"""
+    if user.role != "student":
+        raise HTTPException(status_code=403, detail="Only students can access this")
+    board_key = leaderboards.class_board(user)
+    if not board_key:
+        raise HTTPException(status_code=400, detail="Student class not set")
+
+    return leaderboard_response(db, board_key, limit, user)
+
+async def warm_leaderboards():
+    db = SessionLocal()
+    try:
+        count = await asyncio.to_thread(leaderboards.warm_boards, db)
+        print(f"Loaded {count} leaderboards")
+    except Exception as e:
+        print(f"Leaderboard warm-up failed: {e}")
+    finally:
+        db.close()
+
+async def backfill_leaderboards():
+    db = SessionLocal()
+    try:
+        rows = await asyncio.to_thread(leaderboards.backfill_scores, db)
+        if rows:
+            print(f"Backfilled {rows} leaderboard rows")
+            await asyncio.to_thread(leaderboards.warm_boards, db)
+    except Exception as e:
+        print(f"Leaderboard backfill failed: {e}")
+    finally:
+        db.close()
+
+# Every worker fills its own board cache; the score table is backfilled once
+startup_tasks.append(warm_leaderboards)
+leader_tasks.append(backfill_leaderboards)
+
+# -------------------- NOTIFICATIONS --------------------
+
+@app.get("/notifications")
+def get_notifications(before_id: int = None, limit: int = 20, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Get the user's notifications, newest first; pass next_before_id to page back"""
+    from .models import Notification
+
+    limit = max(1, min(limit, 100))
+    query = db.query(Notification).filter(Notification.user_id == user.id)
+    if before_id is not None:
+        query = query.filter(Notification.id < before_id)
+    items = query.order_by(Notification.id.desc()).limit(limit).all()
+
+    return {
+        "notifications": [
+            {
+                "id": n.id,
+                "kind": n.kind,
+                "course_id": n.course_id,
+                "title": n.title,
+                "body": n.body,
+                "read": n.read_at is not None,
+                "created_at": n.created_at,
+            }
+            for n in items
+        ],
+        "unread_count": notifications.unread_count(db, user.id),
+        "next_before_id": items[-1].id if len(items) == limit else None,
+    }
+
+@app.post("/notifications/{notification_id}/read")
+def mark_notification_read(notification_id: int, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Mark one notification as read"""
+    from .models import Notification
+
+    notification = db.query(Notification).filter(Notification.id == notification_id, Notification.user_id == user.id).first()
+    if not notification:
+        raise HTTPException(status_code=404, detail="Notification not found")
+    if notification.read_at is None:
+        notification.read_at = datetime.utcnow()
+        db.commit()
+        notifications.invalidate_unread([user.id])
+
+    return {"message": "Notification marked as read"}
+
+@app.post("/notifications/read-all")
+def mark_all_notifications_read(user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Mark every unread notification as read"""
+    from .models import Notification
+
+    updated = db.query(Notification).filter(
+        Notification.user_id == user.id, Notification.read_at.is_(None)
+    ).update({Notification.read_at: datetime.utcnow()}, synchronize_session=False)
+    db.commit()
+    notifications.invalidate_unread([user.id])
+
+    return {"updated": updated}
+
+# -------------------- ENGAGEMENT ANALYTICS --------------------
+
+def summarize_engagement(db: Session, since, course_id: int = None):
+    """Aggregate the daily rollup tables; never touches raw progress rows"""
+    from sqlalchemy import func
+    from .models import CourseEngagementDaily, LessonEngagementDaily
+
+    daily = db.query(CourseEngagementDaily).filter(CourseEngagementDaily.day >= since)
+    lessons = db.query(
+        LessonEngagementDaily.lesson_id,
+        LessonEngagementDaily.course_id,
+        func.sum(LessonEngagementDaily.started).label("started"),
+        func.sum(LessonEngagementDaily.completed).label("completed"),
+        func.avg(LessonEngagementDaily.median_watch_seconds).label("median_watch_seconds"),
+    ).filter(LessonEngagementDaily.day >= since)
+    if course_id is not None:
+        daily = daily.filter(CourseEngagementDaily.course_id == course_id)
+        lessons = lessons.filter(LessonEngagementDaily.course_id == course_id)
+    daily = daily.order_by(CourseEngagementDaily.day).all()
+    lessons = lessons.group_by(LessonEngagementDaily.lesson_id, LessonEngagementDaily.course_id).all()
+
+    courses = {}
+    for row in daily:
+        course = courses.setdefault(row.course_id, {
+            "course_id": row.course_id,
+            "enrolled": 0,
+            "started": 0,
+            "completed": 0,
+            "median_watch_seconds": 0,
+            "dropoff_lesson_id": None,
+            "_medians": [],
+        })
+        course["enrolled"] += row.new_enrollments
+        course["started"] += row.lessons_started
+        course["completed"] += row.lessons_completed
+        if row.lessons_started:
+            course["_medians"].append(row.median_watch_seconds)
+
+    dropoff = {}
+    for row in lessons:
+        unfinished = (row.started or 0) - (row.completed or 0)
+        if unfinished > 0 and unfinished > dropoff.get(row.course_id, (None, 0))[1]:
+            dropoff[row.course_id] = (row.lesson_id, unfinished)
+
+    for course in courses.values():
+        medians = sorted(course.pop("_medians"))
+        # Median of the daily medians; exact medians would need the raw rows
+        course["median_watch_seconds"] = medians[len(medians) // 2] if medians else 0
+        course["dropoff_lesson_id"] = dropoff.get(course["course_id"], (None, 0))[0]
+
+    return daily, lessons, list(courses.values())
+
+@app.get("/teacher/courses/{course_id}/engagement")
+def get_course_engagement(course_id: int, days: int = 30, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Get the engagement funnel for a course from the daily rollups"""
+    if days <= 0:
+        raise HTTPException(status_code=400, detail="days must be positive")
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    daily, lessons, summary = summarize_engagement(db, since, course_id)
+
+    return {
+        "summary": summary[0] if summary else None,
+        "daily": [
+            {
+                "day": row.day,
+                "newEnrollments": row.new_enrollments,
+                "activeStudents": row.active_students,
+                "lessonsStarted": row.lessons_started,
+                "lessonsCompleted": row.lessons_completed,
+                "medianWatchSeconds": row.median_watch_seconds,
+                "dropoffLessonId": row.dropoff_lesson_id,
+            }
+            for row in daily
+        ],
+        "lessons": [
+            {
+                "lesson_id": row.lesson_id,
+                "started": row.started,
+                "completed": row.completed,
+                "median_watch_seconds": int(row.median_watch_seconds or 0),
+            }
+            for row in lessons
+        ],
+    }
+
+@app.get("/admin/engagement")
+def get_admin_engagement(days: int = 30, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Get the engagement funnel for every course from the daily rollups"""
+    if days <= 0:
+        raise HTTPException(status_code=400, detail="days must be positive")
+    since = datetime.utcnow().date() - timedelta(days=days - 1)
+    daily, lessons, summary = summarize_engagement(db, since)
+    return {"courses": summary, "count": len(summary)}
+
+@app.post("/admin/engagement/rollup")
+def run_engagement_rollup(admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Fold progress written since the last run into the rollup tables now"""
+    return rollups.run_rollup(db)
+
+if rollups.ROLLUP_INTERVAL_MINUTES > 0:
+    async def start_rollup_scheduler():
+        app.state.rollup_task = asyncio.create_task(rollups.rollup_scheduler())
+
+    async def stop_rollup_scheduler():
+        task = getattr(app.state, "rollup_task", None)
+        if task:
+            task.cancel()
+
+    leader_tasks.append(start_rollup_scheduler)
+    leader_stop_tasks.append(stop_rollup_scheduler)
+    shutdown_tasks.append(stop_rollup_scheduler)
+
+# -------------------- ARCHIVAL --------------------
+
+@app.post("/admin/archive")
+def run_archive(background_tasks: BackgroundTasks, optimize: bool = False, max_batches: int = None, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Queue an archival run of cold progress and finished enrollments; poll the job for its report"""
+    from .models import ArchiveJob
+
+    running = archival.active_job(db)
+    if running:
+        raise HTTPException(status_code=409, detail=f"Archive job {running.id} is already {running.status}")
+
+    job = ArchiveJob(
+        status="queued",
+        optimize=1 if optimize else 0,
+        max_batches=max_batches,
+        created_at=datetime.utcnow(),
+    )
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+    background_tasks.add_task(archival.run_archive_job, job.id)
+    return {"job_id": job.id, "status": job.status}
+
+@app.get("/admin/archive/jobs/{job_id}")
+def get_archive_job(job_id: int, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Get the status of an archival run and, once done, what moved and how sizes changed"""
+    import json
+    from .models import ArchiveJob
+
+    job = db.query(ArchiveJob).filter(ArchiveJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Archive job not found")
+
+    return {
+        "id": job.id,
+        "status": job.status,
+        "optimize": bool(job.optimize),
+        "max_batches": job.max_batches,
+        "report": json.loads(job.report) if job.report else None,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+# -------------------- COURSE COUNTERS --------------------
+
+@app.post("/admin/course-counters/reconcile")
+def reconcile_course_counters(dry_run: bool = False, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Recompute every course's summary counters and report the ones that drifted"""
+    return course_counters.reconcile(db, fix=not dry_run)
+
+# -------------------- AUDIT LOG --------------------
+
+@app.get("/admin/audit")
+def get_audit_events(
+    actor_id: int = None,
+    target_type: str = None,
+    target_id: int = None,
+    action: str = None,
+    since: datetime = None,
+    until: datetime = None,
+    before_id: int = None,
+    limit: int = 50,
+    admin=Depends(get_current_admin),
+    db: Session = Depends(get_db),
+):
+    """Get audit events newest first (by created_at when a time range is given), filtered by actor, target and action"""
+    import json
+    from sqlalchemy import and_, or_
+    from .models import AuditEvent
+
+    if target_id is not None and target_type is None:
+        raise HTTPException(status_code=400, detail="target_id requires target_type")
+
+    limit = max(1, min(limit, 200))
+    query = db.query(AuditEvent)
+    if actor_id is not None:
+        query = query.filter(AuditEvent.actor_id == actor_id)
+    if target_type is not None:
+        query = query.filter(AuditEvent.target_type == target_type)
+    if target_id is not None:
+        query = query.filter(AuditEvent.target_id == target_id)
+    if action is not None:
+        query = query.filter(AuditEvent.action == action)
+    if since is not None:
+        query = query.filter(AuditEvent.created_at >= since)
+    if until is not None:
+        query = query.filter(AuditEvent.created_at < until)
+    # Ids follow flush order, not created_at, so a time range pages by (created_at, id) on its index
+    by_time = since is not None or until is not None
+    if before_id is not None and by_time:
+        cursor = db.query(AuditEvent.created_at).filter(AuditEvent.id == before_id).scalar()
+        if cursor is None:
+            raise HTTPException(status_code=400, detail="Unknown before_id")
+        query = query.filter(or_(
+            AuditEvent.created_at < cursor,
+            and_(AuditEvent.created_at == cursor, AuditEvent.id < before_id),
+        ))
+    elif before_id is not None:
+        query = query.filter(AuditEvent.id < before_id)
+    order = (AuditEvent.created_at.desc(), AuditEvent.id.desc()) if by_time else (AuditEvent.id.desc(),)
+    items = query.order_by(*order).limit(limit).all()
+
+    return {
+        "events": [
+            {
+                "id": e.id,
+                "actor_id": e.actor_id,
+                "actor_role": e.actor_role,
+                "actor_email": e.actor_email,
+                "action": e.action,
+                "target_type": e.target_type,
+                "target_id": e.target_id,
+                "details": json.loads(e.details) if e.details else None,
+                "created_at": e.created_at,
+            }
+            for e in items
+        ],
+        "next_before_id": items[-1].id if len(items) == limit else None,
+    }
+
+async def start_audit_flusher():
+    await asyncio.to_thread(audit.start_flusher)
+
+async def stop_audit_flusher():
+    await asyncio.to_thread(audit.stop_flusher)
+
+startup_tasks.append(start_audit_flusher)
+shutdown_tasks.append(stop_audit_flusher)
+
+# -------------------- EXPORTS --------------------
+
+def export_response(kind: str, course_id: int, file_format: str, background: bool, background_tasks: BackgroundTasks, db: Session):
+    """Stream an export, or queue it as an ExportJob when background is set"""
+    from .models import ExportJob
+
+    if file_format not in ("csv", "xlsx"):
+        raise HTTPException(status_code=400, detail="Format must be 'csv' or 'xlsx'")
+    if file_format == "xlsx":
+        try:
+            import openpyxl  # noqa: F401
+        except ImportError:
+            raise HTTPException(status_code=501, detail="XLSX export requires openpyxl")
+
+    if background:
+        job = ExportJob(
+            kind=kind,
+            course_id=course_id,
+            file_format=file_format,
+            status="queued",
+            created_at=datetime.utcnow(),
+        )
+        db.add(job)
+        db.commit()
+        db.refresh(job)
+        background_tasks.add_task(exports.run_export_job, job.id)
+        return {"job_id": job.id, "status": job.status}
+
+    filename = f"{kind}-{course_id}.{file_format}" if course_id else f"{kind}.{file_format}"
+    headers = {"Content-Disposition": f'attachment; filename="{filename}"'}
+
+    if file_format == "xlsx":
+        # XLSX is a zip archive and cannot be streamed row by row; spool it to disk instead
+        import tempfile
+
+        fd, path = tempfile.mkstemp(suffix=".xlsx")
+        os.close(fd)
+        exports.write_export(path, kind, course_id, "xlsx")
+        background_tasks.add_task(os.remove, path)
+        return FileResponse(
+            path,
+            media_type="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet",
+            headers=headers,
+        )
+
+    return StreamingResponse(exports.iter_csv(kind, course_id), media_type="text/csv", headers=headers)
+
+@app.get("/admin/exports/users")
+def export_users(background_tasks: BackgroundTasks, format: str = "csv", background: bool = False, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Export every user as a spreadsheet"""
+    return export_response("users", None, format, background, background_tasks, db)
+
+@app.get("/admin/exports/courses/{course_id}/{kind}")
+def export_course_admin(course_id: int, kind: str, background_tasks: BackgroundTasks, format: str = "csv", background: bool = False, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Export a course's enrollments or lesson progress as a spreadsheet"""
+    if kind not in ("enrollments", "progress"):
+        raise HTTPException(status_code=404, detail="Unknown export")
+    if not db.query(Course).filter(Course.id == course_id).first():
+        raise HTTPException(status_code=404, detail="Course not found")
+    return export_response(kind, course_id, format, background, background_tasks, db)
+
+@app.get("/teacher/courses/{course_id}/exports/{kind}")
+def export_course_teacher(course_id: int, kind: str, background_tasks: BackgroundTasks, format: str = "csv", teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Export enrollments or lesson progress for one of the teacher's courses"""
+    if kind not in ("enrollments", "progress"):
+        raise HTTPException(status_code=404, detail="Unknown export")
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    return export_response(kind, course_id, format, False, background_tasks, db)
+
+@app.get("/admin/exports/jobs/{job_id}")
+def get_export_job(job_id: int, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Get the status of a background export"""
+    from .models import ExportJob
+
+    job = db.query(ExportJob).filter(ExportJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+
+    return {
+        "id": job.id,
+        "kind": job.kind,
+        "course_id": job.course_id,
+        "format": job.file_format,
+        "status": job.status,
+        "row_count": job.row_count,
+        "error": job.error,
+        "created_at": job.created_at,
+        "finished_at": job.finished_at,
+    }
+
+@app.get("/admin/exports/jobs/{job_id}/download")
+def download_export_job(job_id: int, admin=Depends(get_current_admin), db: Session = Depends(get_db)):
+    """Download the file produced by a finished background export"""
+    from .models import ExportJob
+
+    job = db.query(ExportJob).filter(ExportJob.id == job_id).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Export job not found")
+    if job.status != "done" or not job.file_path or not os.path.exists(job.file_path):
+        raise HTTPException(status_code=409, detail="Export is not ready")
+
+    return FileResponse(job.file_path, filename=os.path.basename(job.file_path))
+
+# -------------------- PROFILING --------------------
+
+@app.get("/admin/profiles/slowest")
+def get_slowest_profiles(admin=Depends(get_current_admin)):
+    """Get the slowest sampled request profiles per route (PROFILE_SAMPLE_RATE)"""
+    return {"routes": profiling.slowest_profiles()}
+
+@app.get("/admin/profiles/{profile_id}")
+def get_profile(profile_id: str, format: str = "json", admin=Depends(get_current_admin)):
+    """Get a stored profile by the X-Profile-Id returned with the profiled response"""
+    profile = profiling.load_profile(profile_id, html=format == "html")
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    return HTMLResponse(profile) if format == "html" else profile
+
+# -------------------- THUMBNAILS --------------------
+
+THUMBNAIL_EXTENSIONS = {"image/jpeg": "jpg", "image/png": "png", "image/webp": "webp", "image/gif": "gif"}
+
+@app.post("/teacher/courses/{course_id}/thumbnail")
+def upload_course_thumbnail(course_id: int, file: UploadFile = File(...), teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Upload a course thumbnail; resized variants are generated in the background"""
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    extension = THUMBNAIL_EXTENSIONS.get(file.content_type)
+    if not extension:
+        raise HTTPException(status_code=400, detail="Thumbnail must be a JPEG, PNG, WebP or GIF image")
+    data = file.file.read(thumbnails.MAX_THUMBNAIL_BYTES + 1)
+    if len(data) > thumbnails.MAX_THUMBNAIL_BYTES:
+        raise HTTPException(status_code=413, detail="Thumbnail is too large")
+
+    digest, filename = thumbnails.store_original(data, extension)
+    course.thumbnail = thumbnails.thumbnail_url(filename)
+    course.thumbnail_variants = None
+    db.commit()
+
+    thumbnails.submit_thumbnail(course.id, digest, filename)
+
+    return {"thumbnail": course.thumbnail, "status": "processing"}
+
+@app.get("/media/thumbnails/{filename}")
+def get_thumbnail(filename: str):
+    """Serve a content-addressed thumbnail; the name changes whenever the bytes do"""
+    import re
+
+    if not re.fullmatch(r"[0-9a-f]{64}(-\d+w)?\.(jpg|png|webp|gif)", filename):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+    path = os.path.join(thumbnails.THUMBNAIL_DIR, filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Thumbnail not found")
+
+    return FileResponse(path, headers={"Cache-Control": "public, max-age=31536000, immutable"})
+
+async def stop_thumbnail_pool():
+    thumbnails.shutdown_pool()
+
+shutdown_tasks.append(stop_thumbnail_pool)
+
+# -------------------- LESSON MEDIA --------------------
+
+VIDEO_EXTENSIONS = {"video/mp4": "mp4", "video/quicktime": "mov", "video/webm": "webm", "video/x-matroska": "mkv"}
+
+def media_job_response(job):
+    return {
+        "id": job.id,
+        "lesson_id": job.lesson_id,
+        "status": job.status,
+        "attempts": job.attempts,
+        "error": job.error,
+        "created_at": job.created_at,
+        "started_at": job.started_at,
+        "finished_at": job.finished_at,
+    }
+
+@app.post("/teacher/courses/{course_id}/modules/{module_id}/lessons/{lesson_id}/video")
+def upload_lesson_video(course_id: int, module_id: int, lesson_id: int, file: UploadFile = File(...), teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Upload a lesson video and queue duration probing and HLS segmenting"""
+    import shutil
+    from .models import CourseModule, CourseLesson, MediaJob
+
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+    lesson = db.query(CourseLesson).join(CourseModule, CourseLesson.module_id == CourseModule.id).filter(
+        CourseLesson.id == lesson_id,
+        CourseLesson.module_id == module_id,
+        CourseModule.course_id == course_id
+    ).first()
+    if not lesson:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+
+    extension = VIDEO_EXTENSIONS.get(file.content_type)
+    if not extension:
+        raise HTTPException(status_code=400, detail="Video must be MP4, MOV, WebM or MKV")
+
+    os.makedirs(media_jobs.VIDEO_DIR, exist_ok=True)
+    path = os.path.join(media_jobs.VIDEO_DIR, f"lesson-{lesson.id}-{secrets.token_hex(8)}.{extension}")
+    with open(path, "wb") as f:
+        shutil.copyfileobj(file.file, f, 1024 * 1024)
+
+    lesson.video_file = path
+    lesson.hls_playlist = None
+    job = MediaJob(lesson_id=lesson.id, status="queued", created_at=datetime.utcnow())
+    db.add(job)
+    db.commit()
+    db.refresh(job)
+
+    return {"video_file": path, "job": media_job_response(job)}
+
+@app.get("/teacher/courses/{course_id}/media-jobs")
+def get_course_media_jobs(course_id: int, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Get video processing jobs for a course, newest first"""
+    from .models import CourseModule, CourseLesson, MediaJob
+
+    course = db.query(Course).filter(Course.id == course_id, Course.teacher_id == teacher.id).first()
+    if not course:
+        raise HTTPException(status_code=404, detail="Course not found")
+
+    jobs = db.query(MediaJob).join(CourseLesson, MediaJob.lesson_id == CourseLesson.id).join(
+        CourseModule, CourseLesson.module_id == CourseModule.id
+    ).filter(CourseModule.course_id == course_id).order_by(MediaJob.id.desc()).all()
+
+    return {"jobs": [media_job_response(j) for j in jobs], "count": len(jobs)}
+
+@app.get("/teacher/media-jobs/{job_id}")
+def get_media_job(job_id: int, teacher: User = Depends(get_current_teacher), db: Session = Depends(get_db)):
+    """Get the status of one video processing job"""
+    from .models import CourseModule, CourseLesson, MediaJob
+
+    job = db.query(MediaJob).join(CourseLesson, MediaJob.lesson_id == CourseLesson.id).join(
+        CourseModule, CourseLesson.module_id == CourseModule.id
+    ).join(Course, CourseModule.course_id == Course.id).filter(
+        MediaJob.id == job_id,
+        Course.teacher_id == teacher.id
+    ).first()
+    if not job:
+        raise HTTPException(status_code=404, detail="Media job not found")
+
+    return media_job_response(job)
+
+@app.get("/media/hls/{lesson_id}/{filename:path}")
+def get_lesson_hls(lesson_id: int, filename: str, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Serve HLS playlists and segments to the course teacher and approved students"""
+    import re
+
+    if not re.fullmatch(r"(master\.m3u8|\d+/(index\.m3u8|seg_\d+\.ts))", filename):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    owner = membership.lesson_course(db, lesson_id)
+    if not owner:
+        raise HTTPException(status_code=404, detail="Lesson not found")
+
+    course_id, teacher_id = owner
+    if user.id != teacher_id and not membership.is_member(db, user.id, course_id):
+        raise HTTPException(status_code=403, detail="Not enrolled in this course")
+
+    path = os.path.join(media_jobs.HLS_DIR, str(lesson_id), filename)
+    if not os.path.exists(path):
+        raise HTTPException(status_code=404, detail="Not found")
+
+    media_type = "application/vnd.apple.mpegurl" if filename.endswith(".m3u8") else "video/mp2t"
+    return FileResponse(path, media_type=media_type)
+
+if media_jobs.MEDIA_WORKERS > 0:
+    async def start_media_workers():
+        media_jobs.start_workers()
+
+    async def stop_media_workers():
+        media_jobs.stop_workers()
+
+    leader_tasks.append(start_media_workers)
+    leader_stop_tasks.append(stop_media_workers)
+    shutdown_tasks.append(stop_media_workers)
+
+# -------------------- DELTA SYNC --------------------
+
+@app.get("/sync")
+def sync_changes(token: str = None, user: User = Depends(get_current_user), db: Session = Depends(get_db)):
+    """Get everything that changed since a sync token, including deletions"""
+    from sqlalchemy import or_, and_
+    from .models import CourseModule, CourseLesson, CourseResource, StudentCourseEnrollment, SyncTombstone
+
+    if user.role not in ("student", "teacher"):
+        raise HTTPException(status_code=403, detail="Only students and teachers can sync")
+
+    # Read the counter first: every version <= it is already committed
+    new_token = sync.current_version(db)
+    since = int(token) if token and token.isdigit() else -1
+    full = since < 0 or since > new_token
+    if full:
+        since = -1
+
+    changed_courses = db.query(Course).filter(Course.sync_version > since)
+    if user.role == "teacher":
+        changed_courses = changed_courses.filter(Course.teacher_id == user.id)
+    courses = []
+    hidden_course_ids = []
+    for course in changed_courses.all():
+        if user.role == "teacher" or check_course_access(user, course):
+            courses.append(course)
+        else:
+            # The course moved out of this student's class/board
+            hidden_course_ids.append(course.id)
+
+    enrollments = db.query(StudentCourseEnrollment)
+    if user.role == "teacher":
+        own_course_ids = [row.id for row in db.query(Course.id).filter(Course.teacher_id == user.id)]
+        enrollments = enrollments.filter(StudentCourseEnrollment.course_id.in_(own_course_ids))
+        tree_course_ids = set(own_course_ids)
+    else:
+        enrollments = enrollments.filter(StudentCourseEnrollment.student_id == user.id)
+        tree_course_ids = {
+            row.course_id for row in db.query(StudentCourseEnrollment.course_id).filter(
+                StudentCourseEnrollment.student_id == user.id,
+                StudentCourseEnrollment.status == "approved"
+            )
+        }
+    changed_enrollments = enrollments.filter(StudentCourseEnrollment.sync_version > since).all()
+
+    # Courses that just became visible to a student need their whole tree, not just recent edits
+    if full:
+        fresh_course_ids = tree_course_ids
+    elif user.role == "student":
+        fresh_course_ids = {e.course_id for e in changed_enrollments if e.status == "approved"} & tree_course_ids
+    else:
+        fresh_course_ids = set()
+
+    def tree_filter(query, course_column, version_column):
+        fresh = list(fresh_course_ids)
+        stale = list(tree_course_ids - fresh_course_ids)
+        return query.filter(or_(
+            course_column.in_(fresh),
+            and_(course_column.in_(stale), version_column > since),
+        ))
+
+    modules = tree_filter(db.query(CourseModule), CourseModule.course_id, CourseModule.sync_version).all()
+    lessons = tree_filter(
+        db.query(CourseLesson, CourseModule.course_id).join(CourseModule, CourseLesson.module_id == CourseModule.id),
+        CourseModule.course_id, CourseLesson.sync_version,
+    ).all()
+    resources = tree_filter(db.query(CourseResource), CourseResource.course_id, CourseResource.sync_version).all()
+
+    deleted = {}
+    if not full:
+        tombstones = db.query(SyncTombstone).filter(SyncTombstone.sync_version > since)
+        for t in tombstones.all():
+            relevant = (
+                t.table_name == Course.__tablename__
+                or (t.table_name == StudentCourseEnrollment.__tablename__ and (
+                    t.student_id == user.id if user.role == "student" else t.course_id in tree_course_ids
+                ))
+                or t.course_id in tree_course_ids
+            )
+            if relevant:
+                deleted.setdefault(t.table_name, []).append(t.row_id)
+        if hidden_course_ids:
+            deleted.setdefault(Course.__tablename__, []).extend(hidden_course_ids)
+
+    return {
+        "token": str(new_token),
+        "full": full,
+        "courses": [
+            {
+                "id": c.id,
+                "title": c.title,
+                "description": c.description,
+                "level": c.level,
+                "duration_hours": c.duration_hours,
+                "thumbnail": c.thumbnail,
+                "target_class": c.target_class,
+                "target_board": c.target_board,
+                "teacher_id": c.teacher_id,
+            }
+            for c in courses
+        ],
+        "modules": [
+            {"id": m.id, "course_id": m.course_id, "title": m.title, "description": m.description, "order": m.order}
+            for m in modules
+        ],
+        "lessons": [
+            {
+                "id": l.id,
+                "course_id": course_id,
+                "module_id": l.module_id,
+                "title": l.title,
+                "duration_seconds": l.duration_seconds,
+                "order": l.order,
+                "hls_url": f"/media/hls/{l.id}/master.m3u8" if l.hls_playlist else None,
+            }
+            for l, course_id in lessons
+        ],
+        "resources": [
+            {"id": r.id, "course_id": r.course_id, "title": r.title, "file_type": r.file_type, "size_mb": r.size_mb}
+            for r in resources
+        ],
+        "enrollments": [
+            {"id": e.id, "course_id": e.course_id, "student_id": e.student_id, "status": e.status, "enrolled_at": e.enrolled_at}
+            for e in changed_enrollments
+        ],
+        "deleted": deleted,
+    }
+
+# -------------------- BATCH --------------------
+
+BATCH_MAX_REQUESTS = 10
+BATCH_TIMEOUT_SECONDS = 10
+
+class BatchItem(BaseModel):
+    id: str = None
+    method: str = "GET"
+    path: str
+
+class BatchRequest(BaseModel):
+    requests: list[BatchItem]
+
+class StreamingNotBatchable(Exception):
+    pass
+
+async def run_batch_item(request: Request, item: BatchItem, headers: list):
+    """Run one GET through the router (skipping middleware) and capture its response"""
+    import json
+    from urllib.parse import urlsplit
+    from starlette.exceptions import HTTPException as StarletteHTTPException
+
+    url = urlsplit(item.path)
+    scope = {
+        key: value for key, value in request.scope.items()
+        if key not in ("route", "endpoint", "path_params", "router")
+    }
+    scope.update({
+        "method": "GET",
+        "path": url.path,
+        "raw_path": url.path.encode(),
+        "query_string": url.query.encode(),
+        "headers": headers,
+    })
+
+    status_code = 500
+    content_type = b""
+    body = []
+    request_sent = False
+    finished = asyncio.Event()
+
+    async def receive():
+        nonlocal request_sent
+        if not request_sent:
+            request_sent = True
+            return {"type": "http.request", "body": b"", "more_body": False}
+        # Endpoints that watch for disconnects wait here until the sub-request ends
+        await finished.wait()
+        return {"type": "http.disconnect"}
+
+    async def send(message):
+        nonlocal status_code, content_type
+        if message["type"] == "http.response.start":
+            status_code = message["status"]
+            content_type = dict(message.get("headers", [])).get(b"content-type", b"")
+            if content_type.startswith(b"text/event-stream"):
+                raise StreamingNotBatchable()
+        elif message["type"] == "http.response.body":
+            body.append(message.get("body", b""))
+
+    try:
+        # The middleware only saw the /batch envelope; gate each sub-request by its own class
+        async with admission.admitted("GET", url.path):
+            await asyncio.wait_for(app.router(scope, receive, send), timeout=BATCH_TIMEOUT_SECONDS)
+    except admission.Shed as e:
+        return {"id": item.id, "status": 503, "body": {"detail": "Server is busy, retry later", "retry_after": e.retry_after}}
+    except StreamingNotBatchable:
+        return {"id": item.id, "status": 400, "body": {"detail": "Streaming endpoints cannot be batched"}}
+    except asyncio.TimeoutError:
+        return {"id": item.id, "status": 504, "body": {"detail": "Sub-request timed out"}}
+    except StarletteHTTPException as e:
+        # Raised by the router itself, e.g. for unknown paths
+        return {"id": item.id, "status": e.status_code, "body": {"detail": e.detail}}
+    except Exception as e:
+        print(f"Batch sub-request {item.path} failed: {e}")
+        return {"id": item.id, "status": 500, "body": {"detail": "Internal Server Error"}}
+    finally:
+        finished.set()
+
+    raw = b"".join(body)
+    if content_type.startswith(b"application/json"):
+        payload = json.loads(raw) if raw else None
+    else:
+        payload = raw.decode("utf-8", errors="replace")
+    return {"id": item.id, "status": status_code, "body": payload}
+
+@app.post("/batch")
+async def batch(data: BatchRequest, request: Request, authorization: str = Header(None)):
+    """Run several GET requests concurrently, authenticating once"""
+    from starlette.concurrency import run_in_threadpool
+
+    if len(data.requests) > BATCH_MAX_REQUESTS:
+        raise HTTPException(status_code=400, detail=f"At most {BATCH_MAX_REQUESTS} requests per batch")
+    for item in data.requests:
+        if item.method.upper() != "GET":
+            raise HTTPException(status_code=400, detail="Only GET requests can be batched")
+        if not item.path.startswith("/") or item.path.split("?")[0] == "/batch":
+            raise HTTPException(status_code=400, detail=f"Invalid path: {item.path}")
+
+    def authenticate():
+        db = SessionLocal()
+        try:
+            user = get_current_user(authorization, db)
+            # Load every column now; sub-requests only read the detached copy
+            db.expunge(user)
+            return user
+        finally:
+            db.close()
+
+    user = None
+    if authorization:
+        try:
+            user = await run_in_threadpool(authenticate)
+        except HTTPException:
+            # Let admin tokens and bad tokens fall through to each endpoint's own check
+            user = None
+
+    headers = [
+        (name, value) for name, value in request.scope["headers"]
+        if name not in (b"content-length", b"content-type", b"accept-encoding")
+    ]
+    token = batch_auth.set((authorization, user) if user is not None else None)
+    try:
+        responses = await asyncio.gather(*(run_batch_item(request, item, headers) for item in data.requests))
+    finally:
+        batch_auth.reset(token)
+
+    return {"responses": responses}
+
 if __name__ == "__main__":
-    import uvicorn
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    # Multi-process gunicorn server; `uvicorn app.main:app --reload` for development
+    from .server import run
+    run(app)
@@ -0,0 +1,181 @@
+# Lesson video processing queue.
+# Uploads enqueue a MediaJob row; MEDIA_WORKERS threads claim queued jobs,
+# probe the duration with ffprobe and cut multi-bitrate HLS with ffmpeg.
+# Jobs live in the database, so any web worker can pick them up and a
+# crashed worker's job is reclaimed after MEDIA_JOB_TIMEOUT_MINUTES.
+
+import os
+import json
+import shutil
+import threading
+import subprocess
+from datetime import datetime, timedelta
+from sqlalchemy import or_, and_
+from .database import SessionLocal
+from .models import CourseModule, CourseLesson, MediaJob
+from . import course_counters
+
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "./media")
+VIDEO_DIR = os.path.join(MEDIA_ROOT, "videos")
+HLS_DIR = os.path.join(MEDIA_ROOT, "hls")
+FFMPEG_BIN = os.getenv("FFMPEG_BIN", "ffmpeg")
+FFPROBE_BIN = os.getenv("FFPROBE_BIN", "ffprobe")
+MEDIA_WORKERS = int(os.getenv("MEDIA_WORKERS", "1"))
+MEDIA_POLL_SECONDS = 5
+MEDIA_JOB_TIMEOUT_MINUTES = int(os.getenv("MEDIA_JOB_TIMEOUT_MINUTES", "120"))
+MEDIA_MAX_ATTEMPTS = 3
+
+# (height, video bitrate); renditions taller than the source are skipped
+HLS_RENDITIONS = [(240, "400k"), (360, "800k"), (720, "2500k")]
+HLS_SEGMENT_SECONDS = 6
+
+_stop = threading.Event()
+_workers = []
+
+
+def probe(path: str):
+    """Return (duration_seconds, video_height, has_audio) for a media file"""
+    output = subprocess.run(
+        [
+            FFPROBE_BIN, "-v", "error",
+            "-show_entries", "format=duration:stream=codec_type,height",
+            "-of", "json", path,
+        ],
+        check=True, capture_output=True, text=True,
+    ).stdout
+    info = json.loads(output)
+    streams = info.get("streams", [])
+    height = max((s.get("height") or 0 for s in streams if s.get("codec_type") == "video"), default=0)
+    has_audio = any(s.get("codec_type") == "audio" for s in streams)
+    duration = float(info.get("format", {}).get("duration") or 0)
+    return int(round(duration)), height, has_audio
+
+
+def hls_command(source: str, out_dir: str, source_height: int, has_audio: bool):
+    renditions = [r for r in HLS_RENDITIONS if r[0] <= source_height] or HLS_RENDITIONS[:1]
+    count = len(renditions)
+
+    splits = "".join(f"[v{i}]" for i in range(count))
+    filters = [f"[0:v]split={count}{splits}"] + [
+        f"[v{i}]scale=-2:{height}[v{i}out]" for i, (height, _) in enumerate(renditions)
+    ]
+
+    command = [FFMPEG_BIN, "-y", "-v", "error", "-i", source, "-filter_complex", ";".join(filters)]
+    for i, (_, bitrate) in enumerate(renditions):
+        command += ["-map", f"[v{i}out]", f"-b:v:{i}", bitrate]
+        if has_audio:
+            command += ["-map", "0:a:0"]
+    command += ["-c:v", "libx264", "-preset", "veryfast", "-g", str(HLS_SEGMENT_SECONDS * 30)]
+    if has_audio:
+        command += ["-c:a", "aac", "-b:a", "96k"]
+
+    stream_map = " ".join(
+        f"v:{i},a:{i}" if has_audio else f"v:{i}" for i in range(count)
+    )
+    command += [
+        "-f", "hls",
+        "-hls_time", str(HLS_SEGMENT_SECONDS),
+        "-hls_playlist_type", "vod",
+        "-hls_segment_filename", os.path.join(out_dir, "%v", "seg_%03d.ts"),
+        "-master_pl_name", "master.m3u8",
+        "-var_stream_map", stream_map,
+        os.path.join(out_dir, "%v", "index.m3u8"),
+    ]
+    return command
+
+
+def process_job(db, job: MediaJob):
+    lesson = db.query(CourseLesson).filter(CourseLesson.id == job.lesson_id).first()
+    if not lesson or not lesson.video_file:
+        raise RuntimeError("Lesson has no video file")
+
+    duration, height, has_audio = probe(lesson.video_file)
+    course_id = db.query(CourseModule.course_id).filter(CourseModule.id == lesson.module_id).scalar()
+    course_counters.bump(db, course_id, video_seconds=duration - (lesson.duration_seconds or 0))
+    lesson.duration_seconds = duration
+    db.commit()
+
+    out_dir = os.path.join(HLS_DIR, str(lesson.id))
+    # Write into a scratch directory and swap it in, so players never see half a rendition set
+    scratch_dir = f"{out_dir}.tmp-{job.id}"
+    shutil.rmtree(scratch_dir, ignore_errors=True)
+    os.makedirs(scratch_dir)
+    subprocess.run(hls_command(lesson.video_file, scratch_dir, height, has_audio), check=True, capture_output=True)
+    shutil.rmtree(out_dir, ignore_errors=True)
+    os.replace(scratch_dir, out_dir)
+
+    lesson.hls_playlist = os.path.join(out_dir, "master.m3u8")
+    db.commit()
+
+
+def claim_job(db):
+    """Atomically move the oldest runnable job to running; safe across processes"""
+    stale_before = datetime.utcnow() - timedelta(minutes=MEDIA_JOB_TIMEOUT_MINUTES)
+    runnable = or_(
+        MediaJob.status == "queued",
+        and_(MediaJob.status == "running", MediaJob.started_at < stale_before),
+    )
+    candidate = db.query(MediaJob.id).filter(
+        runnable, MediaJob.attempts < MEDIA_MAX_ATTEMPTS
+    ).order_by(MediaJob.id).first()
+    if not candidate:
+        return None
+
+    claimed = db.query(MediaJob).filter(MediaJob.id == candidate.id, runnable).update({
+        MediaJob.status: "running",
+        MediaJob.started_at: datetime.utcnow(),
+        MediaJob.attempts: MediaJob.attempts + 1,
+    }, synchronize_session=False)
+    db.commit()
+    if claimed != 1:
+        return None
+    return db.query(MediaJob).filter(MediaJob.id == candidate.id).first()
+
+
+def run_next_job():
+    """Process one job if any is waiting; returns whether a job was found"""
+    db = SessionLocal()
+    try:
+        job = claim_job(db)
+        if not job:
+            return False
+        try:
+            process_job(db, job)
+            job.status = "done"
+            job.error = None
+        except Exception as e:
+            db.rollback()
+            stderr = getattr(e, "stderr", None)
+            job.error = (stderr.decode(errors="replace") if isinstance(stderr, bytes) else stderr or str(e))[-2000:]
+            job.status = "failed" if job.attempts >= MEDIA_MAX_ATTEMPTS else "queued"
+        job.finished_at = datetime.utcnow()
+        db.commit()
+        return True
+    finally:
+        db.close()
+
+
+def worker_loop(stop: threading.Event):
+    while not stop.is_set():
+        try:
+            found = run_next_job()
+        except Exception as e:
+            print(f"Media worker error: {e}")
+            found = False
+        if not found:
+            stop.wait(MEDIA_POLL_SECONDS)
+
+
+def start_workers():
+    # A fresh event per start, so workers told to stop never resume if this process starts again
+    global _stop
+    _stop = threading.Event()
+    for i in range(MEDIA_WORKERS):
+        worker = threading.Thread(target=worker_loop, args=(_stop,), name=f"media-worker-{i}", daemon=True)
+        worker.start()
+        _workers.append(worker)
+
+
+def stop_workers():
+    _stop.set()
+    _workers.clear()
@@ -0,0 +1,104 @@
+# Approved-enrollment membership cache for student content checks.
+# Keeps, per student, the sorted ids of courses they are approved in as a
+# compact int array, and per lesson the (course_id, teacher_id) it belongs to,
+# so HLS segment and progress requests authorize without a database query.
+# Both maps are LRU-bounded with a MEMBERSHIP_TTL expiry.
+# Enrollment changes invalidate the student's entry in this process after
+# commit. A course missing from a cached set is re-checked in the database,
+# so approvals made in other workers apply at once; revocations made in
+# other workers apply when the entry expires. The TTL is kept to a few
+# seconds for that reason: a longer one saves little (a reload is one
+# indexed query per student per TTL) and lets a rejected student keep
+# streaming for longer.
+
+import os
+import time
+import bisect
+import threading
+from array import array
+from collections import OrderedDict
+from sqlalchemy.orm import Session
+from .models import Course, CourseModule, CourseLesson, StudentCourseEnrollment
+
+MEMBERSHIP_TTL = int(os.getenv("MEMBERSHIP_TTL", "5"))
+MEMBERSHIP_CACHE_STUDENTS = int(os.getenv("MEMBERSHIP_CACHE_STUDENTS", "50000"))
+LESSON_CACHE_SIZE = int(os.getenv("LESSON_CACHE_SIZE", "20000"))
+
+_students = OrderedDict()  # student_id -> (array of course ids, loaded_at)
+_lessons = OrderedDict()  # lesson_id -> ((course_id, teacher_id), loaded_at)
+_lock = threading.Lock()
+
+
+def _get(cache: OrderedDict, key):
+    with _lock:
+        entry = cache.get(key)
+        if entry is None:
+            return None
+        if time.monotonic() - entry[1] >= MEMBERSHIP_TTL:
+            del cache[key]
+            return None
+        cache.move_to_end(key)
+        return entry[0]
+
+
+def _put(cache: OrderedDict, key, value, max_size: int):
+    with _lock:
+        cache[key] = (value, time.monotonic())
+        cache.move_to_end(key)
+        while len(cache) > max_size:
+            cache.popitem(last=False)
+
+
+def load_courses(db: Session, student_id: int):
+    ids = db.query(StudentCourseEnrollment.course_id).filter(
+        StudentCourseEnrollment.student_id == student_id,
+        StudentCourseEnrollment.status == "approved",
+    ).order_by(StudentCourseEnrollment.course_id).all()
+    courses = array("i", sorted({row[0] for row in ids}))
+    _put(_students, student_id, courses, MEMBERSHIP_CACHE_STUDENTS)
+    return courses
+
+
+def contains(courses, course_id: int):
+    i = bisect.bisect_left(courses, course_id)
+    return i < len(courses) and courses[i] == course_id
+
+
+def is_member(db: Session, student_id: int, course_id: int):
+    """Whether the student has an approved enrollment in the course"""
+    courses = _get(_students, student_id)
+    if courses is not None and contains(courses, course_id):
+        return True
+    # Not cached, or cached without this course: it may have been approved by another worker
+    return contains(load_courses(db, student_id), course_id)
+
+
+def lesson_course(db: Session, lesson_id: int):
+    """(course_id, teacher_id) for a lesson, or None if it does not exist"""
+    cached = _get(_lessons, lesson_id)
+    if cached is not None:
+        return cached
+    row = db.query(CourseModule.course_id, Course.teacher_id).join(
+        CourseLesson, CourseLesson.module_id == CourseModule.id
+    ).join(Course, CourseModule.course_id == Course.id).filter(CourseLesson.id == lesson_id).first()
+    if not row:
+        return None
+    _put(_lessons, lesson_id, (row.course_id, row.teacher_id), LESSON_CACHE_SIZE)
+    return row.course_id, row.teacher_id
+
+
+def invalidate(student_id: int):
+    with _lock:
+        _students.pop(student_id, None)
+
+
+def forget_course(course_id: int):
+    """Drop cached lessons of a deleted course; enrollments are invalidated per student"""
+    with _lock:
+        for lesson_id in [k for k, (value, _) in _lessons.items() if value[0] == course_id]:
+            del _lessons[lesson_id]
+
+
+def stats():
+    with _lock:
+        return {"students": len(_students), "lessons": len(_lessons)}
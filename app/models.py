@@ -1,4 +1,5 @@
-from sqlalchemy import Column, Integer, String, DateTime, Text, ForeignKey, Float
+from sqlalchemy import Column, Integer, String, DateTime, Date, Text, ForeignKey, Float, Index, UniqueConstraint
+from sqlalchemy.dialects import mysql
 from .database import Base
 
 class User(Base):
@@ -15,6 +16,10 @@ class User(Base):
     student_class = Column(String(50), nullable=True)  # Student class (e.g., "1", "10")
     teacher_status = Column(String(50), nullable=True)  # pending | approved | rejected
 
+    __table_args__ = (
+        Index("ix_users_role_class_board", "role", "student_class", "board"),
+    )
+
 
 class Course(Base):
     __tablename__ = "courses"
@@ -25,10 +30,19 @@ class Course(Base):
     level = Column(String(50), nullable=False, default="beginner")
     duration_hours = Column(Integer, nullable=False, default=0)
     thumbnail = Column(String(255), nullable=True)
+    thumbnail_variants = Column(Text, nullable=True)  # JSON map like {"320w.webp": "/media/thumbnails/..."}
     teacher_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     target_class = Column(String(50), nullable=True)  # e.g., "1-5", "6-8", "9-10", "11-12", or specific "Class 5"
     target_board = Column(String(100), nullable=True)  # e.g., "PSEB", "CBSE", "ICSE" or "All"
     created_at = Column(DateTime, nullable=False)
+    sync_version = Column(Integer, nullable=False, default=0, index=True)  # Set by app.sync on every write
+    # Summary counters kept in step by the write endpoints (app.course_counters)
+    module_count = Column(Integer, nullable=False, default=0)
+    lesson_count = Column(Integer, nullable=False, default=0)
+    video_seconds = Column(Integer, nullable=False, default=0)
+    resource_count = Column(Integer, nullable=False, default=0)
+    resource_size_mb = Column(Float, nullable=False, default=0)
+    student_count = Column(Integer, nullable=False, default=0)  # Approved enrollments
 
 
 class CourseModule(Base):
@@ -40,6 +54,7 @@ class CourseModule(Base):
     description = Column(Text, nullable=True)
     order = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime, nullable=False)
+    sync_version = Column(Integer, nullable=False, default=0, index=True)
 
 
 class CourseLesson(Base):
@@ -50,9 +65,11 @@ class CourseLesson(Base):
     title = Column(String(200), nullable=False)
     description = Column(Text, nullable=True)
     video_file = Column(String(500), nullable=True)  # Path to video file
+    hls_playlist = Column(String(500), nullable=True)  # Master playlist produced by app.media_jobs
     duration_seconds = Column(Integer, nullable=False, default=0)
     order = Column(Integer, nullable=False, default=0)
     created_at = Column(DateTime, nullable=False)
+    sync_version = Column(Integer, nullable=False, default=0, index=True)
 
 
 class CourseResource(Base):
@@ -65,6 +82,7 @@ class CourseResource(Base):
     file_type = Column(String(50), nullable=False)  # pdf, zip, doc, etc.
     size_mb = Column(Float, nullable=False, default=0)
     created_at = Column(DateTime, nullable=False)
+    sync_version = Column(Integer, nullable=False, default=0, index=True)
 
 
 class StudentCourseEnrollment(Base):
@@ -75,6 +93,13 @@ class StudentCourseEnrollment(Base):
     course_id = Column(Integer, ForeignKey("courses.id"), nullable=False)
     enrolled_at = Column(DateTime, nullable=False)
     status = Column(String(50), nullable=False, default="active")  # active, completed, dropped
+    approved_at = Column(DateTime, nullable=True)  # When the enrollment last became approved
+    sync_version = Column(Integer, nullable=False, default=0, index=True)
+
+    __table_args__ = (
+        Index("ix_student_enrollments_enrolled_at", "enrolled_at"),
+        Index("ix_student_enrollments_approved_at", "approved_at"),
+    )
 
 
 class StudentLessonProgress(Base):
@@ -86,3 +111,264 @@ class StudentLessonProgress(Base):
     watched_seconds = Column(Integer, nullable=False, default=0)  # How far student watched
     completed = Column(Integer, nullable=False, default=0)  # 1 if completed, 0 otherwise
     last_accessed = Column(DateTime, nullable=True)
+    # Stamped once, so rollups count each start and completion on the day it happened
+    started_at = Column(DateTime, nullable=True)
+    completed_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_lesson_progress_student_lesson", "student_id", "lesson_id", unique=True),
+        Index("ix_lesson_progress_last_accessed", "last_accessed"),
+        Index("ix_lesson_progress_started_at", "started_at"),
+        Index("ix_lesson_progress_completed_at", "completed_at"),
+    )
+
+
+class StudentFeedEntry(Base):
+    """Denormalized "continue learning" row, one per in-progress lesson, capped per student"""
+    __tablename__ = "student_feed"
+
+    id = Column(Integer, primary_key=True, index=True)
+    student_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False)
+    lesson_id = Column(Integer, ForeignKey("course_lessons.id"), nullable=False)
+    course_title = Column(String(200), nullable=False)
+    lesson_title = Column(String(200), nullable=False)
+    watched_seconds = Column(Integer, nullable=False, default=0)
+    duration_seconds = Column(Integer, nullable=False, default=0)
+    course_percent_complete = Column(Integer, nullable=False, default=0)
+    last_accessed = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        UniqueConstraint("student_id", "lesson_id", name="uq_student_feed_student_lesson"),
+        Index("ix_student_feed_student_accessed", "student_id", "last_accessed"),
+    )
+
+
+class CourseEngagementDaily(Base):
+    """Per-course activity for one day, materialized by app.rollups"""
+    __tablename__ = "course_engagement_daily"
+
+    id = Column(Integer, primary_key=True, index=True)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    new_enrollments = Column(Integer, nullable=False, default=0)
+    active_students = Column(Integer, nullable=False, default=0)
+    lessons_started = Column(Integer, nullable=False, default=0)
+    lessons_completed = Column(Integer, nullable=False, default=0)
+    median_watch_seconds = Column(Integer, nullable=False, default=0)
+    dropoff_lesson_id = Column(Integer, nullable=True)  # Lesson with the most unfinished starts that day
+
+    __table_args__ = (
+        UniqueConstraint("course_id", "day", name="uq_course_engagement_daily_course_day"),
+    )
+
+
+class LessonEngagementDaily(Base):
+    """Per-lesson activity for one day, materialized by app.rollups"""
+    __tablename__ = "lesson_engagement_daily"
+
+    id = Column(Integer, primary_key=True, index=True)
+    lesson_id = Column(Integer, ForeignKey("course_lessons.id"), nullable=False)
+    course_id = Column(Integer, ForeignKey("courses.id"), nullable=False)
+    day = Column(Date, nullable=False)
+    started = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    median_watch_seconds = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("lesson_id", "day", name="uq_lesson_engagement_daily_lesson_day"),
+        Index("ix_lesson_engagement_daily_course_day", "course_id", "day"),
+    )
+
+
+class RollupWatermark(Base):
+    """Last source timestamp folded into a rollup, so runs only read new rows"""
+    __tablename__ = "rollup_watermarks"
+
+    name = Column(String(100), primary_key=True)
+    processed_until = Column(DateTime, nullable=False)
+
+
+class ExportJob(Base):
+    """Spreadsheet export written to disk in the background for very large exports"""
+    __tablename__ = "export_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    kind = Column(String(50), nullable=False)  # users | enrollments | progress
+    course_id = Column(Integer, nullable=True)
+    file_format = Column(String(10), nullable=False, default="csv")  # csv | xlsx
+    status = Column(String(50), nullable=False, default="queued")  # queued, running, done, failed
+    file_path = Column(String(500), nullable=True)
+    row_count = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class ArchiveJob(Base):
+    """One archival run started from the admin API; the report is stored as JSON"""
+    __tablename__ = "archive_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    status = Column(String(50), nullable=False, default="queued")  # queued, running, done, failed
+    optimize = Column(Integer, nullable=False, default=0)
+    max_batches = Column(Integer, nullable=True)
+    report = Column(Text, nullable=True)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    finished_at = Column(DateTime, nullable=True)
+
+
+class MediaJob(Base):
+    """Queued ffprobe/ffmpeg work for an uploaded lesson video"""
+    __tablename__ = "media_jobs"
+
+    id = Column(Integer, primary_key=True, index=True)
+    lesson_id = Column(Integer, ForeignKey("course_lessons.id"), nullable=False, index=True)
+    status = Column(String(50), nullable=False, default="queued")  # queued, running, done, failed
+    attempts = Column(Integer, nullable=False, default=0)
+    error = Column(Text, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+    started_at = Column(DateTime, nullable=True)
+    finished_at = Column(DateTime, nullable=True)
+
+    __table_args__ = (
+        Index("ix_media_jobs_status_id", "status", "id"),
+    )
+
+
+class SyncCounter(Base):
+    """Single-row counter handing out sync versions; its row lock orders concurrent writers"""
+    __tablename__ = "sync_counter"
+
+    id = Column(Integer, primary_key=True)
+    value = Column(Integer, nullable=False, default=0)
+
+
+class SyncTombstone(Base):
+    """Records deleted rows so offline clients can drop them on their next sync"""
+    __tablename__ = "sync_tombstones"
+
+    id = Column(Integer, primary_key=True, index=True)
+    table_name = Column(String(50), nullable=False)
+    row_id = Column(Integer, nullable=False)
+    course_id = Column(Integer, nullable=True)
+    student_id = Column(Integer, nullable=True)
+    sync_version = Column(Integer, nullable=False, index=True)
+    deleted_at = Column(DateTime, nullable=False)
+
+
+class RefreshToken(Base):
+    """Rotating refresh token; only the SHA-256 of the token is stored"""
+    __tablename__ = "refresh_tokens"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    token_hash = Column(String(64), nullable=False, unique=True, index=True)
+    family_id = Column(String(32), nullable=False, index=True)  # all rotations of one login
+    expires_at = Column(DateTime, nullable=False)
+    used_at = Column(DateTime, nullable=True)  # set on rotation; presenting it again is reuse
+    created_at = Column(DateTime, nullable=False)
+
+
+class LeaderboardScore(Base):
+    """A student's running totals on one leaderboard ("course:<id>" or "class:<class>:<board>")"""
+    __tablename__ = "leaderboard_scores"
+
+    id = Column(Integer, primary_key=True, index=True)
+    board_key = Column(String(150), nullable=False)
+    student_id = Column(Integer, ForeignKey("users.id"), nullable=False, index=True)
+    lessons_completed = Column(Integer, nullable=False, default=0)
+    watch_seconds = Column(Integer, nullable=False, default=0)
+
+    __table_args__ = (
+        UniqueConstraint("board_key", "student_id", name="uq_leaderboard_scores_board_student"),
+        Index("ix_leaderboard_scores_ranking", "board_key", "lessons_completed", "watch_seconds"),
+    )
+
+
+class Notification(Base):
+    """In-app notification for one user"""
+    __tablename__ = "notifications"
+
+    id = Column(Integer, primary_key=True, index=True)
+    user_id = Column(Integer, ForeignKey("users.id"), nullable=False)
+    course_id = Column(Integer, nullable=True)
+    kind = Column(String(50), nullable=False)  # course.published, course.updated
+    title = Column(String(255), nullable=False)
+    body = Column(Text, nullable=True)
+    read_at = Column(DateTime, nullable=True)
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        Index("ix_notifications_user_id_id", "user_id", "id"),
+        Index("ix_notifications_user_read", "user_id", "read_at"),
+    )
+
+
+class LessonProgressArchive(Base):
+    """Cold lesson_progress rows moved out by app.archival; keyed by (student, lesson) with no surrogate id"""
+    __tablename__ = "lesson_progress_archive"
+
+    student_id = Column(Integer, primary_key=True)
+    lesson_id = Column(Integer, primary_key=True, index=True)
+    watched_seconds = Column(Integer, nullable=False, default=0)
+    completed = Column(Integer, nullable=False, default=0)
+    last_accessed = Column(DateTime, nullable=True)
+    archived_at = Column(DateTime, nullable=False)
+
+
+class EnrollmentArchive(Base):
+    """Rejected or otherwise finished enrollments moved out of student_enrollments; keeps the original id"""
+    __tablename__ = "student_enrollments_archive"
+
+    id = Column(Integer, primary_key=True)
+    student_id = Column(Integer, nullable=False, index=True)
+    course_id = Column(Integer, nullable=False, index=True)
+    status = Column(String(50), nullable=False)
+    enrolled_at = Column(DateTime, nullable=False)
+    archived_at = Column(DateTime, nullable=False)
+
+
+class AuditEvent(Base):
+    """Admin or teacher action, written in batches by app.audit"""
+    __tablename__ = "audit_events"
+
+    id = Column(Integer, primary_key=True, index=True)
+    actor_id = Column(Integer, nullable=False)  # 0 for the admin account, which has no users row
+    actor_role = Column(String(50), nullable=False)
+    actor_email = Column(String(255), nullable=True)
+    action = Column(String(100), nullable=False)  # e.g. user.delete, teacher.approve, enrollment.approve
+    target_type = Column(String(50), nullable=False)
+    target_id = Column(Integer, nullable=True)
+    details = Column(Text, nullable=True)  # JSON
+    created_at = Column(DateTime, nullable=False)
+
+    __table_args__ = (
+        # Filtered listings page newest-first by id, so the filter columns lead and id follows.
+        # Time-range listings page by (created_at, id); MySQL and SQLite both end a secondary
+        # index with the primary key, so the created_at index already serves that order.
+        Index("ix_audit_events_actor_id_id", "actor_id", "id"),
+        Index("ix_audit_events_target_id", "target_type", "target_id", "id"),
+        Index("ix_audit_events_action_id", "action", "id"),
+        Index("ix_audit_events_created_at", "created_at"),
+    )
+
+
+class UserSearchKey(Base):
+    """One normalized name or email token per row, for prefix search in app.user_search"""
+    __tablename__ = "user_search_keys"
+
+    id = Column(Integer, primary_key=True)
+    user_id = Column(Integer, nullable=False, index=True)
+    # Binary collation on MySQL, so prefix ranges follow code points in every script
+    search_key = Column(String(100).with_variant(mysql.VARCHAR(100, collation="utf8mb4_bin"), "mysql"), nullable=False)
+    # Copied from users so filters are applied without joining every candidate
+    role = Column(String(50), nullable=True)
+    board = Column(String(100), nullable=True)
+    student_class = Column(String(50), nullable=True)
+
+    __table_args__ = (
+        # Unique, so workers backfilling at the same time cannot duplicate keys
+        Index("ix_user_search_keys_key_user", "search_key", "user_id", unique=True),
+    )
@@ -0,0 +1,137 @@
+# In-app notifications.
+# Course publishes and updates fan out to students in a background task:
+# recipients are read in NOTIFICATION_CHUNK_SIZE slices by keyset pagination
+# on users.id (pre-filtered on the indexed role/class/board columns) and
+# each slice is written with one bulk insert. Unread counts are cached per
+# user for NOTIFICATION_COUNT_TTL seconds, in an LRU of at most
+# NOTIFICATION_COUNT_CACHE_SIZE users.
+
+import os
+import time
+import threading
+from collections import OrderedDict
+from datetime import datetime
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import User, Course, StudentCourseEnrollment, Notification
+
+NOTIFICATION_CHUNK_SIZE = int(os.getenv("NOTIFICATION_CHUNK_SIZE", "1000"))
+NOTIFICATION_COUNT_TTL = int(os.getenv("NOTIFICATION_COUNT_TTL", "30"))
+NOTIFICATION_COUNT_CACHE_SIZE = int(os.getenv("NOTIFICATION_COUNT_CACHE_SIZE", "50000"))
+
+_unread_counts = OrderedDict()  # user_id -> (count, cached_at)
+_lock = threading.Lock()
+
+
+def target_classes(target_class: str):
+    """Class values a course targets ("6-8" -> ["6", "7", "8"]), or None for every class"""
+    if not target_class:
+        return None
+    try:
+        if "-" in target_class:
+            start, end = target_class.split("-")
+            return [str(n) for n in range(int(start), int(end) + 1)]
+        return [str(int(target_class.split()[-1]))]
+    except ValueError:
+        return None
+
+
+def eligible_students(db: Session, course: Course, after_id: int, limit: int):
+    query = db.query(User).filter(
+        User.role == "student",
+        User.student_class.isnot(None),
+        User.id > after_id,
+    )
+    classes = target_classes(course.target_class)
+    if classes is not None:
+        query = query.filter(User.student_class.in_(classes))
+    if course.target_board and course.target_board != "All":
+        query = query.filter(User.board == course.target_board)
+    return query.order_by(User.id).limit(limit).all()
+
+
+def enrolled_students(db: Session, course: Course, after_id: int, limit: int):
+    return db.query(User).join(
+        StudentCourseEnrollment, StudentCourseEnrollment.student_id == User.id
+    ).filter(
+        StudentCourseEnrollment.course_id == course.id,
+        StudentCourseEnrollment.status == "approved",
+        User.id > after_id,
+    ).order_by(User.id).limit(limit).all()
+
+
+def fan_out_course(course_id: int, kind: str, is_eligible=None):
+    """
+    Background entry point. "course.published" goes to every student the
+    course targets (is_eligible is the final per-student check), anything
+    else only to the course's approved students.
+    """
+    db = SessionLocal()
+    try:
+        course = db.query(Course).filter(Course.id == course_id).first()
+        if not course:
+            return 0
+
+        if kind == "course.published":
+            title = f"New course: {course.title}"
+            select_chunk = eligible_students
+        else:
+            title = f"Course updated: {course.title}"
+            select_chunk = enrolled_students
+
+        sent = 0
+        after_id = 0
+        while True:
+            students = select_chunk(db, course, after_id, NOTIFICATION_CHUNK_SIZE)
+            if not students:
+                break
+            after_id = students[-1].id
+            recipients = [s.id for s in students if is_eligible is None or is_eligible(s, course)]
+            now = datetime.utcnow()
+            db.bulk_insert_mappings(Notification, [
+                {
+                    "user_id": student_id,
+                    "course_id": course.id,
+                    "kind": kind,
+                    "title": title,
+                    "body": course.description,
+                    "created_at": now,
+                }
+                for student_id in recipients
+            ])
+            db.commit()
+            invalidate_unread(recipients)
+            sent += len(recipients)
+        return sent
+    except Exception as e:
+        db.rollback()
+        print(f"Notification fan-out for course {course_id} failed: {e}")
+    finally:
+        db.close()
+
+
+def unread_count(db: Session, user_id: int):
+    with _lock:
+        cached = _unread_counts.get(user_id)
+        if cached and time.monotonic() - cached[1] < NOTIFICATION_COUNT_TTL:
+            _unread_counts.move_to_end(user_id)
+            return cached[0]
+        if cached:
+            del _unread_counts[user_id]
+
+    count = db.query(func.count(Notification.id)).filter(
+        Notification.user_id == user_id, Notification.read_at.is_(None)
+    ).scalar()
+    with _lock:
+        _unread_counts[user_id] = (count, time.monotonic())
+        _unread_counts.move_to_end(user_id)
+        while len(_unread_counts) > NOTIFICATION_COUNT_CACHE_SIZE:
+            _unread_counts.popitem(last=False)
+    return count
+
+
+def invalidate_unread(user_ids):
+    with _lock:
+        for user_id in user_ids:
+            _unread_counts.pop(user_id, None)
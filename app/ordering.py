@@ -0,0 +1,91 @@
+# Gapped ordering keys for modules and lessons.
+# Siblings are spaced ORDER_GAP apart, so moving one item only rewrites that
+# item's key (the midpoint of its new neighbours). Siblings are renumbered
+# only when a gap is exhausted.
+
+import bisect
+
+ORDER_GAP = 1024
+
+
+def next_order(max_order):
+    return (max_order or 0) + ORDER_GAP
+
+
+def longest_increasing(values):
+    """Indexes of one longest strictly increasing subsequence of values"""
+    tails = []
+    tail_indexes = []
+    previous = [None] * len(values)
+
+    for i, value in enumerate(values):
+        position = bisect.bisect_left(tails, value)
+        if position == len(tails):
+            tails.append(value)
+            tail_indexes.append(i)
+        else:
+            tails[position] = value
+            tail_indexes[position] = i
+        previous[i] = tail_indexes[position - 1] if position else None
+
+    result = []
+    i = tail_indexes[-1] if tail_indexes else None
+    while i is not None:
+        result.append(i)
+        i = previous[i]
+    return result[::-1]
+
+
+def plan_reorder(current, requested_ids):
+    """
+    current: [(id, order)] for every sibling.
+    requested_ids: all or some sibling ids in their new relative order;
+    unlisted siblings keep their positions.
+    Returns ({id: new_order} for rows that must change, rebalanced).
+    """
+    current = sorted(current, key=lambda row: (row[1], row[0]))
+    ids = [row_id for row_id, _ in current]
+    keys = dict(current)
+
+    slots = [i for i, row_id in enumerate(ids) if row_id in set(requested_ids)]
+    desired = list(ids)
+    for slot, row_id in zip(slots, requested_ids):
+        desired[slot] = row_id
+    if desired == ids:
+        return {}, False
+
+    # Keep the largest set of rows whose keys are already in the right order
+    kept = {desired[i] for i in longest_increasing([(keys[row_id], row_id) for row_id in desired])}
+
+    updates = {}
+    i = 0
+    while i < len(desired):
+        if desired[i] in kept:
+            i += 1
+            continue
+        run_end = i
+        while run_end < len(desired) and desired[run_end] not in kept:
+            run_end += 1
+        low = keys[desired[i - 1]] if i > 0 else None
+        high = keys[desired[run_end]] if run_end < len(desired) else None
+        count = run_end - i
+
+        if low is None and high is None:
+            new_keys = [ORDER_GAP * (j + 1) for j in range(count)]
+        elif high is None:
+            new_keys = [low + ORDER_GAP * (j + 1) for j in range(count)]
+        elif low is None:
+            new_keys = [high - ORDER_GAP * (count - j) for j in range(count)]
+        elif high - low > count:
+            step = (high - low) / (count + 1)
+            new_keys = [low + int(step * (j + 1)) for j in range(count)]
+        else:
+            # Gap exhausted: renumber every sibling
+            return {row_id: ORDER_GAP * (j + 1) for j, row_id in enumerate(desired)}, True
+
+        for row_id, key in zip(desired[i:run_end], new_keys):
+            updates[row_id] = key
+            keys[row_id] = key
+        i = run_end
+
+    return updates, False
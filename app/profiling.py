@@ -0,0 +1,255 @@
+# On-demand request profiling.
+# An admin sends "X-Profile: 1" (or ?profile=1) and that one request runs
+# under cProfile (pyinstrument when installed) with every SQL statement timed.
+# PROFILE_SAMPLE_RATE additionally profiles a random fraction of all requests
+# and keeps the PROFILE_KEEP_SLOWEST slowest profiles per route in memory.
+# Requests that are not selected only pay for a header lookup.
+
+import os
+import json
+import time
+import uuid
+import heapq
+import inspect
+import random
+import pstats
+import cProfile
+import functools
+import threading
+import contextvars
+from datetime import datetime
+from urllib.parse import parse_qs
+from fastapi import HTTPException
+from fastapi.routing import APIRoute
+from sqlalchemy import event
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "./profiles")
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+PROFILE_KEEP_SLOWEST = int(os.getenv("PROFILE_KEEP_SLOWEST", "5"))
+PROFILE_TOP_FUNCTIONS = 40
+
+current_profile = contextvars.ContextVar("current_profile", default=None)
+
+slowest_by_route = {}
+_slowest_lock = threading.Lock()
+_sql_listeners_installed = False
+
+
+class ProfileSession:
+    def __init__(self, method: str, path: str, sampled: bool):
+        self.id = uuid.uuid4().hex[:12]
+        self.method = method
+        self.path = path
+        self.route = path
+        self.sampled = sampled
+        self.started_at = datetime.utcnow()
+        self.duration_ms = 0.0
+        self.status_code = None
+        self.queries = []
+        self.functions = []
+        self.html = None
+
+    def run(self, func, *args, **kwargs):
+        """Run func under a profiler in the calling thread"""
+        try:
+            from pyinstrument import Profiler
+        except ImportError:
+            Profiler = None
+
+        if Profiler is not None:
+            profiler = Profiler(interval=0.001)
+            profiler.start()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                profiler.stop()
+                self.html = profiler.output_html()
+                self.functions = [{"summary": profiler.output_text(unicode=False, color=False)}]
+
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            profiler.disable()
+            self.functions = top_functions(profiler)
+
+    def to_dict(self):
+        return {
+            "id": self.id,
+            "method": self.method,
+            "path": self.path,
+            "route": self.route,
+            "sampled": self.sampled,
+            "started_at": self.started_at.isoformat(),
+            "duration_ms": round(self.duration_ms, 3),
+            "status_code": self.status_code,
+            "sql_count": len(self.queries),
+            "sql_ms": round(sum(q["duration_ms"] for q in self.queries), 3),
+            "queries": self.queries,
+            "functions": self.functions,
+        }
+
+
+def top_functions(profiler):
+    stats = pstats.Stats(profiler)
+    rows = []
+    for (filename, line, name), (cc, nc, tottime, cumtime, callers) in stats.stats.items():
+        rows.append({
+            "function": f"{filename}:{line}({name})",
+            "calls": nc,
+            "tottime_ms": round(tottime * 1000, 3),
+            "cumtime_ms": round(cumtime * 1000, 3),
+        })
+    rows.sort(key=lambda r: r["cumtime_ms"], reverse=True)
+    return rows[:PROFILE_TOP_FUNCTIONS]
+
+
+def install_sql_listeners(engine):
+    """Time SQL for profiled requests; installed on first use so normal traffic never pays for it"""
+    global _sql_listeners_installed
+    if _sql_listeners_installed:
+        return
+    _sql_listeners_installed = True
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        if current_profile.get() is not None:
+            context._profile_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+        session = current_profile.get()
+        started = getattr(context, "_profile_started", None)
+        if session is not None and started is not None:
+            session.queries.append({
+                "statement": statement,
+                "parameters": repr(parameters)[:500],
+                "duration_ms": round((time.perf_counter() - started) * 1000, 3),
+            })
+
+
+def save_profile(session: ProfileSession):
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    with open(os.path.join(PROFILE_DIR, f"{session.id}.json"), "w") as f:
+        json.dump(session.to_dict(), f, indent=2, default=str)
+    if session.html:
+        with open(os.path.join(PROFILE_DIR, f"{session.id}.html"), "w") as f:
+            f.write(session.html)
+
+
+def record_sampled(session: ProfileSession):
+    """Keep only the slowest PROFILE_KEEP_SLOWEST sampled profiles per route"""
+    with _slowest_lock:
+        heap = slowest_by_route.setdefault(session.route, [])
+        entry = (session.duration_ms, session.id, session.to_dict())
+        if len(heap) < PROFILE_KEEP_SLOWEST:
+            heapq.heappush(heap, entry)
+        elif entry[0] > heap[0][0]:
+            heapq.heapreplace(heap, entry)
+
+
+def slowest_profiles():
+    with _slowest_lock:
+        return {
+            route: [profile for _, _, profile in sorted(heap, reverse=True)]
+            for route, heap in slowest_by_route.items()
+        }
+
+
+def load_profile(profile_id: str, html: bool = False):
+    if not profile_id.isalnum():
+        return None
+    path = os.path.join(PROFILE_DIR, f"{profile_id}.{'html' if html else 'json'}")
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return f.read() if html else json.load(f)
+
+
+class ProfiledRoute(APIRoute):
+    """Route whose endpoint runs under the request's profiler, in whichever thread FastAPI uses"""
+
+    def __init__(self, path, endpoint, **kwargs):
+        if inspect.iscoroutinefunction(endpoint):
+            @functools.wraps(endpoint)
+            async def wrapped(*args, **kw):
+                session = current_profile.get()
+                if session is None:
+                    return await endpoint(*args, **kw)
+                # cProfile would also count other coroutines on the loop, so
+                # async endpoints only get SQL timings and wall time
+                session.route = path
+                return await endpoint(*args, **kw)
+        else:
+            @functools.wraps(endpoint)
+            def wrapped(*args, **kw):
+                session = current_profile.get()
+                if session is None:
+                    return endpoint(*args, **kw)
+                session.route = path
+                return session.run(endpoint, *args, **kw)
+        super().__init__(path, wrapped, **kwargs)
+
+
+def profile_param(scope):
+    """Whether the query string has profile=1 (not e.g. myprofile=1 or profile=10)"""
+    query_string = scope.get("query_string", b"")
+    if b"profile" not in query_string:
+        return False
+    return "1" in parse_qs(query_string.decode("latin-1")).get("profile", [])
+
+
+class ProfilingMiddleware:
+    """Select requests for profiling and store the result"""
+
+    def __init__(self, app, engine, authorize_admin):
+        self.app = app
+        self.engine = engine
+        self.authorize_admin = authorize_admin
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            return await self.app(scope, receive, send)
+
+        requested = any(name == b"x-profile" for name, _ in scope["headers"]) or profile_param(scope)
+        sampled = not requested and PROFILE_SAMPLE_RATE > 0 and random.random() < PROFILE_SAMPLE_RATE
+        if not requested and not sampled:
+            return await self.app(scope, receive, send)
+
+        if requested and not self.is_admin(scope):
+            return await self.app(scope, receive, send)
+
+        install_sql_listeners(self.engine)
+        session = ProfileSession(scope["method"], scope["path"], sampled)
+
+        async def send_wrapper(message):
+            if message["type"] == "http.response.start":
+                session.status_code = message["status"]
+                if requested:
+                    message.setdefault("headers", [])
+                    message["headers"] = list(message["headers"]) + [(b"x-profile-id", session.id.encode())]
+            await send(message)
+
+        token = current_profile.set(session)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send_wrapper)
+        finally:
+            session.duration_ms = (time.perf_counter() - started) * 1000
+            current_profile.reset(token)
+            if requested:
+                save_profile(session)
+            else:
+                record_sampled(session)
+
+    def is_admin(self, scope):
+        authorization = None
+        for name, value in scope["headers"]:
+            if name == b"authorization":
+                authorization = value.decode("latin-1")
+        try:
+            self.authorize_admin(authorization)
+            return True
+        except HTTPException:
+            return False
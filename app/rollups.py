@@ -0,0 +1,181 @@
+# Course engagement rollups.
+# Folds lesson starts, lesson completions and enrollment approvals recorded
+# since the last run into the daily course_engagement_daily and
+# lesson_engagement_daily tables. Each event is counted on the day it
+# happened: progress rows carry started_at and completed_at, stamped once,
+# and enrollments carry approved_at. last_accessed moves on every heartbeat,
+# so it is not used here. Progress recorded before these columns existed has
+# no event times and is not counted.
+#
+# Run from cron:  python -m app.rollups
+# Or in-process:  ROLLUP_INTERVAL_MINUTES=1440
+
+import os
+import asyncio
+import statistics
+from datetime import datetime, timedelta, time
+from sqlalchemy import func
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import (
+    CourseModule, CourseLesson, StudentCourseEnrollment, StudentLessonProgress,
+    CourseEngagementDaily, LessonEngagementDaily, RollupWatermark,
+)
+
+WATERMARK_NAME = "course_engagement"
+ROLLUP_INTERVAL_MINUTES = int(os.getenv("ROLLUP_INTERVAL_MINUTES", "0"))
+# Rows stamped just before a run may still be uncommitted; leave them for the next run
+ROLLUP_LAG = timedelta(seconds=60)
+
+
+def touched_days(db: Session, since: datetime, until: datetime):
+    """Days with a lesson start, completion or enrollment approval in (since, until]"""
+    days = set()
+    for column in (StudentLessonProgress.started_at, StudentLessonProgress.completed_at, StudentCourseEnrollment.approved_at):
+        rows = db.query(func.date(column)).filter(column > since, column <= until).distinct()
+        days.update(row[0] for row in rows)
+    # SQLite returns DATE() as text, MySQL as a date
+    return sorted(d if not isinstance(d, str) else datetime.strptime(d, "%Y-%m-%d").date() for d in days)
+
+
+def progress_events(db: Session, column, start: datetime, end: datetime):
+    """(course_id, lesson_id, student_id, watched_seconds) of progress rows whose event time is in [start, end)"""
+    return db.query(
+        CourseModule.course_id,
+        StudentLessonProgress.lesson_id,
+        StudentLessonProgress.student_id,
+        StudentLessonProgress.watched_seconds,
+    ).join(
+        CourseLesson, StudentLessonProgress.lesson_id == CourseLesson.id
+    ).join(
+        CourseModule, CourseLesson.module_id == CourseModule.id
+    ).filter(column >= start, column < end).all()
+
+
+def rollup_day(db: Session, day):
+    """Recompute both rollup tables for one day from the events that happened on it"""
+    start = datetime.combine(day, time.min)
+    end = start + timedelta(days=1)
+
+    lessons = {}
+    courses = {}
+
+    def stats_for(course_id, lesson_id, student_id):
+        lesson = lessons.setdefault(lesson_id, {"course_id": course_id, "started": 0, "completed": 0, "watch": []})
+        course = courses.setdefault(course_id, {"students": set(), "started": 0, "completed": 0, "watch": []})
+        course["students"].add(student_id)
+        return lesson, course
+
+    # Watch time is reported for the lessons first opened that day
+    for course_id, lesson_id, student_id, watched_seconds in progress_events(db, StudentLessonProgress.started_at, start, end):
+        lesson, course = stats_for(course_id, lesson_id, student_id)
+        for stats in (lesson, course):
+            stats["started"] += 1
+            stats["watch"].append(watched_seconds or 0)
+
+    for course_id, lesson_id, student_id, _ in progress_events(db, StudentLessonProgress.completed_at, start, end):
+        lesson, course = stats_for(course_id, lesson_id, student_id)
+        lesson["completed"] += 1
+        course["completed"] += 1
+
+    enrollments = db.query(
+        StudentCourseEnrollment.course_id, func.count(StudentCourseEnrollment.id)
+    ).filter(
+        StudentCourseEnrollment.status == "approved",
+        StudentCourseEnrollment.approved_at >= start,
+        StudentCourseEnrollment.approved_at < end,
+    ).group_by(StudentCourseEnrollment.course_id).all()
+    new_enrollments = dict(enrollments)
+
+    db.query(LessonEngagementDaily).filter(LessonEngagementDaily.day == day).delete()
+    db.query(CourseEngagementDaily).filter(CourseEngagementDaily.day == day).delete()
+
+    db.bulk_insert_mappings(LessonEngagementDaily, [
+        {
+            "lesson_id": lesson_id,
+            "course_id": stats["course_id"],
+            "day": day,
+            "started": stats["started"],
+            "completed": stats["completed"],
+            "median_watch_seconds": int(statistics.median(stats["watch"])) if stats["watch"] else 0,
+        }
+        for lesson_id, stats in lessons.items()
+    ])
+
+    course_rows = []
+    for course_id in set(courses) | set(new_enrollments):
+        stats = courses.get(course_id, {"students": set(), "started": 0, "completed": 0, "watch": []})
+        unfinished = {
+            lesson_id: lesson["started"] - lesson["completed"]
+            for lesson_id, lesson in lessons.items()
+            if lesson["course_id"] == course_id and lesson["started"] > lesson["completed"]
+        }
+        course_rows.append({
+            "course_id": course_id,
+            "day": day,
+            "new_enrollments": new_enrollments.get(course_id, 0),
+            "active_students": len(stats["students"]),
+            "lessons_started": stats["started"],
+            "lessons_completed": stats["completed"],
+            "median_watch_seconds": int(statistics.median(stats["watch"])) if stats["watch"] else 0,
+            "dropoff_lesson_id": max(unfinished, key=unfinished.get) if unfinished else None,
+        })
+    db.bulk_insert_mappings(CourseEngagementDaily, course_rows)
+
+    return len(lessons), len(course_rows)
+
+
+def run_rollup(db: Session = None):
+    """Fold everything written since the watermark into the daily tables"""
+    owns_session = db is None
+    db = db or SessionLocal()
+    try:
+        watermark = db.query(RollupWatermark).filter(RollupWatermark.name == WATERMARK_NAME).first()
+        if not watermark:
+            watermark = RollupWatermark(name=WATERMARK_NAME, processed_until=datetime(1970, 1, 1))
+            db.add(watermark)
+
+        since = watermark.processed_until
+        until = max(since, datetime.utcnow() - ROLLUP_LAG)
+        days = touched_days(db, since, until)
+
+        lesson_rows = course_rows = 0
+        for day in days:
+            lessons, courses = rollup_day(db, day)
+            lesson_rows += lessons
+            course_rows += courses
+            db.commit()
+
+        watermark.processed_until = until
+        db.commit()
+
+        return {
+            "since": since,
+            "until": until,
+            "days": [d.isoformat() for d in days],
+            "lessonRows": lesson_rows,
+            "courseRows": course_rows,
+        }
+    finally:
+        if owns_session:
+            db.close()
+
+
+async def rollup_scheduler():
+    """Re-run the rollup every ROLLUP_INTERVAL_MINUTES inside the web process"""
+    from starlette.concurrency import run_in_threadpool
+
+    while True:
+        try:
+            result = await run_in_threadpool(run_rollup)
+            print(f"Engagement rollup processed {len(result['days'])} day(s)")
+        except Exception as e:
+            print(f"Engagement rollup failed: {e}")
+        await asyncio.sleep(ROLLUP_INTERVAL_MINUTES * 60)
+
+
+if __name__ == "__main__":
+    from .database import engine, Base
+
+    Base.metadata.create_all(bind=engine, checkfirst=True)
+    print(run_rollup())
@@ -0,0 +1,160 @@
+# Production launcher: a gunicorn master supervising uvicorn workers.
+# The app is imported once in the master (preload) and workers are forked
+# from it, so imported modules are shared copy-on-write. Workers are
+# recycled after MAX_REQUESTS requests (plus jitter) to cap memory growth.
+# Enrollment events only reach other workers through Redis, so with the
+# in-memory broker the launcher runs a single worker and refuses more.
+# Schedulers and backfills run in one elected worker (see app.leader).
+#
+#   python -m app.server                      serve on $PORT
+#   python -m app.server --rolling-restart    replace workers one at a time
+#
+# Signals to the master (pid in GUNICORN_PID_FILE):
+#   HUP         replace all workers at once (forked from the preloaded code)
+#   TTIN/TTOU   add a worker / retire the oldest one
+#   USR2, then WINCH and QUIT to the old master: deploy new code with no downtime
+
+import os
+import sys
+import math
+import time
+import signal
+
+WORKER_MEMORY_MB = int(os.getenv("WORKER_MEMORY_MB", "256"))
+MAX_REQUESTS = int(os.getenv("MAX_REQUESTS", "5000"))
+MAX_REQUESTS_JITTER = int(os.getenv("MAX_REQUESTS_JITTER", "500"))
+GRACEFUL_TIMEOUT = int(os.getenv("GRACEFUL_TIMEOUT", "30"))
+GUNICORN_PID_FILE = os.getenv("GUNICORN_PID_FILE", "/tmp/sikhiya-gunicorn.pid")
+
+
+def read_first_line(path: str):
+    try:
+        with open(path) as f:
+            return f.readline().strip()
+    except OSError:
+        return None
+
+
+def available_cpus():
+    """CPUs this process may use, honouring cgroup quotas inside containers"""
+    try:
+        cpus = len(os.sched_getaffinity(0))
+    except AttributeError:
+        cpus = os.cpu_count() or 1
+
+    quota = read_first_line("/sys/fs/cgroup/cpu.max")  # cgroup v2: "<quota> <period>" or "max <period>"
+    if quota and not quota.startswith("max"):
+        limit, period = quota.split()
+        cpus = min(cpus, math.ceil(int(limit) / int(period)))
+    else:
+        limit = read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_quota_us")  # cgroup v1
+        period = read_first_line("/sys/fs/cgroup/cpu/cpu.cfs_period_us")
+        if limit and period and int(limit) > 0:
+            cpus = min(cpus, math.ceil(int(limit) / int(period)))
+    return max(1, cpus)
+
+
+def available_memory_mb():
+    """Memory limit of the container, or physical memory outside one"""
+    total = os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    for path in ("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes"):
+        limit = read_first_line(path)
+        if limit and limit.isdigit():
+            total = min(total, int(limit))
+    return total // (1024 * 1024)
+
+
+def shared_events():
+    """Whether enrollment events reach subscribers in every worker"""
+    from .events import broker, RedisBroker
+
+    return isinstance(broker, RedisBroker)
+
+
+def worker_count():
+    """WEB_CONCURRENCY if set; else 1 without a shared events broker, or 2 x CPUs + 1 capped by memory"""
+    if os.getenv("WEB_CONCURRENCY"):
+        return max(1, int(os.getenv("WEB_CONCURRENCY")))
+    if not shared_events():
+        return 1
+    by_cpu = 2 * available_cpus() + 1
+    by_memory = available_memory_mb() // WORKER_MEMORY_MB
+    return max(1, min(by_cpu, by_memory))
+
+
+def post_fork(server, worker):
+    # Connections opened while importing in the master must not be shared with workers
+    from .database import engine
+
+    engine.dispose(close=False)
+
+
+def gunicorn_options(port: int = None, workers: int = None):
+    return {
+        "bind": f"0.0.0.0:{port or os.getenv('PORT', '8000')}",
+        "workers": workers or worker_count(),
+        "worker_class": "uvicorn_worker.UvicornWorker",
+        "preload_app": True,
+        "max_requests": MAX_REQUESTS,
+        "max_requests_jitter": MAX_REQUESTS_JITTER,
+        "graceful_timeout": GRACEFUL_TIMEOUT,
+        "timeout": 120,
+        "keepalive": 5,
+        "pidfile": GUNICORN_PID_FILE,
+        "accesslog": "-",
+        "post_fork": post_fork,
+    }
+
+
+def run(app=None, port: int = None, workers: int = None):
+    """Serve app (default app.main:app) under gunicorn; blocks until shutdown"""
+    from gunicorn.app.base import BaseApplication
+
+    class Server(BaseApplication):
+        def load_config(self):
+            for key, value in gunicorn_options(port, workers).items():
+                self.cfg.set(key, value)
+
+        def load(self):
+            if app is not None:
+                return app
+            from .main import app as main_app
+            return main_app
+
+    options = gunicorn_options(port, workers)
+    if options["workers"] > 1 and not shared_events():
+        # SSE subscribers would miss events published in the other workers
+        raise SystemExit(f"{options['workers']} workers need EVENTS_BROKER=redis; "
+                         "set WEB_CONCURRENCY=1 or configure Redis")
+    print(f"Starting {options['workers']} workers on {options['bind']} "
+          f"({available_cpus()} CPUs, {available_memory_mb()} MB)")
+    Server().run()
+
+
+def worker_pids(master_pid: int):
+    children = read_first_line(f"/proc/{master_pid}/task/{master_pid}/children") or ""
+    return {int(pid) for pid in children.split()}
+
+
+def rolling_restart(settle_seconds: float = 2.0):
+    """Swap each worker for a fresh one, one at a time, so capacity never drops"""
+    master_pid = int(read_first_line(GUNICORN_PID_FILE))
+    original = worker_pids(master_pid)
+    for _ in range(len(original)):
+        before = worker_pids(master_pid)
+        os.kill(master_pid, signal.SIGTTIN)
+        # Wait for the extra worker before retiring the oldest (gunicorn's TTOU picks the oldest)
+        deadline = time.monotonic() + GRACEFUL_TIMEOUT
+        while len(worker_pids(master_pid) - before) == 0 and time.monotonic() < deadline:
+            time.sleep(0.2)
+        time.sleep(settle_seconds)
+        os.kill(master_pid, signal.SIGTTOU)
+        time.sleep(settle_seconds)
+    print(f"Replaced {len(original)} workers; {len(worker_pids(master_pid) & original)} originals left")
+
+
+if __name__ == "__main__":
+    if "--rolling-restart" in sys.argv:
+        rolling_restart()
+    else:
+        run()
@@ -0,0 +1,64 @@
+# Single-flight coalescing for identical concurrent reads.
+# The first request for a key runs the computation; requests for the same key
+# that arrive while it is running wait for that result instead of querying
+# the database again. Errors raised by the computation are re-raised in every
+# waiter. Nothing is cached: once the call finishes the next request for the
+# key starts a fresh one.
+
+import os
+import threading
+
+SINGLEFLIGHT_TIMEOUT = float(os.getenv("SINGLEFLIGHT_TIMEOUT", "10"))
+
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+        self.waiters = 0
+
+
+class SingleFlight:
+    def __init__(self):
+        self._calls = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key, fn, timeout: float = None):
+        """Run fn() once per key across concurrent callers and return its result to all of them"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+            else:
+                call.waiters += 1
+                self.shared += 1
+
+        if not leader:
+            if not call.done.wait(SINGLEFLIGHT_TIMEOUT if timeout is None else timeout):
+                raise TimeoutError(f"Timed out waiting for in-flight {key}")
+            if call.error is not None:
+                raise call.error
+            return call.result
+
+        try:
+            call.result = fn()
+            return call.result
+        except BaseException as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                self._calls.pop(key, None)
+            call.done.set()
+
+    def stats(self):
+        with self._lock:
+            return {"in_flight": len(self._calls), "executed": self.executed, "shared": self.shared}
+
+
+group = SingleFlight()
@@ -0,0 +1,83 @@
+# Delta sync for offline-first clients.
+# Every insert, update or delete of a synced row stamps it with a version from
+# the single-row sync_counter table. The counter row stays locked until the
+# writing transaction commits, so versions become visible in order and a
+# client holding token N has seen every change <= N.
+
+from datetime import datetime
+from sqlalchemy import event, select, update, insert
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import (
+    Course, CourseModule, CourseLesson, CourseResource, StudentCourseEnrollment,
+    SyncCounter, SyncTombstone,
+)
+
+SYNCED_MODELS = (Course, CourseModule, CourseLesson, CourseResource, StudentCourseEnrollment)
+
+
+def next_version(db: Session) -> int:
+    connection = db.connection()
+    bumped = connection.execute(
+        update(SyncCounter).where(SyncCounter.id == 1).values(value=SyncCounter.value + 1)
+    ).rowcount
+    if not bumped:
+        connection.execute(insert(SyncCounter).values(id=1, value=1))
+    return connection.execute(select(SyncCounter.value).where(SyncCounter.id == 1)).scalar_one()
+
+
+def current_version(db: Session) -> int:
+    return db.query(SyncCounter.value).filter(SyncCounter.id == 1).scalar() or 0
+
+
+def tombstone_for(db: Session, obj):
+    course_id = getattr(obj, "course_id", None)
+    if isinstance(obj, Course):
+        course_id = obj.id
+    elif isinstance(obj, CourseLesson):
+        course_id = db.query(CourseModule.course_id).filter(CourseModule.id == obj.module_id).scalar()
+    return SyncTombstone(
+        table_name=obj.__tablename__,
+        row_id=obj.id,
+        course_id=course_id,
+        student_id=getattr(obj, "student_id", None),
+        deleted_at=datetime.utcnow(),
+    )
+
+
+@event.listens_for(SessionLocal, "before_flush")
+def stamp_sync_versions(db, flush_context, instances):
+    changed = [
+        obj for obj in list(db.new) + [o for o in db.dirty if db.is_modified(o)]
+        if isinstance(obj, SYNCED_MODELS)
+    ]
+    deleted = [obj for obj in db.deleted if isinstance(obj, SYNCED_MODELS)]
+    if not changed and not deleted:
+        return
+
+    version = next_version(db)
+    for obj in changed:
+        obj.sync_version = version
+    for obj in deleted:
+        tombstone = tombstone_for(db, obj)
+        tombstone.sync_version = version
+        db.add(tombstone)
+
+
+def record_bulk_tombstones(db: Session, table_name: str, rows):
+    """For query.delete() calls, which bypass the flush hook; rows are (row_id, course_id, student_id)"""
+    rows = list(rows)
+    if not rows:
+        return
+    version = next_version(db)
+    db.bulk_insert_mappings(SyncTombstone, [
+        {
+            "table_name": table_name,
+            "row_id": row_id,
+            "course_id": course_id,
+            "student_id": student_id,
+            "sync_version": version,
+            "deleted_at": datetime.utcnow(),
+        }
+        for row_id, course_id, student_id in rows
+    ])
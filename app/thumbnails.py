@@ -0,0 +1,128 @@
+# Course thumbnail ingestion.
+# Uploaded images are stored under their SHA-256 digest and resized into
+# small JPEG and WebP variants in a process pool, so catalog cards can load
+# a few KB instead of the teacher's original photo.
+# Files are served as immutable, so each is written to a temporary file in
+# the same directory and renamed into place; readers never see a partial one.
+
+import os
+import json
+import hashlib
+import tempfile
+from concurrent.futures import ProcessPoolExecutor
+from .database import SessionLocal
+from .models import Course
+
+MEDIA_ROOT = os.getenv("MEDIA_ROOT", "./media")
+THUMBNAIL_DIR = os.path.join(MEDIA_ROOT, "thumbnails")
+THUMBNAIL_WIDTHS = [160, 320, 640]
+THUMBNAIL_FORMATS = {"webp": "WEBP", "jpg": "JPEG"}
+THUMBNAIL_WORKERS = int(os.getenv("THUMBNAIL_WORKERS", "2"))
+MAX_THUMBNAIL_BYTES = 10 * 1024 * 1024
+
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=THUMBNAIL_WORKERS)
+    return _pool
+
+
+def shutdown_pool():
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def thumbnail_url(filename: str):
+    return f"/media/thumbnails/{filename}"
+
+
+def write_atomically(path: str, write):
+    """Call write(temp_path), then rename the finished file to path"""
+    fd, temp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix=".tmp-")
+    os.close(fd)
+    try:
+        write(temp_path)
+        os.chmod(temp_path, 0o644)
+        os.replace(temp_path, path)
+    except BaseException:
+        os.unlink(temp_path)
+        raise
+
+
+def write_bytes(path: str, data: bytes):
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+def store_original(data: bytes, extension: str):
+    """Save the upload under its content hash; identical uploads share one file"""
+    digest = hashlib.sha256(data).hexdigest()
+    os.makedirs(THUMBNAIL_DIR, exist_ok=True)
+    filename = f"{digest}.{extension}"
+    path = os.path.join(THUMBNAIL_DIR, filename)
+    if not os.path.exists(path):
+        write_atomically(path, lambda temp_path: write_bytes(temp_path, data))
+    return digest, filename
+
+
+def generate_variants(original_path: str, digest: str, out_dir: str):
+    """Runs in a worker process; returns {"<width>w.<ext>": filename}"""
+    from PIL import Image, ImageOps
+
+    variants = {}
+    with Image.open(original_path) as image:
+        image = ImageOps.exif_transpose(image).convert("RGB")
+        for width in THUMBNAIL_WIDTHS:
+            if width > image.width and width != THUMBNAIL_WIDTHS[0]:
+                continue
+            height = round(image.height * width / image.width)
+            resized = image.resize((width, height), Image.LANCZOS)
+            for extension, pil_format in THUMBNAIL_FORMATS.items():
+                filename = f"{digest}-{width}w.{extension}"
+                path = os.path.join(out_dir, filename)
+                if not os.path.exists(path):
+                    write_atomically(path, lambda temp_path: resized.save(temp_path, pil_format, quality=80, optimize=True))
+                variants[f"{width}w.{extension}"] = filename
+    return variants
+
+
+def record_variants(course_id: int, digest: str, future):
+    """Done-callback: write the variant paths onto the course"""
+    db = SessionLocal()
+    try:
+        course = db.query(Course).filter(Course.id == course_id).first()
+        # A newer upload may have replaced this one while it was processing
+        if not course or not course.thumbnail or digest not in course.thumbnail:
+            return
+        try:
+            variants = future.result()
+        except Exception as e:
+            print(f"Thumbnail processing failed for course {course_id}: {e}")
+            course.thumbnail_variants = json.dumps({"error": str(e)})
+        else:
+            course.thumbnail_variants = json.dumps({
+                name: thumbnail_url(filename) for name, filename in variants.items()
+            })
+        db.commit()
+    finally:
+        db.close()
+
+
+def submit_thumbnail(course_id: int, digest: str, filename: str):
+    future = get_pool().submit(
+        generate_variants, os.path.join(THUMBNAIL_DIR, filename), digest, THUMBNAIL_DIR
+    )
+    future.add_done_callback(lambda f: record_variants(course_id, digest, f))
+    return future
+
+
+def course_thumbnail_variants(course: Course):
+    if not course.thumbnail_variants:
+        return None
+    variants = json.loads(course.thumbnail_variants)
+    return None if "error" in variants else variants
@@ -0,0 +1,192 @@
+# Typeahead search over user names and emails for the admin console.
+# Every user has a few rows in user_search_keys: each word of the name, the
+# email's local-part words, and the whole email, casefolded, with accents
+# stripped from Latin letters. Words are runs of Unicode letters, digits and
+# their combining marks, so Devanagari and Gurmukhi names are searchable
+# too. A query prefix becomes a range scan on the (search_key, user_id)
+# index, read in index order, so the first page of matches costs about as
+# much as the rows it returns, whatever the size of the users table.
+# Keys are written on register and removed with the user; users without keys
+# (rows that existed before this table) are filled in by a background thread
+# on startup. After a change to the tokenizer, rebuild so existing keys match.
+#
+# Rebuild everything:  python -m app.user_search
+
+import threading
+import unicodedata
+from sqlalchemy import exists
+from sqlalchemy.orm import Session
+from .database import SessionLocal
+from .models import User, UserSearchKey
+
+KEY_LENGTH = 100
+BACKFILL_BATCH_SIZE = 1000
+MAX_QUERY_TOKENS = 4
+
+
+def normalize(text: str):
+    """NFKD and casefold; accents are dropped from Latin letters, other scripts keep their marks"""
+    kept = []
+    for ch in unicodedata.normalize("NFKD", text or ""):
+        # Below U+0250 is Latin; a vowel sign or virama is part of an Indic letter
+        if unicodedata.combining(ch) and kept and kept[-1] < "\u0250":
+            continue
+        kept.append(ch)
+    return "".join(kept).casefold()
+
+
+def is_word_char(ch: str):
+    return ch.isalnum() or unicodedata.category(ch).startswith("M")
+
+
+def tokens(text: str):
+    """Runs of letters, digits and combining marks in the normalized text"""
+    words = []
+    word = []
+    for ch in normalize(text):
+        if is_word_char(ch):
+            word.append(ch)
+        elif word:
+            words.append("".join(word))
+            word = []
+    if word:
+        words.append("".join(word))
+    return words
+
+
+def keys_for(user: User):
+    email = normalize(user.email).strip()
+    local_part = email.split("@")[0]
+    keys = set(tokens(user.name)) | set(tokens(local_part))
+    if email:
+        keys.add(email)
+    return sorted(k[:KEY_LENGTH] for k in keys)
+
+
+def key_rows(user: User):
+    return [
+        {
+            "user_id": user.id,
+            "search_key": key,
+            "role": user.role,
+            "board": user.board,
+            "student_class": user.student_class,
+        }
+        for key in keys_for(user)
+    ]
+
+
+def index_user(db: Session, user: User):
+    """Write a user's search keys; the user must have an id. The caller commits"""
+    remove_user(db, user.id)
+    db.bulk_insert_mappings(UserSearchKey, key_rows(user))
+
+
+def remove_user(db: Session, user_id: int):
+    db.query(UserSearchKey).filter(UserSearchKey.user_id == user_id).delete(synchronize_session=False)
+
+
+def backfill(db: Session = None, rebuild: bool = False):
+    """Index users that have no keys yet (or everyone, with rebuild); returns how many were indexed"""
+    own_session = db is None
+    db = db or SessionLocal()
+    try:
+        if rebuild:
+            db.query(UserSearchKey).delete(synchronize_session=False)
+            db.commit()
+        indexed = 0
+        after_id = 0
+        while True:
+            users = db.query(User).filter(
+                User.id > after_id,
+                ~exists().where(UserSearchKey.user_id == User.id),
+            ).order_by(User.id).limit(BACKFILL_BATCH_SIZE).all()
+            if not users:
+                return indexed
+            db.bulk_insert_mappings(UserSearchKey, [row for u in users for row in key_rows(u)])
+            db.commit()
+            indexed += len(users)
+            after_id = users[-1].id
+    finally:
+        if own_session:
+            db.close()
+
+
+def _logged_backfill():
+    try:
+        indexed = backfill()
+        if indexed:
+            print(f"Indexed {indexed} users for search")
+    except Exception as e:
+        print(f"User search backfill failed: {e}")
+
+
+def start_backfill():
+    threading.Thread(target=_logged_backfill, name="user-search-backfill", daemon=True).start()
+
+
+def query_tokens(q: str):
+    """Search terms for q; an email-looking query is kept whole so it matches the email key"""
+    q = normalize(q).strip()
+    if "@" in q:
+        return [q[:KEY_LENGTH]]
+    return [t[:KEY_LENGTH] for t in tokens(q)][:MAX_QUERY_TOKENS]
+
+
+def prefix_end(prefix: str):
+    """Smallest string greater than every string starting with prefix"""
+    return prefix[:-1] + chr(ord(prefix[-1]) + 1)
+
+
+def prefix_filter(column, prefix: str):
+    # A range rather than LIKE, so both SQLite and MySQL scan the index
+    return column >= prefix, column < prefix_end(prefix)
+
+
+def search(db: Session, q: str, role: str = None, board: str = None, student_class: str = None, limit: int = 20):
+    """Users with a key starting with every term of q, in key order, at most limit of them"""
+    terms = query_tokens(q)
+    if not terms:
+        return []
+
+    # Drive the scan with the longest term, the most selective range; the others must also match
+    terms.sort(key=len, reverse=True)
+    lead, rest = terms[0], terms[1:]
+    filters = list(prefix_filter(UserSearchKey.search_key, lead))
+    if role is not None:
+        # Older student accounts carry the "user" role
+        filters.append(UserSearchKey.role.in_(["student", "user"] if role == "student" else [role]))
+    if board is not None:
+        filters.append(UserSearchKey.board == board)
+    if student_class is not None:
+        filters.append(UserSearchKey.student_class == student_class)
+    for term in rest:
+        other = UserSearchKey.__table__.alias()
+        filters.append(exists().where(other.c.user_id == UserSearchKey.user_id, *prefix_filter(other.c.search_key, term)))
+
+    # A user can match through several keys; page through the index until limit distinct users are found
+    found = []
+    seen = set()
+    after = None
+    while len(found) < limit:
+        query = db.query(UserSearchKey.search_key, UserSearchKey.user_id).filter(*filters)
+        if after is not None:
+            query = query.filter(
+                (UserSearchKey.search_key > after[0]) | ((UserSearchKey.search_key == after[0]) & (UserSearchKey.user_id > after[1]))
+            )
+        rows = query.order_by(UserSearchKey.search_key, UserSearchKey.user_id).limit(limit * 2).all()
+        for key, user_id in rows:
+            if user_id not in seen:
+                seen.add(user_id)
+                found.append(user_id)
+        if len(rows) < limit * 2:
+            break
+        after = rows[-1]
+
+    found = found[:limit]
+    users = {u.id: u for u in db.query(User).filter(User.id.in_(found)).all()} if found else {}
+    return [users[user_id] for user_id in found if user_id in users]
+
+
+if __name__ == "__main__":
+    print(f"Indexed {backfill(rebuild=True)} users for search")
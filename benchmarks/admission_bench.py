@@ -0,0 +1,133 @@
+# Load test for app.admission: floods the server with expensive admin
+# listings (low priority) while a few clients keep logging in (critical), once
+# with admission control off and once on. Reports latency and 503s per route.
+# The users table is seeded so /admin/students is slow.
+#
+#   python -m benchmarks.admission_bench [capacity] [seconds] [admin clients] [login clients]
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+import statistics
+
+import httpx
+
+PORT = 8766
+SEED_USERS = 20000
+LOGIN = {"email": "bench@example.com", "password": "bench-password"}
+
+
+def seed(database_url: str):
+    env = {**os.environ, "DATABASE_URL": database_url}
+    script = (
+        "from app.database import SessionLocal, engine, Base\n"
+        "from app import models\n"
+        "Base.metadata.create_all(bind=engine)\n"
+        "db = SessionLocal()\n"
+        f"db.bulk_insert_mappings(models.User, [dict(name=f'Student {{i}}', email=f's{{i}}@example.com', password='x',"
+        f" role='student', board='PSEB', student_class=str(i % 12 + 1)) for i in range({SEED_USERS})])\n"
+        "db.commit()\n"
+    )
+    subprocess.run([sys.executable, "-c", script], env=env, check=True)
+
+
+def start_server(database_url: str, capacity: int):
+    env = {**os.environ, "DATABASE_URL": database_url, "ADMISSION_CAPACITY": str(capacity)}
+    command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(PORT), "--log-level", "warning"]
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    deadline = time.monotonic() + 60
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{PORT}/").status_code == 200:
+                return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError("server did not start")
+
+
+async def run_load(seconds: float, admin_clients: int, login_clients: int, admin_token: str):
+    results = {"GET /admin/students": [], "POST /login": []}
+    shed = {route: 0 for route in results}
+    errors = {route: 0 for route in results}
+    stop_at = time.monotonic() + seconds
+
+    async def client_loop(client, route, method, path, **kwargs):
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            try:
+                response = await client.request(method, path, **kwargs)
+            except httpx.TimeoutException:
+                errors[route] += 1
+                continue
+            if response.status_code == 503:
+                shed[route] += 1
+                # Honour Retry-After like a well-behaved client, within the test window
+                await asyncio.sleep(min(float(response.headers.get("retry-after", "1")), 1.0))
+            elif response.status_code == 200:
+                results[route].append(time.perf_counter() - start)
+            else:
+                errors[route] += 1
+
+    headers = {"Authorization": f"Bearer {admin_token}"}
+    limits = httpx.Limits(max_connections=admin_clients + login_clients)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=30) as client:
+        await asyncio.gather(
+            *(client_loop(client, "GET /admin/students", "GET", "/admin/students", headers=headers) for _ in range(admin_clients)),
+            *(client_loop(client, "POST /login", "POST", "/login", json=LOGIN) for _ in range(login_clients)),
+        )
+
+    summary = {}
+    for route, latencies in results.items():
+        latencies.sort()
+        summary[route] = {
+            "ok": len(latencies),
+            "p50": statistics.median(latencies) * 1000 if latencies else 0,
+            "p95": latencies[max(0, int(len(latencies) * 0.95) - 1)] * 1000 if latencies else 0,
+            "shed": shed[route],
+            "errors": errors[route],
+        }
+    return summary
+
+
+def main():
+    capacity = int(sys.argv[1]) if len(sys.argv) > 1 else 8
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 15
+    admin_clients = int(sys.argv[3]) if len(sys.argv) > 3 else 24
+    login_clients = int(sys.argv[4]) if len(sys.argv) > 4 else 4
+
+    print(f"{os.cpu_count()} CPUs, {seconds:.0f}s per case, {admin_clients} admin + {login_clients} login clients, "
+          f"{SEED_USERS} users")
+    print(f"{'admission':<16}{'route':<22}{'ok':>7}{'p50 ms':>10}{'p95 ms':>10}{'503s':>7}{'errors':>8}")
+    for label, cap in (("off", 0), (f"capacity {capacity}", capacity)):
+        with tempfile.TemporaryDirectory() as tmp:
+            database_url = f"sqlite:///{tmp}/bench.db"
+            seed(database_url)
+            process = start_server(database_url, cap)
+            try:
+                from app.admin_config import ADMIN_EMAIL, ADMIN_PASSWORD
+
+                httpx.post(f"http://127.0.0.1:{PORT}/register", json={**LOGIN, "name": "Bench", "role": "student"})
+                admin_token = httpx.post(f"http://127.0.0.1:{PORT}/login", json={
+                    "email": ADMIN_EMAIL, "password": ADMIN_PASSWORD,
+                }).json()["access_token"]
+                summary = asyncio.run(run_load(seconds, admin_clients, login_clients, admin_token))
+                for route, r in summary.items():
+                    print(f"{label:<16}{route:<22}{r['ok']:>7}{r['p50']:>10.1f}{r['p95']:>10.1f}{r['shed']:>7}{r['errors']:>8}")
+                if cap:
+                    metrics = httpx.get(f"http://127.0.0.1:{PORT}/admin/admission", headers={
+                        "Authorization": f"Bearer {admin_token}",
+                    }).json()
+                    for name, stats in metrics["classes"].items():
+                        print(f"{'':<16}{name:<22}admitted {stats['admitted']}, shed {stats['shed']}, "
+                              f"queue p95 {stats['queue_delay_p95_ms']} ms")
+            finally:
+                process.terminate()
+                process.wait(timeout=30)
+
+
+if __name__ == "__main__":
+    main()
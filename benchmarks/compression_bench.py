@@ -0,0 +1,90 @@
+# Bytes on the wire and CPU per request for a large JSON listing,
+# uncompressed vs gzip vs brotli, cold (compressed every time) vs cached.
+# The middleware is driven directly over ASGI with a pre-serialized body,
+# so the numbers are the compression cost alone.
+#
+#   python -m benchmarks.compression_bench [students] [requests]
+
+import sys
+import json
+import time
+import random
+import asyncio
+
+from app import compression
+
+
+def build_body(count: int):
+    boards = ["PSEB", "CBSE", "ICSE", "Other"]
+    return json.dumps({
+        "students": [
+            {
+                "id": i,
+                "name": f"Student {i}",
+                "email": f"student{i}@example.com",
+                "role": "student",
+                "board": random.choice(boards),
+                "student_class": str(random.randint(1, 12)),
+                "avatar": "S",
+            }
+            for i in range(count)
+        ]
+    }).encode()
+
+
+def make_app(body: bytes):
+    async def app(scope, receive, send):
+        await send({
+            "type": "http.response.start",
+            "status": 200,
+            "headers": [(b"content-type", b"application/json"), (b"content-length", str(len(body)).encode())],
+        })
+        await send({"type": "http.response.body", "body": body})
+    return app
+
+
+async def request(app, accept_encoding: str):
+    scope = {"type": "http", "method": "GET", "path": "/admin/students", "headers": [(b"accept-encoding", accept_encoding.encode())]}
+    sent = []
+
+    async def receive():
+        return {"type": "http.request", "body": b""}
+
+    async def send(message):
+        sent.append(message)
+
+    await app(scope, receive, send)
+    return sum(len(m.get("body", b"")) for m in sent if m["type"] == "http.response.body")
+
+
+async def run(app, accept_encoding, requests, cached):
+    size = 0
+    cpu_start = time.process_time()
+    for _ in range(requests):
+        if not cached:
+            compression.cache = compression.CompressedCache(compression.COMPRESSION_CACHE_BYTES)
+        size = await request(app, accept_encoding)
+    return size, (time.process_time() - cpu_start) / requests * 1000
+
+
+def main():
+    students = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    requests = int(sys.argv[2]) if len(sys.argv) > 2 else 50
+
+    random.seed(0)
+    body = build_body(students)
+    app = compression.CompressionMiddleware(make_app(body))
+
+    cases = [("identity", "identity", False), ("gzip", "gzip", False), ("gzip cached", "gzip", True)]
+    if compression.brotli is not None:
+        cases += [("br", "br", False), ("br cached", "br", True)]
+
+    print(f"{students} students, {len(body)} bytes of JSON, {requests} requests per case")
+    print(f"{'encoding':<14}{'bytes':>12}{'ratio':>8}{'cpu ms/req':>14}")
+    for label, accept_encoding, cached in cases:
+        size, cpu = asyncio.run(run(app, accept_encoding, requests, cached))
+        print(f"{label:<14}{size:>12}{size / len(body):>8.2f}{cpu:>14.3f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+# Throughput of the single uvicorn process (old Procfile) vs the gunicorn
+# launcher in app.server, on a CPU-bound route (/login runs PBKDF2) and a
+# trivial one. Each server gets a fresh SQLite database with one student.
+# The load generator runs on the same machine, so leave it a core. The
+# multi-worker case needs the redis package (not a running server).
+#
+#   python -m benchmarks.serving_bench [workers] [seconds] [concurrency]
+
+import os
+import sys
+import time
+import asyncio
+import tempfile
+import subprocess
+import statistics
+
+import httpx
+
+PORT = 8765
+
+
+def start_server(kind: str, workers: int, database_url: str):
+    env = {**os.environ, "DATABASE_URL": database_url, "PORT": str(PORT), "WEB_CONCURRENCY": str(workers)}
+    if kind == "single":
+        command = [sys.executable, "-m", "uvicorn", "app.main:app", "--host", "127.0.0.1", "--port", str(PORT), "--log-level", "warning"]
+    else:
+        env["GUNICORN_PID_FILE"] = os.path.join(tempfile.gettempdir(), "serving-bench.pid")
+        # app.server refuses several workers without a shared broker; these routes never publish
+        env["EVENTS_BROKER"] = "redis"
+        command = [sys.executable, "-m", "app.server"]
+    process = subprocess.Popen(command, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            if httpx.get(f"http://127.0.0.1:{PORT}/").status_code == 200:
+                return process
+        except httpx.TransportError:
+            time.sleep(0.2)
+    process.kill()
+    raise RuntimeError(f"{kind} server did not start")
+
+
+def stop_server(process):
+    process.terminate()
+    try:
+        process.wait(timeout=30)
+    except subprocess.TimeoutExpired:
+        process.kill()
+
+
+async def load(method: str, path: str, body, seconds: float, concurrency: int):
+    latencies = []
+    errors = 0
+    stop_at = time.monotonic() + seconds
+
+    async def client_loop(client):
+        nonlocal errors
+        while time.monotonic() < stop_at:
+            start = time.perf_counter()
+            response = await client.request(method, path, json=body)
+            latencies.append(time.perf_counter() - start)
+            if response.status_code != 200:
+                errors += 1
+
+    limits = httpx.Limits(max_connections=concurrency)
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{PORT}", limits=limits, timeout=60) as client:
+        await asyncio.gather(*(client_loop(client) for _ in range(concurrency)))
+
+    latencies.sort()
+    return {
+        "rps": len(latencies) / seconds,
+        "p50": statistics.median(latencies) * 1000,
+        "p95": latencies[int(len(latencies) * 0.95) - 1] * 1000,
+        "errors": errors,
+    }
+
+
+def main():
+    workers = int(sys.argv[1]) if len(sys.argv) > 1 else max(2, (os.cpu_count() or 1))
+    seconds = float(sys.argv[2]) if len(sys.argv) > 2 else 10
+    concurrency = int(sys.argv[3]) if len(sys.argv) > 3 else 16
+
+    login = {"email": "bench@example.com", "password": "bench-password"}
+    routes = [("GET /", "GET", "/", None), ("POST /login", "POST", "/login", login)]
+
+    print(f"{os.cpu_count()} CPUs, {seconds:.0f}s per case, {concurrency} concurrent clients")
+    print(f"{'server':<22}{'route':<14}{'req/s':>10}{'p50 ms':>10}{'p95 ms':>10}{'errors':>8}")
+    for kind, label in (("single", "uvicorn x1"), ("gunicorn", f"app.server x{workers}")):
+        with tempfile.TemporaryDirectory() as tmp:
+            process = start_server(kind, workers, f"sqlite:///{tmp}/bench.db")
+            try:
+                httpx.post(f"http://127.0.0.1:{PORT}/register", json={**login, "name": "Bench", "role": "student"})
+                for route, method, path, body in routes:
+                    result = asyncio.run(load(method, path, body, seconds, concurrency))
+                    print(f"{label:<22}{route:<14}{result['rps']:>10.1f}{result['p50']:>10.1f}{result['p95']:>10.1f}{result['errors']:>8}")
+            finally:
+                stop_server(process)
+
+
+if __name__ == "__main__":
+    main()
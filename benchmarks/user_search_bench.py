@@ -0,0 +1,95 @@
+# Latency of the admin typeahead (app.user_search) against a large users
+# table, next to the sorted LIKE '%q%' scan an unindexed lookup would need.
+# Seeds a fresh SQLite database with synthetic users first.
+#
+#   python -m benchmarks.user_search_bench [users] [queries]
+
+import os
+import sys
+import time
+import random
+import tempfile
+import statistics
+
+FIRST_NAMES = ["aarav", "priya", "ravi", "simran", "harpreet", "gurpreet", "aman", "neha", "karan", "jaspreet",
+               "rohit", "anjali", "manpreet", "vikram", "pooja", "arjun", "navneet", "sandeep", "kiran", "deepak"]
+LAST_NAMES = ["kumar", "sharma", "singh", "kaur", "verma", "gupta", "sidhu", "gill", "dhillon", "sandhu",
+              "mehta", "bansal", "grewal", "brar", "malhotra", "chopra", "arora", "bhatia", "saini", "joshi"]
+BOARDS = ["PSEB", "CBSE", "ICSE"]
+
+
+def seed(db, count: int):
+    from app.models import User
+    from app import user_search
+
+    rng = random.Random(7)
+    batch = []
+    for i in range(1, count + 1):
+        first, last = rng.choice(FIRST_NAMES), rng.choice(LAST_NAMES)
+        batch.append({
+            "id": i,
+            "name": f"{first.title()} {last.title()}",
+            "email": f"{first}.{last}{i}@example.com",
+            "password": "x",
+            "role": "student",
+            "board": rng.choice(BOARDS),
+            "student_class": str(rng.randint(1, 12)),
+        })
+        if len(batch) == 10000:
+            db.bulk_insert_mappings(User, batch)
+            db.commit()
+            batch = []
+    if batch:
+        db.bulk_insert_mappings(User, batch)
+        db.commit()
+    start = time.perf_counter()
+    user_search.backfill(db)
+    return time.perf_counter() - start
+
+
+def timed(fn, runs: int):
+    latencies = []
+    for _ in range(runs):
+        start = time.perf_counter()
+        fn()
+        latencies.append((time.perf_counter() - start) * 1000)
+    latencies.sort()
+    return statistics.median(latencies), latencies[int(len(latencies) * 0.95) - 1]
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 300000
+    runs = int(sys.argv[2]) if len(sys.argv) > 2 else 200
+
+    tmp = tempfile.mkdtemp()
+    os.environ["DATABASE_URL"] = f"sqlite:///{tmp}/bench.db"
+    from app.database import SessionLocal, engine, Base
+    from app.models import User
+    from app import user_search
+
+    Base.metadata.create_all(bind=engine)
+    db = SessionLocal()
+    print(f"Seeding {count} users ...")
+    print(f"Indexed search keys in {seed(db, count):.1f}s")
+
+    cases = [
+        ("prefix 'ra'", "ra", {}),
+        ("prefix 'harp'", "harp", {}),
+        ("two words 'ravi sh'", "ravi sh", {}),
+        ("'gill' board+class", "gill", {"board": "CBSE", "student_class": "9"}),
+        ("email 'priya.kaur12'", "priya.kaur12", {}),
+    ]
+    print(f"{'query':<26}{'typeahead p50':>15}{'p95':>8}{'LIKE scan p50':>16}")
+    for label, q, filters in cases:
+        p50, p95 = timed(lambda: user_search.search(db, q, limit=20, **filters), runs)
+        like = f"%{q.split()[0]}%"
+        scan = db.query(User).filter((User.name.ilike(like)) | (User.email.ilike(like)))
+        for column, value in filters.items():
+            scan = scan.filter(getattr(User, column) == value)
+        scan_p50, _ = timed(lambda: scan.order_by(User.name).limit(20).all(), max(3, runs // 50))
+        print(f"{label:<26}{p50:>12.2f} ms{p95:>6.2f}{scan_p50:>13.1f} ms")
+    db.close()
+
+
+if __name__ == "__main__":
+    main()